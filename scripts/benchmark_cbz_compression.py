@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+基准测试脚本：对比 CBZ 打包时图片 deflate 压缩与不压缩存储（ZIP_STORED）的耗时和文件大小
+
+- deflate: 改造前的行为，所有条目（包括图片）都使用 ZIP_DEFLATED
+- stored:  默认压缩策略，只压缩 XML/JSON，图片原样存储
+
+对语料目录中的每个画廊（ZIP/CBZ/7z 压缩包或图片文件夹）分别用两种策略执行 write_xml_to_zip，
+统计打包耗时、输出大小以及顺序读取全部页面的耗时（模拟阅读器打开文件）
+
+ZIP/CBZ 输入会先解压并以 ZIP_STORED 重新写入工作目录（不计入耗时）：否则输入中已经 deflate 的条目会被按原始数据复制，
+deflate 策略实际上没有重新压缩，耗时被低估
+
+用法: python scripts/benchmark_cbz_compression.py <语料目录> [--rounds 3]
+"""
+import sys
+import os
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+
+# 添加父目录到路径以便导入模块
+sys.path.append('src')
+
+import cbztool
+
+POLICIES = (
+    ('deflate', [ext.lstrip('.') for ext in cbztool.image_exts] + list(cbztool.DEFAULT_DEFLATE_FORMATS)),
+    ('stored', list(cbztool.DEFAULT_DEFLATE_FORMATS)),
+)
+
+
+def find_galleries(corpus):
+    galleries = []
+    for name in sorted(os.listdir(corpus)):
+        path = os.path.join(corpus, name)
+        if os.path.isdir(path) or name.lower().endswith(('.zip', '.cbz', '.7z')):
+            galleries.append(path)
+    return galleries
+
+
+def copy_stored(source, target):
+    """解压每个条目并以 ZIP_STORED 写入 target，保证两种策略都从未压缩的数据开始打包"""
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(target, 'w', zipfile.ZIP_STORED) as dst:
+        for info in src.infolist():
+            if info.is_dir():
+                continue
+            dst.writestr(info.filename, src.read(info), compress_type=zipfile.ZIP_STORED)
+
+
+def package(gallery, workdir, deflate_formats):
+    """复制画廊到工作目录后打包，返回 (打包耗时, 输出大小, 读取耗时)"""
+    target = os.path.join(workdir, os.path.basename(gallery))
+    if os.path.isdir(gallery):
+        shutil.copytree(gallery, target)
+    elif gallery.lower().endswith(('.zip', '.cbz')):
+        # 输出文件名为 <名称>.cbz，输入统一改名为 .zip 避免与输出冲突
+        target = os.path.splitext(target)[0] + '.zip'
+        copy_stored(gallery, target)
+    else:
+        shutil.copyfile(gallery, target)
+
+    start = time.perf_counter()
+    cbz = cbztool.write_xml_to_zip(target, {'Title': os.path.basename(gallery)},
+                                   keep_original=False, remove_ads=False, deflate_formats=deflate_formats)
+    elapsed = time.perf_counter() - start
+    if not cbz:
+        return None
+
+    start = time.perf_counter()
+    with zipfile.ZipFile(cbz) as archive:
+        for info in archive.infolist():
+            archive.read(info)
+    read_elapsed = time.perf_counter() - start
+
+    size = os.path.getsize(cbz)
+    os.remove(cbz)
+    return elapsed, size, read_elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CBZ 图片压缩策略基准测试")
+    parser.add_argument('corpus', help="画廊语料目录（包含 ZIP/CBZ/7z 压缩包或图片文件夹）")
+    parser.add_argument('--rounds', type=int, default=3, help="每个画廊每种策略的重复次数，取最快一次")
+    args = parser.parse_args()
+
+    galleries = find_galleries(args.corpus)
+    if not galleries:
+        print(f"{args.corpus} 中没有找到画廊")
+        return
+
+    totals = {name: [0.0, 0, 0.0] for name, _ in POLICIES}
+    with tempfile.TemporaryDirectory() as tmp:
+        for gallery in galleries:
+            results = {}
+            for name, deflate_formats in POLICIES:
+                best = None
+                for _ in range(args.rounds):
+                    result = package(gallery, tmp, deflate_formats)
+                    if result and (best is None or result[0] < best[0]):
+                        best = result
+                if best is None:
+                    break
+                results[name] = best
+            # 只统计两种策略都打包成功的画廊，保证总计可以直接比较
+            if len(results) != len(POLICIES):
+                print(f"{os.path.basename(gallery)[:40]:<40} | 打包失败，跳过")
+                continue
+            line = []
+            for name, best in results.items():
+                for i, value in enumerate(best):
+                    totals[name][i] += value
+                line.append(f"{name} {best[0]:7.2f}s {best[1] / 1024 / 1024:8.2f}MiB 读取 {best[2]:6.2f}s")
+            print(f"{os.path.basename(gallery)[:40]:<40} | " + " | ".join(line))
+
+    print()
+    for name, (elapsed, size, read_elapsed) in totals.items():
+        print(f"{name:>8}: 打包 {elapsed:8.2f}s  大小 {size / 1024 / 1024:10.2f}MiB  读取 {read_elapsed:8.2f}s")
+    deflate, stored = totals['deflate'], totals['stored']
+    if stored[0] and deflate[1]:
+        print(f"打包加速比: {deflate[0] / stored[0]:.2f}x  大小变化: {(stored[1] - deflate[1]) / deflate[1] * 100:+.2f}%")
+
+
+if __name__ == '__main__':
+    main()
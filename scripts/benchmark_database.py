@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+基准测试脚本：对比 TaskDatabase 连接层改造前后的并发吞吐量
+
+- legacy: 每次操作新建连接（默认 DELETE 日志模式），读写都持有全局锁，每次更新立即提交
+- pooled: 线程复用 WAL 长连接，读操作无锁，进度更新经写缓冲批量落盘
+
+用法: python scripts/benchmark_database.py [--tasks 2000] [--threads 8] [--seconds 5]
+"""
+import sys
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+import random
+
+# 添加父目录到路径以便导入模块
+sys.path.append('src')
+
+# 导入 database 时会创建全局实例，指向临时目录，避免在当前目录下生成 data/tasks.db
+_singleton_dir = tempfile.TemporaryDirectory()
+os.environ.setdefault('TASK_DB_PATH', os.path.join(_singleton_dir.name, 'tasks.db'))
+
+from database import TaskDatabase
+
+
+class LegacyTaskDatabase(TaskDatabase):
+    """模拟改造前的行为：每次调用新建连接，读操作同样持有全局锁，更新不经过写缓冲"""
+
+    def _get_conn(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = DELETE')
+        return conn
+
+    def update_task(self, task_id, **kwargs):
+        super().update_task(task_id, **kwargs)
+        return self.flush()
+
+    def get_task(self, task_id):
+        with self.lock:
+            return super().get_task(task_id)
+
+    def get_tasks(self, *args, **kwargs):
+        with self.lock:
+            return super().get_tasks(*args, **kwargs)
+
+
+def seed(db, count):
+    for i in range(count):
+        db.add_task(f"task-{i}", status="completed", filename=f"gallery_{i}.cbz",
+                    url=f"https://e-hentai.org/g/{i}/token{i}/")
+
+
+def run(db, task_count, threads, seconds):
+    ops = [0] * threads
+    stop = threading.Event()
+
+    def worker(index):
+        rnd = random.Random(index)
+        while not stop.is_set():
+            task_id = f"task-{rnd.randrange(task_count)}"
+            if index % 4 == 0:
+                # 每 4 个线程中有 1 个模拟下载线程的进度写入
+                db.update_task(task_id, progress=rnd.randrange(100), speed=rnd.randrange(1 << 20))
+            elif rnd.random() < 0.5:
+                db.get_tasks(page=rnd.randrange(1, 10), page_size=20)
+            else:
+                db.get_task(task_id)
+            ops[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in workers:
+        t.join()
+    return sum(ops) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TaskDatabase 并发吞吐量基准测试")
+    parser.add_argument('--tasks', type=int, default=2000, help="预置任务数量")
+    parser.add_argument('--threads', type=int, default=8, help="并发线程数")
+    parser.add_argument('--seconds', type=float, default=5, help="每轮测试时长（秒）")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, cls in (('legacy', LegacyTaskDatabase), ('pooled', TaskDatabase)):
+            db = cls(os.path.join(tmp, f"{name}.db"))
+            seed(db, args.tasks)
+            results[name] = run(db, args.tasks, args.threads, args.seconds)
+            print(f"{name:>8}: {results[name]:10.1f} ops/s")
+
+    if results['legacy']:
+        print(f"加速比: {results['pooled'] / results['legacy']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+批量任务作业
+对大量已完成任务执行重新打包、移动、写入元数据等文件操作：作业中的每个任务在共享线程池中执行，
+作业记录处理进度和失败原因，全部任务结束后调用一次 on_finish（如触发一次 Komga 媒体库扫描）
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class BulkJobStatus:
+    RUNNING = "running"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+
+
+class BulkJob:
+    """单个批量作业的进度：每个任务的操作返回 True 表示修改了文件，False 表示无需处理（跳过）"""
+
+    # 最多记录的失败原因条数
+    MAX_ERRORS = 500
+
+    def __init__(self, actions: List[str], task_ids: List[str]):
+        self.id = uuid.uuid4().hex[:12]
+        self.actions = actions
+        self.task_ids = task_ids
+        self.status = BulkJobStatus.RUNNING
+        self.succeeded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors: Dict[str, str] = {}
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        return len(self.task_ids)
+
+    @property
+    def processed(self) -> int:
+        return self.succeeded + self.skipped + self.failed
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'id': self.id,
+                'actions': self.actions,
+                'status': self.status,
+                'total': self.total,
+                'processed': self.processed,
+                'succeeded': self.succeeded,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'errors': dict(self.errors),
+                'created_at': self.created_at,
+                'finished_at': self.finished_at
+            }
+
+
+class BulkJobManager:
+    def __init__(self, workers: int = 4, keep: int = 50):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='BulkJob')
+        self.keep = keep
+        self._jobs: Dict[str, BulkJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, actions: List[str], task_ids: Iterable[str], operation: Callable[[str], bool],
+               on_finish: Optional[Callable[[BulkJob], None]] = None) -> BulkJob:
+        """
+        创建作业并开始执行
+
+        operation(task_id) 在线程池中执行，返回是否修改了文件，抛出异常时记为失败；
+        on_finish(job) 在最后一个任务结束（或作业取消后剩余任务被跳过）后调用一次
+        """
+        job = BulkJob(actions, list(dict.fromkeys(str(task_id) for task_id in task_ids)))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+        remaining = [job.total]
+
+        def run(task_id):
+            if job.cancelled.is_set():
+                outcome, error = None, None
+            else:
+                try:
+                    outcome, error = bool(operation(task_id)), None
+                except Exception as e:
+                    outcome, error = None, str(e) or type(e).__name__
+            with job._lock:
+                if error is not None:
+                    job.failed += 1
+                    if len(job.errors) < BulkJob.MAX_ERRORS:
+                        job.errors[task_id] = error
+                elif outcome:
+                    job.succeeded += 1
+                else:
+                    job.skipped += 1
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._finish(job, on_finish)
+
+        if not job.task_ids:
+            self._finish(job, on_finish)
+        for task_id in job.task_ids:
+            self.executor.submit(run, task_id)
+        return job
+
+    def _finish(self, job: BulkJob, on_finish):
+        try:
+            if on_finish:
+                on_finish(job)
+        finally:
+            with job._lock:
+                job.status = BulkJobStatus.CANCELLED if job.cancelled.is_set() else BulkJobStatus.COMPLETED
+                job.finished_at = time.time()
+
+    def _prune(self):
+        """只保留最近 keep 个已结束的作业"""
+        finished = sorted((job for job in self._jobs.values() if job.finished_at),
+                          key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[BulkJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[BulkJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[BulkJob]:
+        """取消作业：正在执行的任务会执行完，尚未开始的任务被跳过"""
+        job = self.get(job_id)
+        if job:
+            job.cancelled.set()
+        return job
+
+
+bulk_jobs = BulkJobManager()
@@ -1,6 +1,11 @@
 import zipfile, os
+import io
 import shutil
+import struct
+import sys
 import tempfile
+import threading
+import weakref
 from xml.dom.minidom import parseString
 import dicttoxml
 from utils import check_dirs
@@ -10,6 +15,20 @@ import detectAd
 import re
 import py7zr
 
+# 打包进 CBZ 的图片扩展名
+image_exts = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.jxl')
+
+# CBZ 中需要 deflate 压缩的格式，其余条目（已压缩的图片）以 ZIP_STORED 原样存储
+DEFAULT_DEFLATE_FORMATS = ('xml', 'json')
+
+def compress_type_for(name, deflate_formats=None):
+    """按扩展名返回条目的压缩方式，deflate_formats 为需要压缩的扩展名列表（如 ['xml', 'json']），None 时使用默认值"""
+    if deflate_formats is None:
+        deflate_formats = DEFAULT_DEFLATE_FORMATS
+    ext = os.path.splitext(name)[1].lstrip('.').lower()
+    formats = {str(fmt).strip().lstrip('.').lower() for fmt in deflate_formats}
+    return zipfile.ZIP_DEFLATED if ext in formats else zipfile.ZIP_STORED
+
 # 广告文件名正则列表
 ad_file_pattern = re.compile(
     r'('
@@ -30,15 +49,98 @@ def make_comicinfo_xml(metadata):
         dicttoxml.dicttoxml(metadata, custom_root='ComicInfo', attr_type=False)
     ).toprettyxml(indent="  ", encoding="UTF-8")
 
-def update_comicinfo_in_cbz(cbz_path, metadata, logger=None):
+# 追加更新 ComicInfo.xml 会在文件中留下旧条目和旧中央目录，
+# 失效数据超过文件大小的 COMPACT_RATIO 且不少于 COMPACT_MIN_BYTES 时重写整个 CBZ 回收空间
+COMPACT_RATIO = 0.1
+COMPACT_MIN_BYTES = 64 * 1024
+
+# 同一 CBZ 的追加更新和重写互斥，避免并发修改同一文件的中央目录；不同文件互不阻塞
+_cbz_locks = weakref.WeakValueDictionary()  # CBZ 路径 -> 锁，没有线程使用时自动移除
+_cbz_locks_lock = threading.Lock()
+
+def _cbz_lock(cbz_path):
+    key = os.path.realpath(cbz_path)
+    with _cbz_locks_lock:
+        lock = _cbz_locks.get(key)
+        if lock is None:
+            lock = _cbz_locks[key] = threading.Lock()
+        return lock
+
+def zip_dead_bytes(cbz_path):
+    """估算 ZIP 文件中不被中央目录引用的失效数据字节数（被替换的旧条目、旧中央目录等）"""
+    with zipfile.ZipFile(cbz_path, 'r') as zf:
+        live = 0
+        for info in zf.infolist():
+            live += zipfile.sizeFileHeader + len(info.filename.encode('utf-8')) + len(info.extra) + info.compress_size
+            if info.flag_bits & 0x08:
+                live += 16  # 数据描述符
+        return max(0, zf.start_dir - live)
+
+def compact_cbz(cbz_path, deflate_formats=None):
+    """重写 CBZ，只保留中央目录中的条目（按原始压缩数据复制），写入临时文件后替换原文件"""
+    with _cbz_lock(cbz_path):
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cbz_path), suffix=".cbz", delete=False) as tmp:
+            temp_path = tmp.name
+        try:
+            with zipfile.ZipFile(cbz_path, 'r') as src_zip:
+                with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as dst_zip:
+                    dst_zip.comment = src_zip.comment
+                    for item in src_zip.infolist():
+                        if item.is_dir():
+                            dst_zip.writestr(item, b'')
+                            continue
+                        copy_zip_entry(src_zip, item, dst_zip,
+                                       compress_type=compress_type_for(item.filename, deflate_formats))
+            os.replace(temp_path, cbz_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+def append_comicinfo_to_cbz(cbz_path, xml_content, deflate_formats=None, drop=(), logger=None):
+    """
+    将 ComicInfo.xml 追加写入 CBZ 末尾并只重写中央目录，同时从中央目录中移除旧的 ComicInfo.xml 和 drop 中的条目
+
+    被移除的条目成为失效数据，超过阈值时调用 compact_cbz 重写整个文件；写入后清除压缩包注释（PENDING_CBZ_COMMENT 标记）
+    """
+    drop = set(drop)
+    with _cbz_lock(cbz_path):
+        with zipfile.ZipFile(cbz_path, 'a') as zf:
+            for item in [item for item in zf.infolist()
+                         if item.filename.lower() == 'comicinfo.xml' or item.filename in drop]:
+                zf.filelist.remove(item)
+                zf.NameToInfo.pop(item.filename, None)
+
+            # 新条目写在原中央目录之后而不是覆盖它：写入中途出错时，
+            # 文件末尾附近仍保留完整的旧中央目录，阅读器依然可以打开
+            zf.fp.seek(0, os.SEEK_END)
+            zf.start_dir = zf.fp.tell()
+            zf.comment = b''
+            zf.writestr("ComicInfo.xml", xml_content,
+                        compress_type=compress_type_for("ComicInfo.xml", deflate_formats))
+
+        dead_bytes = zip_dead_bytes(cbz_path)
+        size = os.path.getsize(cbz_path)
+
+    # 重写在追加完成、释放锁之后进行，compact_cbz 自行获取该文件的锁
+    if dead_bytes > max(COMPACT_MIN_BYTES, size * COMPACT_RATIO):
+        if logger:
+            logger.info(f"CBZ 失效数据 {dead_bytes} 字节，重写文件: {cbz_path}")
+        compact_cbz(cbz_path, deflate_formats)
+
+def update_comicinfo_in_cbz(cbz_path, metadata, logger=None, deflate_formats=None):
     """
     仅更新 CBZ 文件中的 ComicInfo.xml，不重新处理图片。
     适用于元数据编辑后的快速重新打包场景。
 
+    新的 ComicInfo.xml 追加写入文件末尾，只重写中央目录，旧条目成为失效数据；
+    失效数据超过阈值时调用 compact_cbz 重写整个文件。
+
     Args:
         cbz_path: CBZ 文件的路径
         metadata: ComicInfo 元数据字典
         logger: 可选的日志记录器
+        deflate_formats: 需要 deflate 压缩的扩展名列表，None 时使用 DEFAULT_DEFLATE_FORMATS
 
     Returns:
         成功返回 cbz_path，失败返回 None
@@ -55,26 +157,7 @@ def update_comicinfo_in_cbz(cbz_path, metadata, logger=None):
 
     try:
         xml_content = make_comicinfo_xml(metadata)
-        cbz_dir = os.path.dirname(cbz_path)
-
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(dir=cbz_dir, suffix=".cbz", delete=False) as tmp:
-            temp_path = tmp.name
-
-        # 复制原 CBZ 中除 ComicInfo.xml 以外的所有文件，再写入新的 ComicInfo.xml
-        with zipfile.ZipFile(cbz_path, 'r') as src_zip:
-            with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as dst_zip:
-                for item in src_zip.infolist():
-                    if item.filename.lower() == 'comicinfo.xml':
-                        continue  # 跳过旧的 ComicInfo.xml
-                    data = src_zip.read(item.filename)
-                    dst_zip.writestr(item, data)
-
-                # 写入新的 ComicInfo.xml
-                dst_zip.writestr("ComicInfo.xml", xml_content)
-
-        # 替换原文件
-        os.replace(temp_path, cbz_path)
+        append_comicinfo_to_cbz(cbz_path, xml_content, deflate_formats=deflate_formats, logger=logger)
 
         if logger:
             logger.info(f"ComicInfo.xml 已更新: {cbz_path}")
@@ -83,13 +166,130 @@ def update_comicinfo_in_cbz(cbz_path, metadata, logger=None):
     except Exception as e:
         if logger:
             logger.error(f"更新 ComicInfo.xml 失败: {e}")
-        # 清理临时文件
-        if 'temp_path' in locals() and os.path.exists(temp_path):
+        return None
+
+# StreamingCbzWriter 关闭后写入的压缩包注释：页面已完整写入，尚未写入 ComicInfo.xml
+PENDING_CBZ_COMMENT = b'hentai-assistant:pending-comicinfo'
+
+def is_pending_cbz(file_path):
+    """是否为 StreamingCbzWriter 写入、尚未写入 ComicInfo.xml 的 CBZ"""
+    if os.path.isdir(file_path) or not file_path.lower().endswith('.cbz'):
+        return False
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zf:
+            return zf.comment == PENDING_CBZ_COMMENT
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+class StreamingCbzWriter:
+    """
+    页面下载过程中增量写入的 CBZ
+
+    页面可以乱序下载完成：轮到的页面由 add_bytes 直接写入压缩包，只有提前完成、尚未轮到的页面才暂存到 pending_dir 中；
+    close 后压缩包带 PENDING_CBZ_COMMENT 标记，封包时由 write_xml_to_zip 原地删除广告页并追加 ComicInfo.xml，
+    不再需要把整个图片目录复制进新的压缩包
+    """
+
+    def __init__(self, cbz_path, pending_dir, total, logger=None):
+        self.cbz_path = cbz_path
+        self.pending_dir = pending_dir
+        self.total = total
+        self.logger = logger
+        self._next = 1
+        self._pending = {}  # 页码 -> (暂存文件路径, 压缩包内文件名)，文件路径为 None 表示跳过该页
+        self._lock = threading.Lock()
+        self._zip = zipfile.ZipFile(cbz_path, 'w', zipfile.ZIP_STORED)
+
+    def add_bytes(self, index, name, data):
+        """第 index 页（从 1 开始）下载完成：轮到该页时直接写入压缩包，否则暂存到 pending_dir 等待前面的页面"""
+        with self._lock:
+            if index == self._next:
+                self._zip.writestr(name, data, compress_type=compress_type_for(name))
+                self._next += 1
+                self._flush()
+                return
+
+        # 暂存文件在锁外写入，不阻塞其他页面
+        os.makedirs(self.pending_dir, exist_ok=True)
+        path = os.path.join(self.pending_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self._pending[index] = (path, name)
+            self._flush()
+
+    def skip(self, index):
+        """第 index 页不写入压缩包（如无法获取图片地址），不阻塞后续页面"""
+        with self._lock:
+            self._pending[index] = (None, None)
+            self._flush()
+
+    def _flush(self):
+        while self._next in self._pending:
+            path, name = self._pending.pop(self._next)
+            if path:
+                self._zip.write(path, name, compress_type=compress_type_for(name))
+                os.remove(path)
+            self._next += 1
+
+    def close(self):
+        """写入剩余页面并标记为等待写入 ComicInfo.xml，返回 CBZ 路径"""
+        with self._lock:
+            # 正常情况下所有页面都已按顺序写入；如有缺页，剩余页面仍按页码顺序写入
+            for index in sorted(self._pending):
+                path, name = self._pending.pop(index)
+                if path:
+                    self._zip.write(path, name, compress_type=compress_type_for(name))
+                    os.remove(path)
+            self._zip.comment = PENDING_CBZ_COMMENT
+            self._zip.close()
+        shutil.rmtree(self.pending_dir, ignore_errors=True)
+        return self.cbz_path
+
+    def abort(self):
+        """下载失败或取消：删除未完成的 CBZ 和暂存页面"""
+        with self._lock:
             try:
-                os.remove(temp_path)
-            except OSError:
+                self._zip.close()
+            except Exception:
                 pass
-        return None
+            if os.path.exists(self.cbz_path):
+                os.remove(self.cbz_path)
+        shutil.rmtree(self.pending_dir, ignore_errors=True)
+
+def finish_pending_cbz(file_path, xml_content, remove_ads=False, logger=None, deflate_formats=None):
+    """
+    完成 StreamingCbzWriter 写入的 CBZ：原地移除广告页并追加 ComicInfo.xml，返回 CBZ 路径
+
+    页面已按页码顺序以默认压缩策略写入；配置的压缩策略与之不同时重写整个文件
+    """
+    with zipfile.ZipFile(file_path, 'r') as zf:
+        entries = {
+            info.filename: info for info in zf.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(image_exts)
+        }
+        img_files = natsorted(entries, key=lambda name: os.path.basename(name))
+        if not img_files:
+            msg = f"文件 {file_path} 内没有找到有效图片"
+            if logger:
+                logger.warning(msg)
+            else:
+                print(msg)
+            return None
+
+        ad_pages = set()
+        if remove_ads:
+            ad_pages = detect_ad_pages(
+                img_files, lambda name: Image.open(io.BytesIO(zf.read(entries[name]))), logger
+            )
+        needs_rewrite = any(info.compress_type != compress_type_for(name, deflate_formats)
+                            for name, info in entries.items())
+
+    append_comicinfo_to_cbz(file_path, xml_content, deflate_formats=deflate_formats,
+                            drop=[img_files[i] for i in ad_pages], logger=logger)
+    if needs_rewrite:
+        compact_cbz(file_path, deflate_formats)
+    return file_path
 
 def extract_images_only(file_path, temp_dir):
     file_exts = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.avif', '.jxl', '.xml', '.json')
@@ -105,11 +305,130 @@ def extract_images_only(file_path, temp_dir):
                 if name.lower().endswith(file_exts):
                     archive.extract(name, temp_dir)
 
-def write_xml_to_zip(file_path, metadata, app=None, logger=None):
+# 按原始压缩数据复制条目需要用到 zipfile 的内部成员，只在验证过的 Python 版本上启用，
+# 其他版本（或内部成员缺失时）回退为解压后流式写入
+_RAW_ZIP_COPY = (
+    (3, 8) <= sys.version_info[:2] <= (3, 13)
+    and all(hasattr(zipfile, name) for name in ('structFileHeader', 'sizeFileHeader', '_FH_FILENAME_LENGTH', '_FH_EXTRA_FIELD_LENGTH'))
+    and hasattr(zipfile.ZipFile, '_writecheck')
+)
+
+def copy_zip_entry(src_zip, info, tgt_zip, arcname=None, compress_type=None):
+    """
+    将 src_zip 中的条目复制到 tgt_zip，压缩方式相同时按原始压缩数据复制，不解压也不重新压缩
+
+    compress_type 为目标压缩方式，None 表示沿用源条目的压缩方式；
+    压缩方式不同、加密或非 STORED/DEFLATED 的条目（以及不支持原样复制的 Python 版本）解压后按目标压缩方式流式写入
+    """
+    arcname = arcname or info.filename
+    if compress_type is None:
+        compress_type = info.compress_type if info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) else zipfile.ZIP_DEFLATED
+    if not _RAW_ZIP_COPY or info.flag_bits & 0x1 or info.compress_type != compress_type:
+        zinfo = zipfile.ZipInfo(arcname, date_time=info.date_time)
+        zinfo.compress_type = compress_type
+        zinfo.external_attr = info.external_attr
+        zinfo.file_size = info.file_size
+        with src_zip.open(info) as source, tgt_zip.open(zinfo, 'w') as target:
+            shutil.copyfileobj(source, target)
+        return
+
+    # 跳过源文件中的本地文件头，定位到压缩数据
+    src = src_zip.fp
+    src.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, src.read(zipfile.sizeFileHeader))
+    src.seek(info.header_offset + zipfile.sizeFileHeader
+             + header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+    zinfo = zipfile.ZipInfo(arcname, date_time=info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+
+    # 与 ZipFile.write 相同：写入本地文件头和数据后登记到中央目录
+    tgt_zip._writecheck(zinfo)
+    tgt_zip._didModify = True
+    zinfo.header_offset = tgt_zip.fp.tell()
+    tgt_zip.fp.write(zinfo.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated zip entry: {info.filename}")
+        tgt_zip.fp.write(chunk)
+        remaining -= len(chunk)
+    tgt_zip.filelist.append(zinfo)
+    tgt_zip.NameToInfo[zinfo.filename] = zinfo
+    tgt_zip.start_dir = tgt_zip.fp.tell()
+
+def detect_ad_pages(img_files, open_image, logger=None):
+    """
+    检测末尾的广告页，返回广告页在 img_files 中的索引集合
+
+    img_files 为按页码排序的页面名称，open_image(name) 返回对应页面的 PIL Image，只有实际检查的末尾几页会被解码
+    """
+    ad_pages = set()
+    if logger:
+        logger.info("正在检测广告页...")
+    start_idx = max(0, len(img_files) - 10)
+    normal_num = 0
+    for i in range(len(img_files) - 1, start_idx - 1, -1):
+        if i in ad_pages:
+            continue
+        name = img_files[i]
+        basename = os.path.basename(name)
+        # 文件名匹配
+        if ad_file_pattern.search(basename):
+            ad_pages.add(i)
+            (logger.debug if logger else print)(f"[DEBUG] 文件名匹配广告: {i} => {basename}")
+            continue
+        # 图像检测
+        try:
+            with open_image(name) as img:
+                img.load()
+                is_ad = detectAd.is_ad_img(img, logger)
+                if is_ad:
+                    ad_pages.add(i)
+                    (logger.debug if logger else print)(f"[DEBUG] 二维码检测广告: {i} => {name}")
+                elif normal_num > 2:
+                    break
+                else:
+                    normal_num += 1
+        except Exception as e:
+            (logger.debug if logger else print)(f"[DEBUG] 打开图片 {name} 异常: {e}")
+            continue
+
+    # 邻页补充
+    if ad_pages:
+        start_idx = min(ad_pages)
+        ad_num = 0
+        for i in range(start_idx, len(img_files)):
+            if i in ad_pages:
+                ad_num += 1
+                continue
+            if ad_num >= 2 or ((i - 1 in ad_pages) and (i + 1 in ad_pages)):
+                ad_pages.add(i)
+                (logger.debug if logger else print)(f"[DEBUG] 根据邻页规则补充广告: {i} => {img_files[i]}")
+            else:
+                ad_num = 0
+        if logger:
+            logger.info(f"[INFO] 最终广告页索引: {sorted(ad_pages)}")
+            logger.info(f"[INFO] 最终广告页文件: {', '.join([img_files[i] for i in sorted(ad_pages)])}")
+        else:
+            print(f"[INFO] 最终广告页索引: {sorted(ad_pages)}")
+            print(f"[INFO] 最终广告页文件: {', '.join([img_files[i] for i in sorted(ad_pages)])}")
+
+    return ad_pages
+
+def write_xml_to_zip(file_path, metadata, app=None, logger=None, keep_original=None, remove_ads=None, deflate_formats=None):
     zip_file_root = os.path.dirname(file_path)
     zip_file_name = os.path.basename(file_path)
-    copy = app and app.config.get('KEEP_ORIGINAL_FILE', False)
-    remove_ad_flag = app and app.config.get('REMOVE_ADS', False)
+    # 显式传入的参数优先于 app.config（在子进程中执行时没有 app）
+    copy = keep_original if keep_original is not None else app and app.config.get('KEEP_ORIGINAL_FILE', False)
+    remove_ad_flag = remove_ads if remove_ads is not None else app and app.config.get('REMOVE_ADS', False)
+    if deflate_formats is None and app:
+        deflate_formats = app.config.get('CBZ_DEFLATE_FORMATS')
 
     print(f"处理文件: {file_path}, 复制原文件: {copy}, 删除广告页: {remove_ad_flag}")
     if logger:
@@ -117,141 +436,90 @@ def write_xml_to_zip(file_path, metadata, app=None, logger=None):
 
     xml_content = make_comicinfo_xml(metadata)
 
-    # 检查输入是文件夹、ZIP文件还是7z文件
-    if os.path.isdir(file_path):
-        # 处理文件夹输入
-        # 获取所有图片并自然排序
-        img_files = []
-        for root, dirs, files in os.walk(file_path):
-            for file in files:
-                if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.jxl')):
-                    full_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(full_path, file_path)
-                    img_files.append(rel_path)
-        img_files = natsorted(img_files, key=lambda name: os.path.basename(name))
-    else:
-        # 处理ZIP或7z文件输入，先解压到临时目录
-        temp_dir = tempfile.mkdtemp(dir=zip_file_root)
-        try:
+    # 下载时已增量写入的 CBZ：原地完成，没有需要保留的原文件
+    if is_pending_cbz(file_path):
+        return finish_pending_cbz(file_path, xml_content, remove_ads=remove_ad_flag, logger=logger,
+                                  deflate_formats=deflate_formats)
+
+    # 检查输入是文件夹、ZIP文件还是7z文件：
+    # ZIP 直接从源压缩包按条目读取和复制；7z 无法按条目复制压缩数据，仍先解压到临时目录
+    src_zip = None
+    temp_dir = None
+    image_dir = file_path
+    target_zip_path = None
+    try:
+        if os.path.isdir(file_path):
+            pass
+        elif file_path.lower().endswith('.7z'):
+            temp_dir = tempfile.mkdtemp(dir=zip_file_root)
+            image_dir = temp_dir
             extract_images_only(file_path, temp_dir)
-            # 获取所有图片并自然排序
+        else:
+            src_zip = zipfile.ZipFile(file_path, 'r')
+
+        # 获取所有图片并自然排序
+        if src_zip is not None:
+            zip_entries = {
+                info.filename: info for info in src_zip.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(image_exts)
+            }
+            img_files = list(zip_entries)
+        else:
             img_files = []
-            for root, dirs, files in os.walk(temp_dir):
+            for root, dirs, files in os.walk(image_dir):
                 for file in files:
-                    if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.jxl')):
+                    if file.lower().endswith(image_exts):
                         full_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(full_path, temp_dir)
+                        rel_path = os.path.relpath(full_path, image_dir)
                         img_files.append(rel_path)
-            img_files = natsorted(img_files, key=lambda name: os.path.basename(name))
-        except Exception as e:
-            shutil.rmtree(temp_dir)
-            raise e
-    if not img_files:
-        msg = f"文件夹 {file_path} 内没有找到有效图片"
-        if logger:
-            logger.warning(msg)
-        else:
-            print(msg)
-        if 'temp_dir' in locals() and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        return None
-
-    # 广告页检测
-    ad_pages = set()
-    if remove_ad_flag:
-        if logger:
-            logger.info("正在检测广告页...")
-        start_idx = max(0, len(img_files) - 10)
-        normal_num = 0
-        for i in range(len(img_files) - 1, start_idx - 1, -1):
-            if i in ad_pages:
-                continue
-            name = img_files[i]
-            basename = os.path.basename(name)
-            # 文件名匹配
-            if ad_file_pattern.search(basename):
-                ad_pages.add(i)
-                (logger.debug if logger else print)(f"[DEBUG] 文件名匹配广告: {i} => {basename}")
-                continue
-            # 图像检测
-            try:
-                if os.path.isdir(file_path):
-                    # 从文件夹读取图片
-                    img_path = os.path.join(file_path, name)
-                    with Image.open(img_path) as img:
-                        img.load()
-                        is_ad = detectAd.is_ad_img(img, logger)
-                        if is_ad:
-                            ad_pages.add(i)
-                            (logger.debug if logger else print)(f"[DEBUG] 二维码检测广告: {i} => {name}")
-                        elif normal_num > 2:
-                            break
-                        else:
-                            normal_num += 1
-                else:
-                    # 从临时目录读取图片
-                    img_path = os.path.join(temp_dir, name)
-                    with Image.open(img_path) as img:
-                        img.load()
-                        is_ad = detectAd.is_ad_img(img, logger)
-                        if is_ad:
-                            ad_pages.add(i)
-                            (logger.debug if logger else print)(f"[DEBUG] 二维码检测广告: {i} => {name}")
-                        elif normal_num > 2:
-                            break
-                        else:
-                            normal_num += 1
-            except Exception as e:
-                (logger.debug if logger else print)(f"[DEBUG] 打开图片 {name} 异常: {e}")
-                continue
+        img_files = natsorted(img_files, key=lambda name: os.path.basename(name))
 
-        # 邻页补充
-        if ad_pages:
-            start_idx = min(ad_pages)
-            ad_num = 0
-            for i in range(start_idx, len(img_files)):
-                if i in ad_pages:
-                    ad_num += 1
-                    continue
-                if ad_num >= 2 or ((i - 1 in ad_pages) and (i + 1 in ad_pages)):
-                    ad_pages.add(i)
-                    (logger.debug if logger else print)(f"[DEBUG] 根据邻页规则补充广告: {i} => {img_files[i]}")
-                else:
-                    ad_num = 0
+        if not img_files:
+            msg = f"文件夹 {file_path} 内没有找到有效图片"
             if logger:
-                logger.info(f"[INFO] 最终广告页索引: {sorted(ad_pages)}")
-                logger.info(f"[INFO] 最终广告页文件: {', '.join([img_files[i] for i in sorted(ad_pages)])}")
+                logger.warning(msg)
             else:
-                print(f"[INFO] 最终广告页索引: {sorted(ad_pages)}")
-                print(f"[INFO] 最终广告页文件: {', '.join([img_files[i] for i in sorted(ad_pages)])}")
-
-    # 安全临时文件（唯一文件名，避免冲突）
-    with tempfile.NamedTemporaryFile(dir=zip_file_root, suffix=".cbz", delete=False) as tmp:
-        target_zip_path = tmp.name
-
-    # 创建目标ZIP文件并写入内容
-    with zipfile.ZipFile(target_zip_path, 'w', zipfile.ZIP_DEFLATED) as tgt_zip:
-        # 写入非广告页（流式复制，节省内存）
-        for idx, name in enumerate(img_files):
-            if idx in ad_pages:
-                continue
-            if os.path.isdir(file_path):
-                # 从文件夹复制文件
-                src_path = os.path.join(file_path, name)
-                with open(src_path, 'rb') as source, tgt_zip.open(name, 'w') as target:
-                    shutil.copyfileobj(source, target)
-            else:
-                # 从临时目录复制文件
-                src_path = os.path.join(temp_dir, name)
-                with open(src_path, 'rb') as source, tgt_zip.open(name, 'w') as target:
-                    shutil.copyfileobj(source, target)
+                print(msg)
+            return None
+
+        def open_image(name):
+            # 只有广告检测实际检查的末尾几页会被解码
+            if src_zip is not None:
+                return Image.open(io.BytesIO(src_zip.read(zip_entries[name])))
+            return Image.open(os.path.join(image_dir, name))
 
-        # 写入 ComicInfo.xml
-        tgt_zip.writestr("ComicInfo.xml", xml_content)
+        # 广告页检测
+        ad_pages = detect_ad_pages(img_files, open_image, logger) if remove_ad_flag else set()
 
-    # 清理临时目录（如果存在）
-    if 'temp_dir' in locals() and os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
+        # 安全临时文件（唯一文件名，避免冲突）
+        with tempfile.NamedTemporaryFile(dir=zip_file_root, suffix=".cbz", delete=False) as tmp:
+            target_zip_path = tmp.name
+
+        # 创建目标ZIP文件并写入内容，图片默认不压缩存储
+        with zipfile.ZipFile(target_zip_path, 'w', zipfile.ZIP_STORED) as tgt_zip:
+            # 写入非广告页（ZIP 源在压缩方式相同时直接复制压缩数据，其他来源流式复制文件）
+            for idx, name in enumerate(img_files):
+                if idx in ad_pages:
+                    continue
+                compress_type = compress_type_for(name, deflate_formats)
+                if src_zip is not None:
+                    copy_zip_entry(src_zip, zip_entries[name], tgt_zip, compress_type=compress_type)
+                else:
+                    tgt_zip.write(os.path.join(image_dir, name), name, compress_type=compress_type)
+
+            # 写入 ComicInfo.xml
+            tgt_zip.writestr("ComicInfo.xml", xml_content,
+                             compress_type=compress_type_for("ComicInfo.xml", deflate_formats))
+    except Exception:
+        if target_zip_path and os.path.exists(target_zip_path):
+            os.remove(target_zip_path)
+        raise
+    finally:
+        if src_zip is not None:
+            src_zip.close()
+        # 清理临时目录（如果存在）
+        if temp_dir and os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
 
     # 文件替换逻辑
     if copy:
@@ -284,3 +552,53 @@ def write_xml_to_zip(file_path, metadata, app=None, logger=None):
     shutil.move(target_zip_path, new_file_path)
 
     return new_file_path
+
+
+class PackageError(Exception):
+    """子进程封包失败，records 为失败前已收集的日志"""
+
+    def __init__(self, message, records):
+        super().__init__(message, records)
+        self.message = message
+        self.records = records
+
+    def __str__(self):
+        return self.message
+
+
+class LogCollector:
+    """在子进程中代替 logger 收集日志，返回主进程后再写入任务日志"""
+
+    def __init__(self):
+        self.records = []
+
+    def _log(self, level, msg):
+        self.records.append((level, str(msg)))
+
+    def debug(self, msg, *args, **kwargs):
+        self._log('debug', msg)
+
+    def info(self, msg, *args, **kwargs):
+        self._log('info', msg)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log('warning', msg)
+
+    def error(self, msg, *args, **kwargs):
+        self._log('error', msg)
+
+
+def package_archive(file_path, metadata, keep_original=False, remove_ads=False, deflate_formats=None):
+    """
+    供进程池调用的封包入口：写入 ComicInfo.xml、删除广告页并重新打包
+
+    返回 (新文件路径, [(日志级别, 日志内容), ...])，出错时异常连同已收集的日志一起抛出
+    """
+    collector = LogCollector()
+    try:
+        cbz = write_xml_to_zip(file_path, metadata, logger=collector,
+                               keep_original=keep_original, remove_ads=remove_ads,
+                               deflate_formats=deflate_formats)
+    except Exception as e:
+        raise PackageError(str(e), collector.records) from None
+    return cbz, collector.records
@@ -18,11 +18,25 @@ def get_default_config():
             'keep_torrents': 'false',
             'keep_original_file': 'false',
             'prefer_japanese_title': 'true',
-            'move_path': ''
+            'move_path': '',
+            'archive_tasks_after': '', # 任务最后更新超过该时长后移入归档表（如 90d），留空则不归档
+            'gmetadata_cache_ttl': '7d' # 画廊元数据缓存有效期，留空则不缓存
+        },
+        'download': {
+            'max_workers': 5, # 同时执行的下载任务总数
+            'ehentai': 2, # 以下为各下载来源的并发上限
+            'nhentai': 2,
+            'hitomi': 2,
+            'hdoujin': 1,
+            'aria2': 2,
+            'package_workers': 2, # 封包（解压、广告页检测、重新打包）进程数
+            'nhentai_page_workers': 4, # 单个画廊同时下载的页数
+            'hitomi_page_workers': 4
         },
         'advanced':{
             'tags_translation': 'false',
             'remove_ads': 'false',
+            'cbz_deflate_formats': ['xml', 'json'], # CBZ 中需要压缩的格式，其余（图片）不压缩直接存储
             'aggressive_series_detection': 'false', # 启用后，E-Hentai 会对 AltnateSeries 字段进行更激进的检测。
             'openai_series_detection': 'false', # 启用后，使用配置号的 OpenAI 接口对标题进行系列名和序号的检测。
             'prefer_openai_series': 'false' # 启用后，优先使用 OpenAI 进行系列识别，正则作为后备方案。
@@ -210,6 +224,12 @@ def load_config():
                     converted_section[key] = int(value)
                 except (ValueError, TypeError):
                     converted_section[key] = 1  # 默认值
+            elif section == 'download':
+                # 并发数均为整数，不进行布尔转换
+                try:
+                    converted_section[key] = int(value)
+                except (ValueError, TypeError):
+                    converted_section[key] = default_config['download'].get(key)
             elif isinstance(value, str):
                 lower_value = value.lower()
                 if lower_value in TRUE_VALUES:
@@ -1,11 +1,147 @@
 import sqlite3
 import threading
+import atexit
+import functools
+import itertools
+import time
 import os
 import json
-from datetime import datetime, timezone
+import zlib
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional, Tuple
 
-from utils import TaskStatus, parse_gallery_url, check_dirs
+from utils import TaskStatus, JobState, parse_gallery_url, check_dirs
+
+
+class SQLitePool:
+    """
+    SQLite 连接池
+
+    每个线程复用一条独立的长连接（threading.local），数据库使用 WAL 日志模式：
+    读操作无需加锁即可并发执行，且不会被写操作阻塞；写操作由 write_lock 串行化，
+    保证同一时刻只有一个写者，避免 SQLITE_BUSY。
+    """
+
+    PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',     # WAL 模式下 NORMAL 即可保证一致性，只在检查点时 fsync
+        'cache_size': -16000,        # 负数表示 KiB，约 16MB 页缓存
+        'mmap_size': 268435456,      # 256MB 内存映射读取
+        'temp_store': 'MEMORY',
+        'recursive_triggers': 'ON',  # 让 INSERT OR REPLACE 删除旧行时同样触发 DELETE 触发器（维护全文索引）
+    }
+
+    def __init__(self, db_path: str, timeout: float = 10, pragmas: Optional[Dict] = None):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.pragmas = dict(self.PRAGMAS, **(pragmas or {}))
+        self.write_lock = threading.RLock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """获取当前线程的连接，不存在时创建（线程结束后随 threading.local 一起回收）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """关闭当前线程持有的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def touches_tasks(func):
+    """装饰 TaskDatabase 中写入任务数据的方法：执行完成后递增版本号，保证新版本号对应的数据已对读者可见"""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.touch()
+    return wrapper
+
+
+class TaskRow(dict):
+    """
+    任务行字典
+
+    JSON 字段（metadata/comicinfo/pending_changes）先保留数据库中的原始字符串，首次访问时才解码，
+    列表等只用到少数字段的场景不必为每一行解析完整的 gmetadata。
+    """
+
+    JSON_FIELDS = ("metadata", "comicinfo", "pending_changes")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._raw = {key for key in self.JSON_FIELDS if isinstance(dict.get(self, key), str) and dict.get(self, key)}
+
+    def _decode(self, key):
+        if key in self._raw:
+            self._raw.discard(key)
+            try:
+                super().__setitem__(key, json.loads(super().__getitem__(key)))
+            except json.JSONDecodeError:
+                pass
+
+    def _decode_all(self):
+        for key in list(self._raw):
+            self._decode(key)
+
+    def __getitem__(self, key):
+        self._decode(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._raw.discard(key)
+        super().__setitem__(key, value)
+
+    # 覆盖 __iter__ 使 dict(row) / {}.update(row) 通过 __getitem__ 取值，得到解码后的结果
+    def __iter__(self):
+        return super().__iter__()
+
+    def get(self, key, default=None):
+        self._decode(key)
+        return super().get(key, default)
+
+    def pop(self, key, *default):
+        self._raw.discard(key)
+        return super().pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        self._decode(key)
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        self._raw.difference_update(other)
+        super().update(other)
+
+    def items(self):
+        self._decode_all()
+        return super().items()
+
+    def values(self):
+        self._decode_all()
+        return super().values()
+
+    def copy(self):
+        """浅拷贝，未访问过的 JSON 字段仍保持未解码"""
+        row = TaskRow()
+        dict.update(row, dict.items(self))
+        row._raw = set(self._raw)
+        return row
+
 
 class TaskDatabase:
     STATUS_MAP = {
@@ -15,21 +151,68 @@ class TaskDatabase:
         "failed": TaskStatus.ERROR,
     }
 
-    def __init__(self, db_path: str = './data/tasks.db'):
+    # 列表视图查询的字段：不包含原始 gmetadata、日志和待处理变更等大字段
+    LIST_COLUMNS = (
+        "id", "status", "error", "filename", "progress", "downloaded", "total_size", "speed",
+        "url", "mode", "favcat", "comicinfo", "output_path", "target_path",
+        "repack_status", "move_status", "last_error", "cover_url", "komga_id", "created_at", "updated_at",
+    )
+
+    # 需要同步写入的终态
+    TERMINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.CANCELLED, TaskStatus.ERROR)
+
+    def __init__(self, db_path: str = './data/tasks.db', flush_interval: float = 0.5, lazy: bool = False):
+        """lazy 为 True 时推迟到第一次获取连接时才创建数据库和表（导入模块本身不产生文件和写入）"""
         self.db_path = db_path
-        self.lock = threading.Lock()
         self._latest_added_cache = None  # 缓存最新的收藏时间
-        
-        # 确保数据库文件的父目录存在
-        db_dir = os.path.dirname(self.db_path)
-        if db_dir:
-            check_dirs(db_dir)
-        
-        self._init_database()
+
+        self.pool = SQLitePool(self.db_path)
+        # 写锁：只有写操作需要持有，读操作依赖 WAL 快照并发执行
+        self.lock = self.pool.write_lock
+
+        # 写缓冲：task_id -> {列名: 值}，由后台线程定期批量刷新
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Dict] = {}
+        self._pending_logs: List[Tuple[str, str]] = []
+        self._pending_lock = threading.Lock()
+        self._flusher = None
+        atexit.register(self.flush)
+
+        # 任务数据版本号：任何任务相关的写入都会递增，用于生成 HTTP ETag
+        # 进程启动标识保证重启后版本号不会与旧的 ETag 冲突
+        self._epoch = f"{int(time.time()):x}"
+        self._version_counter = itertools.count(1)
+        self.version = 0
+
+        self._initialized = False
+        self._initializing = False
+        if not lazy:
+            self._ensure_initialized()
+
+    def _ensure_initialized(self):
+        """创建数据库目录和表，并校准一次状态计数（兼容触发器创建之前已存在的任务）；只执行一次"""
+        # 使用写锁：写操作可能在持有写锁后才第一次获取连接，单独的初始化锁会与其死锁
+        with self.lock:
+            # 初始化过程本身也会获取连接，同一线程重入时直接返回
+            if self._initialized or self._initializing:
+                return
+            self._initializing = True
+            try:
+                # 确保数据库文件的父目录存在
+                db_dir = os.path.dirname(self.db_path)
+                if db_dir:
+                    check_dirs(db_dir)
+                self._init_database()
+                self.reconcile_status_counts()
+                self._initialized = True
+            finally:
+                self._initializing = False
 
     def _get_conn(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        """获取当前线程复用的数据库连接"""
+        if not self._initialized:
+            self._ensure_initialized()
+        return self.pool.connection()
 
     def _init_database(self):
         """初始化数据库表"""
@@ -119,6 +302,10 @@ class TaskDatabase:
             except sqlite3.Error:
                 pass  # 索引可能已存在
 
+            # 任务列表分页索引：按状态过滤与不过滤两种情况下都能按 (created_at, id) 顺序扫描
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at, id)')
+
             # 为历史数据填充 normalized_url
             cursor = conn.execute('SELECT id, url FROM tasks WHERE url IS NOT NULL AND normalized_url IS NULL')
             tasks_to_update = cursor.fetchall()
@@ -149,6 +336,120 @@ class TaskDatabase:
 
             conn.commit()
 
+            self.fts_enabled = self._init_fts(conn)
+
+            # 创建任务状态计数表，由触发器随 tasks 的增删改同步维护，使状态统计为 O(1) 查询
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS task_status_counts (
+                    status TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS task_status_counts_insert AFTER INSERT ON tasks BEGIN
+                    INSERT INTO task_status_counts (status, count) VALUES (new.status, 1)
+                    ON CONFLICT(status) DO UPDATE SET count = count + 1;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS task_status_counts_delete AFTER DELETE ON tasks BEGIN
+                    UPDATE task_status_counts SET count = count - 1 WHERE status = old.status;
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS task_status_counts_update AFTER UPDATE OF status ON tasks
+                WHEN old.status IS NOT new.status BEGIN
+                    UPDATE task_status_counts SET count = count - 1 WHERE status = old.status;
+                    INSERT INTO task_status_counts (status, count) VALUES (new.status, 1)
+                    ON CONFLICT(status) DO UPDATE SET count = count + 1;
+                END
+            ''')
+            conn.commit()
+
+            # 创建任务日志表：只追加写入，自增 id 同时作为增量读取的游标
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS task_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT NOT NULL,
+                    line TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_task_logs_task_id ON task_logs(task_id, id)')
+
+            # 将旧版本保存在 tasks.log 中的日志迁移到 task_logs
+            cursor = conn.execute("SELECT id, log FROM tasks WHERE log IS NOT NULL AND log != ''")
+            rows = cursor.fetchall()
+            for task_id, log in rows:
+                conn.executemany('INSERT INTO task_logs (task_id, line) VALUES (?, ?)',
+                                 [(task_id, line) for line in log.splitlines()])
+            if rows:
+                conn.execute("UPDATE tasks SET log = NULL WHERE log IS NOT NULL")
+
+            conn.commit()
+
+            # 创建任务归档表：只保留去重和查找所需的摘要字段，完整任务及日志压缩后存入 payload
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tasks_archive (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    url TEXT,
+                    normalized_url TEXT,
+                    output_path TEXT,
+                    komga_id TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    archived_at TEXT,
+                    payload BLOB NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_archive_normalized_url ON tasks_archive(normalized_url)')
+
+            conn.commit()
+
+            # 创建持久化下载队列表：下载参数随任务一起落盘，重启后可重新排队恢复
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS task_queue (
+                    task_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    mode TEXT,
+                    favcat TEXT,
+                    provider TEXT,
+                    priority INTEGER DEFAULT 0,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    external_id TEXT,
+                    lease_owner TEXT,
+                    lease_expires_at REAL,
+                    heartbeat_at REAL,
+                    attempts INTEGER DEFAULT 0,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor = conn.execute("PRAGMA table_info(task_queue)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'provider' not in columns:
+                conn.execute('ALTER TABLE task_queue ADD COLUMN provider TEXT')
+            if 'priority' not in columns:
+                conn.execute('ALTER TABLE task_queue ADD COLUMN priority INTEGER DEFAULT 0')
+            if 'external_id' not in columns:
+                conn.execute('ALTER TABLE task_queue ADD COLUMN external_id TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_task_queue_state ON task_queue(state)')
+
+            conn.commit()
+
+            # 创建 gmetadata 缓存表：键为站点及画廊标识（如 ehentai:gid/token），值为 gmetadata JSON
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS gmetadata_cache (
+                    key TEXT PRIMARY KEY,
+                    gmetadata TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+
+            conn.commit()
+
             # 创建 eh_favorites 表
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS eh_favorites (
@@ -215,6 +516,68 @@ class TaskDatabase:
 
             conn.commit()
 
+    # 全文索引覆盖的字段：comicinfo 为 JSON，取其中的标题与标签
+    FTS_COLUMNS_SQL = """
+        {p}.id, {p}.filename, {p}.url,
+        CASE WHEN json_valid({p}.comicinfo) THEN json_extract({p}.comicinfo, '$.Title') END,
+        CASE WHEN json_valid({p}.comicinfo) THEN json_extract({p}.comicinfo, '$.Tags') END
+    """
+    # trigram 分词器按 3 字符切分，支持中日文及任意子串/前缀匹配，短于 3 字符的搜索词回退到 LIKE
+    FTS_MIN_TERM_LENGTH = 3
+
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        """创建任务全文索引（FTS5）及同步触发器，SQLite 不支持 FTS5 时返回 False 并回退到 LIKE 搜索"""
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'"
+            ).fetchone()
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                    id, filename, url, title, tags,
+                    tokenize = 'trigram'
+                )
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+                    INSERT INTO tasks_fts (rowid, id, filename, url, title, tags)
+                    VALUES (new.rowid, {self.FTS_COLUMNS_SQL.format(p='new')});
+                END
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+                    DELETE FROM tasks_fts WHERE rowid = old.rowid;
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF id, filename, url, comicinfo ON tasks BEGIN
+                    DELETE FROM tasks_fts WHERE rowid = old.rowid;
+                    INSERT INTO tasks_fts (rowid, id, filename, url, title, tags)
+                    VALUES (new.rowid, {self.FTS_COLUMNS_SQL.format(p='new')});
+                END
+            ''')
+            if not exists:
+                # 首次创建索引时为历史任务建立索引
+                conn.execute(f'''
+                    INSERT INTO tasks_fts (rowid, id, filename, url, title, tags)
+                    SELECT tasks.rowid, {self.FTS_COLUMNS_SQL.format(p='tasks')} FROM tasks
+                ''')
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            import logging
+            logging.warning(f"FTS5 full-text index unavailable, falling back to LIKE search: {e}")
+            return False
+
+    def touch(self):
+        """递增任务数据版本号（任务表、任务日志或内存中的任务状态发生变化时调用）"""
+        self.version = next(self._version_counter)
+
+    @property
+    def version_tag(self) -> str:
+        """当前任务数据版本标识，可直接用作 ETag"""
+        return f"{self._epoch}-{self.version}"
+
+    @touches_tasks
     def add_task(self, task_id: str, status: str = TaskStatus.IN_PROGRESS,
                  filename: Optional[str] = None, error: Optional[str] = None,
                  url: Optional[str] = None, mode: Optional[str] = None, favcat: Optional[str] = None,
@@ -272,6 +635,7 @@ class TaskDatabase:
                 print(f"Database error adding task: {e}")
                 return False
 
+    @touches_tasks
     def update_task(self, task_id: str, status: Optional[str] = None, error: Optional[str] = None,
                     log: Optional[str] = None, filename: Optional[str] = None, progress: Optional[int] = None,
                     downloaded: Optional[int] = None, total_size: Optional[int] = None, speed: Optional[int] = None,
@@ -281,187 +645,437 @@ class TaskDatabase:
                     pending_changes: Optional[Dict] = None, repack_status: Optional[str] = None,
                     move_status: Optional[str] = None, last_error: Optional[str] = None,
                     cover_url: Optional[str] = None, komga_id: Optional[str] = None) -> bool:
-        """更新任务信息"""
+        """
+        更新任务信息
+
+        非终态的字段更新先写入内存缓冲区，按任务合并后由后台线程每隔 flush_interval 秒
+        在同一事务中批量落盘；终态（完成/取消/错误）的状态变更会连同该任务已缓冲的字段立即同步写入。
+        """
+        values = {
+            'status': self.STATUS_MAP.get(status, status) if status is not None else None,
+            'error': error,
+            'log': log,
+            'filename': filename,
+            'progress': progress,
+            'downloaded': downloaded,
+            'total_size': total_size,
+            'speed': speed,
+            'url': url,
+            'mode': mode,
+            'favcat': favcat,
+            'metadata': self._serialize_json(metadata),
+            'comicinfo': self._serialize_json(comicinfo),
+            'output_path': output_path,
+            'target_path': target_path,
+            'pending_changes': self._serialize_json(pending_changes),
+            'repack_status': repack_status,
+            'move_status': move_status,
+            'last_error': last_error,
+            'cover_url': cover_url,
+            'komga_id': komga_id,
+        }
+        fields = {key: value for key, value in values.items() if value is not None}
+        if not fields:
+            return True
+        fields['updated_at'] = datetime.now(timezone.utc).isoformat()
+
+        if fields.get('status') not in self.TERMINAL_STATUSES:
+            with self._pending_lock:
+                self._pending.setdefault(task_id, {}).update(fields)
+            self._ensure_flusher()
+            return True
+
         with self.lock:
+            # 在写锁内取出缓冲区，保证不会被后台刷新线程用旧值覆盖
+            with self._pending_lock:
+                buffered = self._pending.pop(task_id, {})
+            buffered.update(fields)
             try:
                 with self._get_conn() as conn:
-                    updates = []
-                    params = []
-
-                    if status is not None:
-                        updates.append("status = ?")
-                        params.append(self.STATUS_MAP.get(status, status))
-                    if error is not None:
-                        updates.append("error = ?")
-                        params.append(error)
-                    if log is not None:
-                        updates.append("log = ?")
-                        params.append(log)
-                    if filename is not None:
-                        updates.append("filename = ?")
-                        params.append(filename)
-                    if progress is not None:
-                        updates.append("progress = ?")
-                        params.append(progress)
-                    if downloaded is not None:
-                        updates.append("downloaded = ?")
-                        params.append(downloaded)
-                    if total_size is not None:
-                        updates.append("total_size = ?")
-                        params.append(total_size)
-                    if speed is not None:
-                        updates.append("speed = ?")
-                        params.append(speed)
-                    if url is not None:
-                        updates.append("url = ?")
-                        params.append(url)
-                    if mode is not None:
-                        updates.append("mode = ?")
-                        params.append(mode)
-                    if favcat is not None:
-                        updates.append("favcat = ?")
-                        params.append(favcat)
-                    if metadata is not None:
-                        updates.append("metadata = ?")
-                        params.append(self._serialize_json(metadata))
-                    if comicinfo is not None:
-                        updates.append("comicinfo = ?")
-                        params.append(self._serialize_json(comicinfo))
-                    if output_path is not None:
-                        updates.append("output_path = ?")
-                        params.append(output_path)
-                    if target_path is not None:
-                        updates.append("target_path = ?")
-                        params.append(target_path)
-                    if pending_changes is not None:
-                        updates.append("pending_changes = ?")
-                        params.append(self._serialize_json(pending_changes))
-                    if repack_status is not None:
-                        updates.append("repack_status = ?")
-                        params.append(repack_status)
-                    if move_status is not None:
-                        updates.append("move_status = ?")
-                        params.append(move_status)
-                    if last_error is not None:
-                        updates.append("last_error = ?")
-                        params.append(last_error)
-                    if cover_url is not None:
-                        updates.append("cover_url = ?")
-                        params.append(cover_url)
-                    if komga_id is not None:
-                        updates.append("komga_id = ?")
-                        params.append(komga_id)
-
-                    if updates:
-                        updates.append("updated_at = ?")
-                        params.append(datetime.now(timezone.utc).isoformat())
-                        params.append(task_id)
-
-                        query = f"UPDATE tasks SET {', '.join(updates)} WHERE id = ?"
-                        conn.execute(query, params)
-                        conn.commit()
+                    self._apply_task_fields(conn, task_id, buffered)
+                    conn.commit()
                 return True
             except sqlite3.Error as e:
                 print(f"Database error updating task: {e}")
                 return False
 
-    def get_task(self, task_id: str) -> Optional[Dict]:
-        """获取单个任务"""
+    def _apply_task_fields(self, conn: sqlite3.Connection, task_id: str, fields: Dict):
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        cursor = conn.execute(f"UPDATE tasks SET {assignments} WHERE id = ?", [*fields.values(), task_id])
+        # 任务已被归档时先恢复到任务表再更新
+        if cursor.rowcount == 0 and self._restore_archived_task(conn, task_id):
+            conn.execute(f"UPDATE tasks SET {assignments} WHERE id = ?", [*fields.values(), task_id])
+
+    def _ensure_flusher(self):
+        """按需启动后台刷新线程"""
+        if self._flusher is not None:
+            return
+        with self._pending_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='TaskDatabaseFlusher', daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._pending or self._pending_logs:
+                self.flush()
+
+    def flush(self) -> bool:
+        """将缓冲区中的任务更新和日志在单个事务中写入数据库"""
         with self.lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+                logs, self._pending_logs = self._pending_logs, []
+            if not pending and not logs:
+                return True
             try:
                 with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
-                    row = cursor.fetchone()
-                    return self._deserialize_task(dict(row)) if row else None
+                    for task_id, fields in pending.items():
+                        self._apply_task_fields(conn, task_id, fields)
+                    if logs:
+                        conn.executemany('INSERT INTO task_logs (task_id, line) VALUES (?, ?)', logs)
+                    conn.commit()
+                return True
             except sqlite3.Error as e:
-                print(f"Database error getting task: {e}")
-                return None
+                print(f"Database error flushing task updates: {e}")
+                # 放回缓冲区等待下次刷新重试：期间产生的更新较新，以其字段为准；日志保持原有顺序
+                with self._pending_lock:
+                    for task_id, fields in pending.items():
+                        self._pending[task_id] = {**fields, **self._pending.get(task_id, {})}
+                    self._pending_logs = logs + self._pending_logs
+                return False
+
+    @touches_tasks
+    def append_task_log(self, task_id: str, line: str):
+        """追加一条任务日志（写入缓冲区，随下一次批量刷新落盘）"""
+        with self._pending_lock:
+            self._pending_logs.append((task_id, line))
+        self._ensure_flusher()
+
+    def get_task_logs(self, task_id: str, after: int = 0, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        """
+        增量获取任务日志
+
+        返回 (日志列表, 游标)，游标为最后一条日志的 id，下次请求时作为 after 传入即可只获取新增日志
+        """
+        if self._pending_logs:
+            self.flush()
+        try:
+            with self._get_conn() as conn:
+                query = 'SELECT id, line FROM task_logs WHERE task_id = ? AND id > ? ORDER BY id'
+                params = [task_id, after]
+                if limit:
+                    query += ' LIMIT ?'
+                    params.append(limit)
+                rows = conn.execute(query, params).fetchall()
+                if not rows:
+                    archived = self._load_archived_payload(conn, task_id)
+                    if archived:
+                        rows = [log for log in archived['logs'] if log[0] > after][:limit or None]
+                        return [line for _, line in rows], (rows[-1][0] if rows else after)
+                return [row['line'] for row in rows], (rows[-1]['id'] if rows else after)
+        except sqlite3.Error as e:
+            print(f"Database error getting task logs: {e}")
+            return [], after
+
+    def get_task(self, task_id: str) -> Optional[Dict]:
+        """获取单个任务，任务表中不存在时从归档中查找"""
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
+                row = cursor.fetchone()
+                if row:
+                    return self._deserialize_task(dict(row))
+                archived = self._load_archived_payload(conn, task_id)
+                return TaskRow(archived['task']) if archived else None
+        except sqlite3.Error as e:
+            print(f"Database error getting task: {e}")
+            return None
+
+    def get_task_metadata(self, task_id: str) -> Optional[Dict]:
+        """只获取任务的原始 gmetadata（列表视图不查询该字段，需要时单独读取）"""
+        try:
+            with self._get_conn() as conn:
+                row = conn.execute('SELECT metadata FROM tasks WHERE id = ?', (task_id,)).fetchone()
+                return TaskRow(metadata=row[0]).get('metadata') if row else None
+        except sqlite3.Error as e:
+            print(f"Database error getting task metadata: {e}")
+            return None
 
     def get_task_by_normalized_url(self, normalized_url: str) -> Optional[Dict]:
         """
         根据规范化 URL 获取任务
         优先返回进行中或已完成的任务，其次是失败或取消的任务
         """
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                # 优先查询进行中或已完成的任务
+                cursor = conn.execute('''
+                    SELECT * FROM tasks 
+                    WHERE normalized_url = ? 
+                    ORDER BY 
+                        CASE status
+                            WHEN ? THEN 1  -- 进行中优先级最高
+                            WHEN ? THEN 2  -- 已完成次之
+                            WHEN ? THEN 3  -- 取消
+                            WHEN ? THEN 4  -- 失败
+                            ELSE 5
+                        END,
+                        created_at DESC
+                    LIMIT 1
+                ''', (normalized_url, TaskStatus.IN_PROGRESS, TaskStatus.COMPLETED, 
+                      TaskStatus.CANCELLED, TaskStatus.ERROR))
+                row = cursor.fetchone()
+                if row:
+                    return self._deserialize_task(dict(row))
+                # 任务表中没有时回退到归档摘要，保证已归档的任务仍能参与去重
+                cursor = conn.execute(f'''
+                    SELECT {", ".join(self.ARCHIVE_SUMMARY_COLUMNS)} FROM tasks_archive
+                    WHERE normalized_url = ?
+                    ORDER BY CASE status WHEN ? THEN 1 ELSE 2 END, created_at DESC
+                    LIMIT 1
+                ''', (normalized_url, TaskStatus.COMPLETED))
+                row = cursor.fetchone()
+                return TaskRow(dict(row)) if row else None
+        except sqlite3.Error as e:
+            print(f"Database error getting task by normalized URL: {e}")
+            return None
+
+    def _select_columns(self, view: str, table: str = "tasks") -> str:
+        """按视图返回查询字段：list 只查询列表所需字段，detail 查询全部字段"""
+        if view == "list":
+            return ", ".join(f"{table}.{column}" for column in self.LIST_COLUMNS)
+        return f"{table}.*"
+
+    def get_tasks(self, status_filter: Optional[str] = None, search_query: Optional[str] = None, page: int = 1,
+                  page_size: int = 20, order_by: str = "created_at DESC", view: str = "detail") -> Tuple[List[Dict], int]:
+        """
+        获取任务列表，支持分页和状态过滤；order_by 为 "relevance" 时按全文检索相关度排序
+
+        view 为 "list" 时只查询 LIST_COLUMNS 中的字段
+        """
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+
+                where_clauses, params = self._build_task_filters(status_filter, search_query)
+                where_clause = ""
+                if where_clauses:
+                    where_clause = "WHERE " + " AND ".join(where_clauses)
+
+                # 获取总数
+                count_query = f"SELECT COUNT(*) FROM tasks {where_clause}"
+                cursor = conn.execute(count_query, params)
+                total = cursor.fetchone()[0]
+
+                # 按相关度排序时关联全文索引的 rank（bm25），未命中索引的结果排在最后
+                rank_join = ""
+                rank_params = []
+                if order_by == "relevance":
+                    fts_terms = [t for t in self._split_search_terms(search_query or "")
+                                 if self.fts_enabled and len(t) >= self.FTS_MIN_TERM_LENGTH]
+                    if fts_terms:
+                        rank_join = """
+                            LEFT JOIN (SELECT rowid AS fts_rowid, rank AS fts_rank FROM tasks_fts WHERE tasks_fts MATCH ?) AS fts
+                            ON fts.fts_rowid = tasks.rowid
+                        """
+                        rank_params.append(self._build_fts_query(fts_terms))
+                        order_by = "fts_rank IS NULL, fts_rank, created_at DESC"
+                    else:
+                        order_by = "created_at DESC"
+
+                # 获取分页数据
+                offset = (page - 1) * page_size
+                data_query = f"""
+                    SELECT {self._select_columns(view)} FROM tasks {rank_join} {where_clause}
+                    ORDER BY {order_by}
+                    LIMIT ? OFFSET ?
+                """
+                params = rank_params + params + [page_size, offset]
+
+                cursor = conn.execute(data_query, params)
+                tasks = [self._deserialize_task(dict(row)) for row in cursor.fetchall()]
+
+                return tasks, total
+        except sqlite3.Error as e:
+            print(f"Database error getting tasks: {e}")
+            return [], 0
+
+    def get_tasks_after(self, status_filter: Optional[str] = None, search_query: Optional[str] = None,
+                        after: Optional[Tuple[str, str]] = None, page_size: int = 20,
+                        view: str = "detail") -> Tuple[List[Dict], Optional[Tuple[str, str]]]:
+        """
+        游标（keyset）分页获取任务列表，按 created_at、id 倒序
+
+        after 为上一页最后一条任务的 (created_at, id)，为 None 时从第一页开始；
+        返回 (任务列表, 下一页游标)，没有更多数据时游标为 None。
+        不需要 COUNT(*) 和 OFFSET，翻页深度不影响查询耗时；view 含义同 get_tasks
+        """
+        try:
+            with self._get_conn() as conn:
+                where_clauses, params = self._build_task_filters(status_filter, search_query)
+                if after:
+                    where_clauses.append("(created_at, id) < (?, ?)")
+                    params.extend(after)
+                where_clause = ""
+                if where_clauses:
+                    where_clause = "WHERE " + " AND ".join(where_clauses)
+
+                # 多取一条用于判断是否还有下一页
+                cursor = conn.execute(f"""
+                    SELECT {self._select_columns(view)} FROM tasks {where_clause}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                """, params + [page_size + 1])
+                rows = cursor.fetchall()
+
+                next_cursor = None
+                if len(rows) > page_size:
+                    rows = rows[:page_size]
+                    next_cursor = (rows[-1]['created_at'], rows[-1]['id'])
+                return [self._deserialize_task(dict(row)) for row in rows], next_cursor
+        except sqlite3.Error as e:
+            print(f"Database error getting tasks after cursor: {e}")
+            return [], None
+
+    def get_task_ids(self, status_filter: Optional[str] = None, search_query: Optional[str] = None) -> List[str]:
+        """获取符合过滤条件的全部任务 id（按创建时间倒序），条件与 get_tasks 相同，只查询 id 列"""
+        try:
+            with self._get_conn() as conn:
+                where_clauses, params = self._build_task_filters(status_filter, search_query)
+                where_clause = ""
+                if where_clauses:
+                    where_clause = "WHERE " + " AND ".join(where_clauses)
+                cursor = conn.execute(f"SELECT id FROM tasks {where_clause} ORDER BY created_at DESC", params)
+                return [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Database error getting task ids: {e}")
+            return []
+
+    def _build_task_filters(self, status_filter: Optional[str], search_query: Optional[str]) -> Tuple[List[str], List]:
+        """构造任务列表的状态过滤与搜索条件"""
+        where_clauses = []
+        params = []
+
+        if status_filter:
+            status_cn = self.STATUS_MAP.get(status_filter, status_filter)
+            where_clauses.append("status = ?")
+            params.append(status_cn)
+
+        if search_query:
+            search_clause, search_params = self._build_search_clause(search_query)
+            if search_clause:
+                where_clauses.append(search_clause)
+                params.extend(search_params)
+
+        return where_clauses, params
+
+    def _split_search_terms(self, search_query: str) -> List[str]:
+        """将以逗号、竖线或换行分隔的搜索词拆分为列表"""
+        import re
+        return [t.strip() for t in re.split(r'[,|\n]+', search_query) if t.strip()]
+
+    def _build_fts_query(self, terms: List[str]) -> str:
+        """构造 FTS5 MATCH 表达式：每个词作为短语匹配，多个词之间为 OR 关系"""
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def _build_search_clause(self, search_query: str) -> Tuple[str, List]:
+        """
+        将搜索词转换为 WHERE 子句（多个词之间为 OR 关系）
+
+        可用全文索引时，长度足够的词走 FTS5 索引，其余的词回退到 id/filename/url 的 LIKE 匹配
+        """
+        terms = self._split_search_terms(search_query)
+        if not terms:
+            return "", []
+        term_clauses = []
+        params = []
+        fts_terms = []
+        for term in terms:
+            if self.fts_enabled and len(term) >= self.FTS_MIN_TERM_LENGTH:
+                fts_terms.append(term)
+                continue
+            term_clauses.append("(id LIKE ? OR filename LIKE ? OR url LIKE ?)")
+            search_term = f"%{term}%"
+            params.extend([search_term, search_term, search_term])
+        if fts_terms:
+            term_clauses.insert(0, "tasks.rowid IN (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ?)")
+            params.insert(0, self._build_fts_query(fts_terms))
+        return "(" + " OR ".join(term_clauses) + ")", params
+
+    def get_status_counts(self, search_query: Optional[str] = None) -> Dict[str, int]:
+        """
+        获取各状态的任务数量，可按搜索条件过滤
+
+        无搜索条件时直接读取触发器维护的 task_status_counts 表；有搜索条件时才按条件实时统计
+        """
+        try:
+            with self._get_conn() as conn:
+                if not search_query:
+                    cursor = conn.execute("SELECT status, count FROM task_status_counts WHERE count > 0")
+                    return {row[0]: row[1] for row in cursor.fetchall()}
+
+                where_clause = ""
+                search_clause, params = self._build_search_clause(search_query)
+                if search_clause:
+                    where_clause = f"WHERE {search_clause}"
+                cursor = conn.execute(f"SELECT status, COUNT(*) FROM tasks {where_clause} GROUP BY status", params)
+                return {row[0]: row[1] for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"Database error getting status counts: {e}")
+            return {}
+
+    def reconcile_status_counts(self) -> Dict[str, int]:
+        """
+        按 tasks 表重新计算状态计数，修正可能的偏差
+
+        返回修正前后不一致的状态及其偏差值（计数表中的值 - 实际值），无偏差时返回空字典
+        """
         with self.lock:
             try:
                 with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    # 优先查询进行中或已完成的任务
-                    cursor = conn.execute('''
-                        SELECT * FROM tasks 
-                        WHERE normalized_url = ? 
-                        ORDER BY 
-                            CASE status
-                                WHEN ? THEN 1  -- 进行中优先级最高
-                                WHEN ? THEN 2  -- 已完成次之
-                                WHEN ? THEN 3  -- 取消
-                                WHEN ? THEN 4  -- 失败
-                                ELSE 5
-                            END,
-                            created_at DESC
-                        LIMIT 1
-                    ''', (normalized_url, TaskStatus.IN_PROGRESS, TaskStatus.COMPLETED, 
-                          TaskStatus.CANCELLED, TaskStatus.ERROR))
-                    row = cursor.fetchone()
-                    return self._deserialize_task(dict(row)) if row else None
+                    stored = {row[0]: row[1] for row in conn.execute("SELECT status, count FROM task_status_counts")}
+                    actual = {row[0]: row[1] for row in conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status")}
+                    drift = {
+                        status: stored.get(status, 0) - actual.get(status, 0)
+                        for status in set(stored) | set(actual)
+                        if stored.get(status, 0) != actual.get(status, 0)
+                    }
+                    if drift:
+                        conn.execute("DELETE FROM task_status_counts")
+                        conn.executemany("INSERT INTO task_status_counts (status, count) VALUES (?, ?)", actual.items())
+                        conn.commit()
+                        self.touch()
+                    return drift
             except sqlite3.Error as e:
-                print(f"Database error getting task by normalized URL: {e}")
-                return None
+                print(f"Database error reconciling status counts: {e}")
+                return {}
 
-    def get_tasks(self, status_filter: Optional[str] = None, search_query: Optional[str] = None, page: int = 1,
-                  page_size: int = 20, order_by: str = "created_at DESC") -> Tuple[List[Dict], int]:
-        """获取任务列表，支持分页和状态过滤"""
+    @touches_tasks
+    def fail_in_progress_tasks(self, error: str) -> int:
+        """
+        将进行中但不在下载队列中的任务标记为错误（用于应用重启后清理残留状态），返回受影响的任务数
+
+        队列中尚未完成的任务会由 TaskQueue 恢复执行，不在此处理
+        """
         with self.lock:
             try:
                 with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-
-                    where_clauses = []
-                    params = []
-
-                    if status_filter:
-                        status_cn = self.STATUS_MAP.get(status_filter, status_filter)
-                        where_clauses.append("status = ?")
-                        params.append(status_cn)
-                        
-                    if search_query:
-                        import re
-                        terms = [t.strip() for t in re.split(r'[,|\n]+', search_query) if t.strip()]
-                        if terms:
-                            term_clauses = []
-                            for term in terms:
-                                term_clauses.append("(id LIKE ? OR filename LIKE ? OR url LIKE ?)")
-                                search_term = f"%{term}%"
-                                params.extend([search_term, search_term, search_term])
-                            where_clauses.append("(" + " OR ".join(term_clauses) + ")")
-                        
-                    where_clause = ""
-                    if where_clauses:
-                        where_clause = "WHERE " + " AND ".join(where_clauses)
-
-                    # 获取总数
-                    count_query = f"SELECT COUNT(*) FROM tasks {where_clause}"
-                    cursor = conn.execute(count_query, params)
-                    total = cursor.fetchone()[0]
-
-                    # 获取分页数据
-                    offset = (page - 1) * page_size
-                    data_query = f"""
-                        SELECT * FROM tasks {where_clause}
-                        ORDER BY {order_by}
-                        LIMIT ? OFFSET ?
-                    """
-                    params.extend([page_size, offset])
-
-                    cursor = conn.execute(data_query, params)
-                    tasks = [self._deserialize_task(dict(row)) for row in cursor.fetchall()]
-
-                    return tasks, total
+                    cursor = conn.execute('''
+                        UPDATE tasks SET status = ?, error = ?, updated_at = ?
+                        WHERE status = ? AND id NOT IN (SELECT task_id FROM task_queue WHERE state != ?)
+                    ''', (TaskStatus.ERROR, error, datetime.now(timezone.utc).isoformat(),
+                          TaskStatus.IN_PROGRESS, JobState.DONE))
+                    conn.commit()
+                    return cursor.rowcount
             except sqlite3.Error as e:
-                print(f"Database error getting tasks: {e}")
-                return [], 0
+                print(f"Database error failing in-progress tasks: {e}")
+                return 0
 
+    @touches_tasks
     def clear_tasks(self, status: str) -> bool:
         """清除指定状态的任务"""
         with self.lock:
@@ -469,29 +1083,121 @@ class TaskDatabase:
                 with self._get_conn() as conn:
                     if status == 'all_except_in_progress':
                         # 清除除了进行中任务外的所有任务
-                        conn.execute('DELETE FROM tasks WHERE status != ?', (TaskStatus.IN_PROGRESS,))
+                        condition, params = 'status != ?', (TaskStatus.IN_PROGRESS,)
                     else:
                         # 将前端状态映射为数据库状态
-                        status_cn = self.STATUS_MAP.get(status, status)
-                        conn.execute('DELETE FROM tasks WHERE status = ?', (status_cn,))
+                        condition, params = 'status = ?', (self.STATUS_MAP.get(status, status),)
+                    # 归档中的任务一并清除，避免其继续参与链接去重
+                    conn.execute(f'DELETE FROM tasks WHERE {condition}', params)
+                    conn.execute(f'DELETE FROM tasks_archive WHERE {condition}', params)
+                    # 清理已删除任务的日志和队列记录
+                    conn.execute('DELETE FROM task_logs WHERE task_id NOT IN (SELECT id FROM tasks)')
+                    conn.execute('DELETE FROM task_queue WHERE task_id NOT IN (SELECT id FROM tasks)')
                     conn.commit()
                 return True
             except sqlite3.Error as e:
                 print(f"Database error clearing tasks: {e}")
                 return False
 
+    @touches_tasks
     def delete_task(self, task_id: str) -> bool:
         """删除单个任务"""
         with self.lock:
+            with self._pending_lock:
+                self._pending.pop(task_id, None)
+                self._pending_logs = [entry for entry in self._pending_logs if entry[0] != task_id]
             try:
                 with self._get_conn() as conn:
-                    cursor = conn.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+                    deleted = conn.execute('DELETE FROM tasks WHERE id = ?', (task_id,)).rowcount
+                    conn.execute('DELETE FROM task_logs WHERE task_id = ?', (task_id,))
+                    conn.execute('DELETE FROM task_queue WHERE task_id = ?', (task_id,))
+                    deleted += conn.execute('DELETE FROM tasks_archive WHERE id = ?', (task_id,)).rowcount
                     conn.commit()
-                    return cursor.rowcount > 0
+                    return deleted > 0
             except sqlite3.Error as e:
                 print(f"Database error deleting task: {e}")
                 return False
 
+    # 归档表中保留的摘要字段，用于去重（normalized_url）和不解压 payload 的快速查找
+    ARCHIVE_SUMMARY_COLUMNS = (
+        "id", "status", "filename", "url", "normalized_url", "output_path", "komga_id", "created_at", "updated_at",
+    )
+
+    @touches_tasks
+    def archive_tasks(self, older_than_hours: float, batch_size: int = 500) -> int:
+        """
+        将最后更新时间早于 older_than_hours 小时的非进行中任务移入归档表，返回归档的任务数
+
+        完整的任务行和日志以 zlib 压缩的 JSON 存入 payload，任务表和日志表中的记录随之删除，
+        全文索引和状态计数由触发器同步维护。每批在独立事务中提交，避免长时间占用写锁。
+        """
+        self.flush()
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=older_than_hours)).isoformat()
+        columns = ", ".join(self.ARCHIVE_SUMMARY_COLUMNS)
+        placeholders = ", ".join("?" * (len(self.ARCHIVE_SUMMARY_COLUMNS) + 2))
+        archived = 0
+        while True:
+            with self.lock:
+                try:
+                    with self._get_conn() as conn:
+                        conn.row_factory = sqlite3.Row
+                        rows = conn.execute('''
+                            SELECT * FROM tasks
+                            WHERE status != ? AND COALESCE(updated_at, created_at) < ?
+                            LIMIT ?
+                        ''', (TaskStatus.IN_PROGRESS, cutoff, batch_size)).fetchall()
+                        if not rows:
+                            return archived
+                        now = datetime.now(timezone.utc).isoformat()
+                        for row in rows:
+                            task = dict(row)
+                            logs = conn.execute(
+                                'SELECT id, line FROM task_logs WHERE task_id = ? ORDER BY id', (task['id'],)
+                            ).fetchall()
+                            payload = zlib.compress(json.dumps(
+                                {'task': task, 'logs': [tuple(log) for log in logs]}, ensure_ascii=False
+                            ).encode('utf-8'))
+                            conn.execute(
+                                f'INSERT OR REPLACE INTO tasks_archive ({columns}, archived_at, payload) VALUES ({placeholders})',
+                                (*(task.get(column) for column in self.ARCHIVE_SUMMARY_COLUMNS), now, payload)
+                            )
+                        ids = [row['id'] for row in rows]
+                        id_placeholders = ", ".join("?" * len(ids))
+                        conn.execute(f'DELETE FROM task_logs WHERE task_id IN ({id_placeholders})', ids)
+                        conn.execute(f'DELETE FROM task_queue WHERE task_id IN ({id_placeholders})', ids)
+                        conn.execute(f'DELETE FROM tasks WHERE id IN ({id_placeholders})', ids)
+                        conn.commit()
+                        archived += len(rows)
+                        if len(rows) < batch_size:
+                            return archived
+                except sqlite3.Error as e:
+                    print(f"Database error archiving tasks: {e}")
+                    return archived
+
+    def _load_archived_payload(self, conn: sqlite3.Connection, task_id: str) -> Optional[Dict]:
+        """读取并解压归档任务，返回 {'task': 任务行, 'logs': [[日志 id, 内容], ...]}"""
+        row = conn.execute('SELECT payload FROM tasks_archive WHERE id = ?', (task_id,)).fetchone()
+        if not row:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def _restore_archived_task(self, conn: sqlite3.Connection, task_id: str) -> bool:
+        """将归档任务恢复到任务表（由调用方提交事务），任务未归档时返回 False"""
+        archived = self._load_archived_payload(conn, task_id)
+        if not archived:
+            return False
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+        task = {column: archived['task'][column] for column in columns if column in archived['task']}
+        conn.execute(
+            f'INSERT OR REPLACE INTO tasks ({", ".join(task)}) VALUES ({", ".join("?" * len(task))})',
+            list(task.values())
+        )
+        conn.executemany('INSERT INTO task_logs (id, task_id, line) VALUES (?, ?, ?)',
+                         [(log_id, task_id, line) for log_id, line in archived['logs']])
+        conn.execute('DELETE FROM tasks_archive WHERE id = ?', (task_id,))
+        return True
+
+    @touches_tasks
     def migrate_memory_tasks(self, memory_tasks: Dict) -> bool:
         """将内存中的任务迁移到数据库"""
         with self.lock:
@@ -499,7 +1205,6 @@ class TaskDatabase:
                 with self._get_conn() as conn:
                     now = datetime.now(timezone.utc).isoformat()
                     for task_id, task_info in memory_tasks.items():
-                        log_content = task_info.log_buffer.getvalue() if hasattr(task_info, 'log_buffer') else ""
                         conn.execute('''
                             INSERT OR REPLACE INTO tasks
                             (id, status, error, log, filename, progress, downloaded,
@@ -511,7 +1216,7 @@ class TaskDatabase:
                             task_id,
                             self.STATUS_MAP.get(task_info.status, task_info.status),
                             task_info.error,
-                            log_content,
+                            None,  # 日志保存在 task_logs 表中
                             task_info.filename,
                             task_info.progress,
                             task_info.downloaded,
@@ -546,15 +1251,214 @@ class TaskDatabase:
         return value
 
     def _deserialize_task(self, task: Dict) -> Dict:
-        for key in ("metadata", "comicinfo", "pending_changes"):
-            value = task.get(key)
-            if isinstance(value, str) and value:
-                try:
-                    task[key] = json.loads(value)
-                except json.JSONDecodeError:
-                    pass
-        return task
+        # 叠加尚未落盘的缓冲更新，保证读到的是最新状态
+        if self._pending:
+            with self._pending_lock:
+                buffered = self._pending.get(task.get('id'))
+                if buffered:
+                    task.update({key: value for key, value in buffered.items() if key in task})
+        # JSON 字段延迟到首次访问时再解码
+        return TaskRow(task)
+
+
+    def enqueue_job(self, task_id: str, url: str, mode: Optional[str] = None, favcat: Optional[str] = None,
+                    provider: Optional[str] = None, priority: int = 0) -> bool:
+        """将下载任务加入持久化队列"""
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    conn.execute('''
+                        INSERT OR REPLACE INTO task_queue
+                        (task_id, url, mode, favcat, provider, priority, state, attempts, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+                    ''', (task_id, url, mode, favcat, provider, priority, JobState.QUEUED,
+                          datetime.now(timezone.utc).isoformat(), datetime.now(timezone.utc).isoformat()))
+                    conn.commit()
+                return True
+            except sqlite3.Error as e:
+                print(f"Database error enqueuing job: {e}")
+                return False
 
+    def lease_job(self, owner: str, lease_seconds: float,
+                  provider_limits: Optional[Dict[str, int]] = None) -> Optional[Dict]:
+        """
+        领取一个待执行的任务，返回任务记录（attempts 已递增），没有可领取的任务时返回 None
+
+        除排队中的任务外，租约已过期（持有者崩溃或停止续约）的任务也会被重新领取。
+        provider_limits 为各下载来源的并发上限，已占满的来源不会被领取；
+        领取顺序依次为：优先级高者优先、当前占用槽位少的来源优先（来源间公平轮转）、先提交者优先
+        """
+        now = time.time()
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    conn.row_factory = sqlite3.Row
+                    active = dict(conn.execute('''
+                        SELECT COALESCE(provider, ''), COUNT(*) FROM task_queue
+                        WHERE state IN (?, ?) AND lease_expires_at >= ?
+                        GROUP BY provider
+                    ''', (JobState.LEASED, JobState.RUNNING, now)).fetchall())
+                    full = [provider for provider, limit in (provider_limits or {}).items()
+                            if active.get(provider, 0) >= limit]
+                    query = '''
+                        SELECT * FROM task_queue
+                        WHERE (state = ? OR (state IN (?, ?, ?, ?) AND lease_expires_at < ?))
+                    '''
+                    params = [JobState.QUEUED, JobState.LEASED, JobState.RUNNING, JobState.AWAITING,
+                              JobState.PROCESSING, now]
+                    if full:
+                        query += f" AND COALESCE(provider, '') NOT IN ({', '.join('?' * len(full))})"
+                        params.extend(full)
+                    query += " ORDER BY priority DESC"
+                    if active:
+                        query += f", CASE COALESCE(provider, '') {' '.join('WHEN ? THEN ?' for _ in active)} ELSE 0 END"
+                        for provider, count in active.items():
+                            params.extend((provider, count))
+                    query += ", rowid LIMIT 1"
+                    row = conn.execute(query, params).fetchone()
+                    if not row:
+                        return None
+                    conn.execute('''
+                        UPDATE task_queue
+                        SET state = ?, lease_owner = ?, lease_expires_at = ?, heartbeat_at = ?,
+                            attempts = attempts + 1, updated_at = ?
+                        WHERE task_id = ?
+                    ''', (JobState.LEASED, owner, now + lease_seconds, now,
+                          datetime.now(timezone.utc).isoformat(), row['task_id']))
+                    conn.commit()
+                    job = dict(row)
+                    job.update(state=JobState.LEASED, lease_owner=owner, attempts=job['attempts'] + 1)
+                    return job
+            except sqlite3.Error as e:
+                print(f"Database error leasing job: {e}")
+                return None
+
+    def set_job_state(self, task_id: str, state: str, provider: Optional[str] = None) -> bool:
+        """更新队列任务状态，结束（done）时同时释放租约；指定 provider 时同时更新任务的下载来源"""
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    if provider is not None:
+                        conn.execute('UPDATE task_queue SET provider = ? WHERE task_id = ?', (provider, task_id))
+                    if state == JobState.DONE:
+                        conn.execute(
+                            'UPDATE task_queue SET state = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? WHERE task_id = ?',
+                            (state, datetime.now(timezone.utc).isoformat(), task_id)
+                        )
+                    else:
+                        conn.execute(
+                            'UPDATE task_queue SET state = ?, updated_at = ? WHERE task_id = ?',
+                            (state, datetime.now(timezone.utc).isoformat(), task_id)
+                        )
+                    conn.commit()
+                return True
+            except sqlite3.Error as e:
+                print(f"Database error updating job state: {e}")
+                return False
+
+    def claim_job_slot(self, task_id: str, provider: str, limit: Optional[int] = None) -> Tuple[bool, Optional[str]]:
+        """
+        在来源槽位未占满时将任务切换到该来源并标记为执行中（占用槽位），返回 (是否成功, 切换前的来源)
+
+        用于执行函数之外的下载（如 aria2 种子失败后的兜底下载）；任务不在队列中时直接视为成功
+        """
+        now = time.time()
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    row = conn.execute('SELECT provider FROM task_queue WHERE task_id = ?', (task_id,)).fetchone()
+                    if not row:
+                        return True, None
+                    if limit:
+                        active = conn.execute('''
+                            SELECT COUNT(*) FROM task_queue
+                            WHERE COALESCE(provider, '') = ? AND state IN (?, ?) AND lease_expires_at >= ? AND task_id != ?
+                        ''', (provider, JobState.LEASED, JobState.RUNNING, now, task_id)).fetchone()[0]
+                        if active >= limit:
+                            return False, row[0]
+                    conn.execute(
+                        'UPDATE task_queue SET provider = ?, state = ?, updated_at = ? WHERE task_id = ?',
+                        (provider, JobState.RUNNING, datetime.now(timezone.utc).isoformat(), task_id)
+                    )
+                    conn.commit()
+                    return True, row[0]
+            except sqlite3.Error as e:
+                print(f"Database error claiming job slot: {e}")
+                return True, None
+
+    def heartbeat_jobs(self, owner: str, lease_seconds: float) -> int:
+        """为指定持有者的所有未结束任务续约，返回续约的任务数"""
+        now = time.time()
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    cursor = conn.execute(
+                        'UPDATE task_queue SET lease_expires_at = ?, heartbeat_at = ? WHERE lease_owner = ? AND state IN (?, ?, ?, ?)',
+                        (now + lease_seconds, now, owner, JobState.LEASED, JobState.RUNNING, JobState.AWAITING,
+                         JobState.PROCESSING)
+                    )
+                    conn.commit()
+                    return cursor.rowcount
+            except sqlite3.Error as e:
+                print(f"Database error renewing job leases: {e}")
+                return 0
+
+    def requeue_interrupted_jobs(self) -> int:
+        """将上次运行时已领取但未结束的任务重新排队（应用启动时调用），返回重新排队的任务数"""
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    cursor = conn.execute(
+                        'UPDATE task_queue SET state = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? WHERE state IN (?, ?, ?, ?)',
+                        (JobState.QUEUED, datetime.now(timezone.utc).isoformat(),
+                         JobState.LEASED, JobState.RUNNING, JobState.AWAITING, JobState.PROCESSING)
+                    )
+                    conn.commit()
+                    return cursor.rowcount
+            except sqlite3.Error as e:
+                print(f"Database error requeuing interrupted jobs: {e}")
+                return 0
+
+    def set_job_external_id(self, task_id: str, external_id: Optional[str]) -> bool:
+        """记录任务在外部下载器中的标识（如 aria2 gid），重启后据此继续跟踪未完成的外部下载"""
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    conn.execute(
+                        'UPDATE task_queue SET external_id = ?, updated_at = ? WHERE task_id = ?',
+                        (external_id, datetime.now(timezone.utc).isoformat(), task_id)
+                    )
+                    conn.commit()
+                return True
+            except sqlite3.Error as e:
+                print(f"Database error updating job external id: {e}")
+                return False
+
+    def get_job_external_id(self, task_id: str) -> Optional[str]:
+        """获取任务在外部下载器中的标识"""
+        try:
+            with self._get_conn() as conn:
+                row = conn.execute('SELECT external_id FROM task_queue WHERE task_id = ?', (task_id,)).fetchone()
+                return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"Database error getting job external id: {e}")
+            return None
+
+    def get_queue_counts(self) -> Dict[str, Dict[str, int]]:
+        """按下载来源统计队列中未结束的任务数：{来源: {状态: 数量}}"""
+        try:
+            with self._get_conn() as conn:
+                rows = conn.execute(
+                    "SELECT COALESCE(provider, ''), state, COUNT(*) FROM task_queue WHERE state != ? GROUP BY provider, state",
+                    (JobState.DONE,)
+                ).fetchall()
+                counts: Dict[str, Dict[str, int]] = {}
+                for provider, state, count in rows:
+                    counts.setdefault(provider, {})[state] = count
+                return counts
+        except sqlite3.Error as e:
+            print(f"Database error getting queue counts: {e}")
+            return {}
 
     def set_global_state(self, key: str, value: str) -> bool:
         """设置全局状态值"""
@@ -570,15 +1474,57 @@ class TaskDatabase:
 
     def get_global_state(self, key: str) -> Optional[str]:
         """获取全局状态值"""
+        try:
+            with self._get_conn() as conn:
+                cursor = conn.execute('SELECT value FROM global WHERE key = ?', (key,))
+                row = cursor.fetchone()
+                return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"Database error getting global state: {e}")
+            return None
+
+    def get_cached_gmetadata(self, key: str, max_age: float) -> Optional[Dict]:
+        """获取缓存的 gmetadata，不存在或获取时间早于 max_age 秒前时返回 None"""
+        try:
+            with self._get_conn() as conn:
+                row = conn.execute(
+                    'SELECT gmetadata FROM gmetadata_cache WHERE key = ? AND fetched_at >= ?',
+                    (key, time.time() - max_age)
+                ).fetchone()
+                return json.loads(row[0]) if row else None
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Database error getting cached gmetadata: {e}")
+            return None
+
+    def set_cached_gmetadata(self, key: str, gmetadata: Dict) -> bool:
+        """写入或更新 gmetadata 缓存"""
         with self.lock:
             try:
                 with self._get_conn() as conn:
-                    cursor = conn.execute('SELECT value FROM global WHERE key = ?', (key,))
-                    row = cursor.fetchone()
-                    return row[0] if row else None
+                    conn.execute(
+                        'INSERT OR REPLACE INTO gmetadata_cache (key, gmetadata, fetched_at) VALUES (?, ?, ?)',
+                        (key, json.dumps(gmetadata, ensure_ascii=False), time.time())
+                    )
+                    conn.commit()
+                return True
             except sqlite3.Error as e:
-                print(f"Database error getting global state: {e}")
-                return None
+                print(f"Database error caching gmetadata: {e}")
+                return False
+
+    def invalidate_cached_gmetadata(self, key: Optional[str] = None) -> int:
+        """删除指定键的 gmetadata 缓存，key 为 None 时清空全部缓存，返回删除的条目数"""
+        with self.lock:
+            try:
+                with self._get_conn() as conn:
+                    if key is None:
+                        cursor = conn.execute('DELETE FROM gmetadata_cache')
+                    else:
+                        cursor = conn.execute('DELETE FROM gmetadata_cache WHERE key = ?', (key,))
+                    conn.commit()
+                    return cursor.rowcount
+            except sqlite3.Error as e:
+                print(f"Database error invalidating cached gmetadata: {e}")
+                return 0
 
     def upsert_eh_favorites(self, favorites: List[Dict]) -> bool:
         """将 E-Hentai 收藏夹数据添加或更新到数据库 (UPSERT)"""
@@ -655,17 +1601,16 @@ class TaskDatabase:
 
     def get_eh_favorites_by_favcat(self, favcat_list: List[str]) -> List[Dict]:
         """根据收藏夹分类ID获取所有画廊"""
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    placeholders = ','.join('?' for _ in favcat_list)
-                    query = f"SELECT gid, token, favcat FROM eh_favorites WHERE favcat IN ({placeholders})"
-                    cursor = conn.execute(query, favcat_list)
-                    return [dict(row) for row in cursor.fetchall()]
-            except sqlite3.Error as e:
-                print(f"Database error getting EH favorites by favcat: {e}")
-                return []
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                placeholders = ','.join('?' for _ in favcat_list)
+                query = f"SELECT gid, token, favcat FROM eh_favorites WHERE favcat IN ({placeholders})"
+                cursor = conn.execute(query, favcat_list)
+                return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Database error getting EH favorites by favcat: {e}")
+            return []
 
     def delete_eh_favorites_by_gids(self, gids: List[int]) -> bool:
         """根据 GID 列表删除收藏夹记录"""
@@ -685,28 +1630,26 @@ class TaskDatabase:
 
     def get_eh_favorite_by_gid(self, gid: int) -> Optional[Dict]:
         """根据 GID 获取单个收藏夹项目"""
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.execute('SELECT * FROM eh_favorites WHERE gid = ?', (gid,))
-                    row = cursor.fetchone()
-                    return dict(row) if row else None
-            except sqlite3.Error as e:
-                print(f"Database error getting EH favorite by GID: {e}")
-                return None
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute('SELECT * FROM eh_favorites WHERE gid = ?', (gid,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+        except sqlite3.Error as e:
+            print(f"Database error getting EH favorite by GID: {e}")
+            return None
 
     def get_undownloaded_favorites(self) -> List[Dict]:
         """获取所有尚未下载的收藏夹项目"""
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.execute('SELECT * FROM eh_favorites WHERE downloaded = ?', (False,))
-                    return [dict(row) for row in cursor.fetchall()]
-            except sqlite3.Error as e:
-                print(f"Database error getting undownloaded favorites: {e}")
-                return []
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute('SELECT * FROM eh_favorites WHERE downloaded = ?', (False,))
+                return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Database error getting undownloaded favorites: {e}")
+            return []
 
     def mark_favorite_as_downloaded(self, gid: int) -> bool:
         """将指定 GID 的收藏夹项目标记为已下载"""
@@ -746,28 +1689,26 @@ class TaskDatabase:
 
     def get_favorites_without_komga_id(self) -> List[Dict]:
         """获取所有 komga 字段为空的收藏夹项目"""
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.execute('SELECT * FROM eh_favorites WHERE komga IS NULL')
-                    return [dict(row) for row in cursor.fetchall()]
-            except sqlite3.Error as e:
-                print(f"Database error getting favorites without komga id: {e}")
-                return []
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute('SELECT * FROM eh_favorites WHERE komga IS NULL')
+                return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Database error getting favorites without komga id: {e}")
+            return []
 
     def get_favorite_by_komga_id(self, komga_id: str) -> Optional[Dict]:
         """根据 Komga Book ID 获取单个收藏夹项目"""
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.execute('SELECT * FROM eh_favorites WHERE komga = ?', (komga_id,))
-                    row = cursor.fetchone()
-                    return dict(row) if row else None
-            except sqlite3.Error as e:
-                print(f"Database error getting favorite by Komga ID: {e}")
-                return None
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute('SELECT * FROM eh_favorites WHERE komga = ?', (komga_id,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+        except sqlite3.Error as e:
+            print(f"Database error getting favorite by Komga ID: {e}")
+            return None
 
     def get_latest_added_time(self) -> Optional[str]:
         """获取最新的收藏时间（带缓存）"""
@@ -776,16 +1717,15 @@ class TaskDatabase:
             return self._latest_added_cache
         
         # 缓存为空时查询数据库
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    cursor = conn.execute('SELECT MAX(added) FROM eh_favorites')
-                    row = cursor.fetchone()
-                    self._latest_added_cache = row[0] if row and row[0] else None
-                    return self._latest_added_cache
-            except sqlite3.Error as e:
-                print(f"Database error getting latest added time: {e}")
-                return None
+        try:
+            with self._get_conn() as conn:
+                cursor = conn.execute('SELECT MAX(added) FROM eh_favorites')
+                row = cursor.fetchone()
+                self._latest_added_cache = row[0] if row and row[0] else None
+                return self._latest_added_cache
+        except sqlite3.Error as e:
+            print(f"Database error getting latest added time: {e}")
+            return None
 
     def upsert_hath_status(self, clients: List[Dict]) -> bool:
         """
@@ -895,24 +1835,23 @@ class TaskDatabase:
         Returns:
             客户端状态字典或列表
         """
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    
-                    if client_id is not None:
-                        cursor = conn.execute(
-                            'SELECT * FROM hath_status WHERE client_id = ?',
-                            (client_id,)
-                        )
-                        row = cursor.fetchone()
-                        return dict(row) if row else None
-                    else:
-                        cursor = conn.execute('SELECT * FROM hath_status')
-                        return [dict(row) for row in cursor.fetchall()]
-            except sqlite3.Error as e:
-                print(f"Database error getting H@H status: {e}")
-                return None
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                
+                if client_id is not None:
+                    cursor = conn.execute(
+                        'SELECT * FROM hath_status WHERE client_id = ?',
+                        (client_id,)
+                    )
+                    row = cursor.fetchone()
+                    return dict(row) if row else None
+                else:
+                    cursor = conn.execute('SELECT * FROM hath_status')
+                    return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Database error getting H@H status: {e}")
+            return None
 
     def get_hath_status_changes(self) -> List[Dict]:
         """
@@ -921,18 +1860,17 @@ class TaskDatabase:
         Returns:
             状态发生变化的客户端列表
         """
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.execute('''
-                        SELECT * FROM hath_status 
-                        WHERE status != last_status OR last_status IS NULL
-                    ''')
-                    return [dict(row) for row in cursor.fetchall()]
-            except sqlite3.Error as e:
-                print(f"Database error getting H@H status changes: {e}")
-                return []
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.execute('''
+                    SELECT * FROM hath_status 
+                    WHERE status != last_status OR last_status IS NULL
+                ''')
+                return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Database error getting H@H status changes: {e}")
+            return []
 
     def normalize_url(self, url: str) -> tuple[str, str]:
         """
@@ -980,6 +1918,7 @@ class TaskDatabase:
         
         return normalized, site_type
 
+    @touches_tasks
     def upsert_komga_url_index(self, urls: List[Dict]) -> bool:
         """
         批量插入或更新 Komga URL 索引
@@ -1070,25 +2009,24 @@ class TaskDatabase:
         if not urls:
             return {}
         
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    # 规范化所有 URL
-                    normalized_urls = [self.normalize_url(url)[0] for url in urls]
-                    
-                    # 构建查询
-                    placeholders = ','.join('?' for _ in normalized_urls)
-                    query = f"SELECT normalized_url FROM komga_url_index WHERE normalized_url IN ({placeholders})"
-                    
-                    cursor = conn.execute(query, normalized_urls)
-                    existing = {row[0] for row in cursor.fetchall()}
-                    
-                    # 构建结果字典
-                    result = {norm_url: norm_url in existing for norm_url in normalized_urls}
-                    return result
-            except sqlite3.Error as e:
-                print(f"Database error checking URLs exist: {e}")
-                return {url: False for url in urls}
+        try:
+            with self._get_conn() as conn:
+                # 规范化所有 URL
+                normalized_urls = [self.normalize_url(url)[0] for url in urls]
+                
+                # 构建查询
+                placeholders = ','.join('?' for _ in normalized_urls)
+                query = f"SELECT normalized_url FROM komga_url_index WHERE normalized_url IN ({placeholders})"
+                
+                cursor = conn.execute(query, normalized_urls)
+                existing = {row[0] for row in cursor.fetchall()}
+                
+                # 构建结果字典
+                result = {norm_url: norm_url in existing for norm_url in normalized_urls}
+                return result
+        except sqlite3.Error as e:
+            print(f"Database error checking URLs exist: {e}")
+            return {url: False for url in urls}
 
     def query_book_ids_by_urls(self, urls: List[str]) -> Dict[str, Optional[Dict]]:
         """
@@ -1103,42 +2041,42 @@ class TaskDatabase:
         if not urls:
             return {}
         
-        with self.lock:
-            try:
-                with self._get_conn() as conn:
-                    conn.row_factory = sqlite3.Row
-                    
-                    # 规范化所有 URL
-                    url_mapping = {self.normalize_url(url)[0]: url for url in urls}
-                    normalized_urls = list(url_mapping.keys())
-                    
-                    # 构建查询
-                    placeholders = ','.join('?' for _ in normalized_urls)
-                    query = f"""
-                        SELECT normalized_url, book_id, original_url, site_type 
-                        FROM komga_url_index 
-                        WHERE normalized_url IN ({placeholders})
-                    """
-                    
-                    cursor = conn.execute(query, normalized_urls)
-                    results = {}
-                    
-                    for row in cursor.fetchall():
-                        results[row['normalized_url']] = {
-                            'book_id': row['book_id'],
-                            'original_url': row['original_url'],
-                            'site_type': row['site_type']
-                        }
-                    
-                    # 为未找到的 URL 添加 None
-                    for norm_url in normalized_urls:
-                        if norm_url not in results:
-                            results[norm_url] = None
-                    
-                    return results
-            except sqlite3.Error as e:
-                print(f"Database error querying book IDs by URLs: {e}")
-                return {self.normalize_url(url)[0]: None for url in urls}
-
-# 全局数据库实例
-task_db = TaskDatabase()
+        try:
+            with self._get_conn() as conn:
+                conn.row_factory = sqlite3.Row
+                
+                # 规范化所有 URL
+                url_mapping = {self.normalize_url(url)[0]: url for url in urls}
+                normalized_urls = list(url_mapping.keys())
+                
+                # 构建查询
+                placeholders = ','.join('?' for _ in normalized_urls)
+                query = f"""
+                    SELECT normalized_url, book_id, original_url, site_type 
+                    FROM komga_url_index 
+                    WHERE normalized_url IN ({placeholders})
+                """
+                
+                cursor = conn.execute(query, normalized_urls)
+                results = {}
+                
+                for row in cursor.fetchall():
+                    results[row['normalized_url']] = {
+                        'book_id': row['book_id'],
+                        'original_url': row['original_url'],
+                        'site_type': row['site_type']
+                    }
+                
+                # 为未找到的 URL 添加 None
+                for norm_url in normalized_urls:
+                    if norm_url not in results:
+                        results[norm_url] = None
+                
+                return results
+        except sqlite3.Error as e:
+            print(f"Database error querying book IDs by URLs: {e}")
+            return {self.normalize_url(url)[0]: None for url in urls}
+
+# 全局数据库实例，TASK_DB_PATH 环境变量可在导入前指定数据库路径（如脚本、测试使用临时数据库）；
+# 第一次访问时才初始化，封包进程池的工作进程导入 main.py 时不会打开数据库
+task_db = TaskDatabase(os.environ.get('TASK_DB_PATH', './data/tasks.db'), lazy=True)
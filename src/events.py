@@ -0,0 +1,72 @@
+"""
+进程内任务事件总线
+下载线程通过 event_bus.publish 发布任务增量（状态、进度、速度、新日志等），
+SSE 连接通过 subscribe 获取订阅，在两次推送之间按任务合并增量
+"""
+import threading
+from typing import Dict, List, Optional
+
+
+class Subscription:
+    """单个客户端的订阅：按 task_id 合并增量，普通字段只保留最新值，日志行累积"""
+
+    # 客户端消费过慢时，每个任务最多缓存的日志行数
+    MAX_LOG_LINES = 200
+
+    def __init__(self, bus: 'EventBus'):
+        self._bus = bus
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Dict] = {}
+
+    def push(self, task_id: str, fields: Dict):
+        with self._cond:
+            delta = self._pending.setdefault(task_id, {'id': task_id})
+            for key, value in fields.items():
+                if key == 'log':
+                    lines = delta.setdefault('log', [])
+                    lines.append(value)
+                    if len(lines) > self.MAX_LOG_LINES:
+                        del lines[0]
+                        delta['log_truncated'] = True
+                else:
+                    delta[key] = value
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> List[Dict]:
+        """等待并取出合并后的增量，超时没有新事件时返回空列表"""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            deltas, self._pending = list(self._pending.values()), {}
+        return deltas
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, task_id: str, fields: Dict):
+        """发布任务增量；没有客户端订阅时直接返回"""
+        if not self._subscribers:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(task_id, fields)
+
+
+event_bus = EventBus()
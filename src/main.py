@@ -1,6 +1,5 @@
-import os, re, shutil, sqlite3
+import os, re, shutil
 import json, html
-from datetime import datetime, timezone
 import subprocess # 导入 subprocess 模块
 import sys # 导入 sys 模块
 import functools
@@ -12,7 +11,6 @@ from flask_cors import CORS
 import concurrent.futures
 import langcodes
 import threading
-from io import StringIO
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -23,11 +21,16 @@ from providers import ehentai
 from providers import nhentai
 from providers import hitomi
 from providers import hdoujin
+from providers import page_fetcher
 from providers.ehtranslator import EhTagTranslator
-from utils import check_dirs, is_valid_zip, TaskStatus, parse_gallery_url, parse_interval_to_hours, sanitize_filename, truncate_filename
+from utils import check_dirs, is_valid_zip, TaskStatus, JobState, parse_gallery_url, parse_interval_to_hours, sanitize_filename, truncate_filename
 from notification import notify
 import cbztool
+import metadata_cache
 from database import task_db
+from events import event_bus
+from task_queue import TaskQueue, AwaitingFuture, PROVIDERS
+from pipeline import Pipeline, PipelineJob, Stage
 from config import load_config, save_config
 from metadata_extractor import MetadataExtractor, parse_filename
 from migrate import migrate_ini_to_yaml
@@ -126,15 +129,20 @@ logging.getLogger('werkzeug').addFilter(StatsFilter())
 
 # 创建一个线程池用于并发处理任务
 executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+# 下载任务通过持久化队列执行，重启后未完成的任务自动恢复
+task_queue = TaskQueue(task_db, max_workers=5)
 
 tasks = {}
 tasks_lock = threading.Lock()
 
 class TaskInfo:
-    def __init__(self, future, logger, log_buffer):
+    # 变化时通过事件总线推送给前端的字段
+    EVENT_FIELDS = ('status', 'error', 'filename', 'progress', 'downloaded', 'total_size', 'speed')
+
+    def __init__(self, future, logger, task_id=None):
+        self.task_id = task_id
         self.future = future
         self.logger = logger
-        self.log_buffer = log_buffer
         self.status = TaskStatus.IN_PROGRESS  # "完成"、"取消"、"错误"
         self.error = None
         self.filename = None # 初始 filename 为 None
@@ -145,6 +153,14 @@ class TaskInfo:
         self.cancelled = False  # 取消标志
         self.aria2_gid = None  # Aria2 下载任务的 gid
 
+    def __setattr__(self, name, value):
+        changed = name in self.EVENT_FIELDS and self.__dict__.get('task_id') and self.__dict__.get(name, value) != value
+        super().__setattr__(name, value)
+        if changed:
+            # 内存中的任务状态同样会合并进 API 响应，变化时递增任务数据版本号（ETag）
+            task_db.touch()
+            event_bus.publish(self.task_id, {name: value})
+
 class SafeDict(dict):
     def __missing__(self, key):
         return '{' + key + '}'
@@ -172,6 +188,7 @@ def init_global_logger():
         formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
         
         # Handler 1: 写入文件
+        check_dirs(os.path.dirname(LOG_FILE))
         file_handler = RotatingFileHandler(LOG_FILE, maxBytes=2*1024*1024, backupCount=5, encoding='utf-8')
         file_handler.setFormatter(formatter)
         logger.addHandler(file_handler)
@@ -180,10 +197,24 @@ def init_global_logger():
         add_console_handler(logger, formatter)
     return logger
 
-global_logger = init_global_logger()
+# 日志处理器在启动时（__main__）才添加：封包进程池的工作进程会以 __mp_main__ 重新导入本模块，不应打开日志文件
+global_logger = logging.getLogger("app")
+
+class TaskLogHandler(logging.Handler):
+    """将任务日志逐条追加写入数据库 task_logs 表"""
+    def __init__(self, task_id):
+        super().__init__()
+        self.task_id = task_id
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+            task_db.append_task_log(self.task_id, line)
+            event_bus.publish(self.task_id, {'log': line})
+        except Exception:
+            self.handleError(record)
 
 def get_task_logger(task_id):
-    log_buffer = StringIO()
     logger = logging.getLogger(f"task_{task_id}")
     logger.setLevel(logging.INFO)
 
@@ -193,10 +224,10 @@ def get_task_logger(task_id):
 
     formatter = logging.Formatter(f'%(asctime)s [%(levelname)s] [task:{task_id}] %(message)s')
 
-    # Handler 1: 写入内存缓冲区 (用于 API)
-    buffer_handler = logging.StreamHandler(log_buffer)
-    buffer_handler.setFormatter(formatter)
-    logger.addHandler(buffer_handler)
+    # Handler 1: 追加写入数据库日志表 (用于 API)
+    db_handler = TaskLogHandler(task_id)
+    db_handler.setFormatter(formatter)
+    logger.addHandler(db_handler)
 
     # Handler 2: 写入终端 (用于 Docker logs)
     add_console_handler(logger, formatter)
@@ -204,7 +235,7 @@ def get_task_logger(task_id):
     # 阻止日志向上传播到 root logger，避免 werkzeug 环境下重复输出
     logger.propagate = False
 
-    return logger, log_buffer
+    return logger
 
 def update_eh_funds(eh_funds):
     """更新 eh_funds 到 app.config 和数据库"""
@@ -237,11 +268,44 @@ def check_config(app_instance=None):
     app_instance.config['KEEP_ORIGINAL_FILE'] = general.get('keep_original_file', False)
     app_instance.config['PREFER_JAPANESE_TITLE'] = general.get('prefer_japanese_title', True)
     app_instance.config['MOVE_PATH'] = str(general.get('move_path', '')).rstrip('/') or None
+    # 任务归档期限，留空表示不归档
+    archive_after = str(general.get('archive_tasks_after', '') or '').strip()
+    archive_after_hours = parse_interval_to_hours(archive_after) if archive_after else None
+    if archive_after and archive_after_hours is None:
+        logging.error(f"Invalid 'general.archive_tasks_after': {archive_after}. Must include time unit (m/h/d). Task archiving disabled.")
+    app_instance.config['TASK_ARCHIVE_AFTER_HOURS'] = archive_after_hours
+
+    # 画廊元数据缓存有效期
+    gmetadata_cache_ttl = str(general.get('gmetadata_cache_ttl', '') or '').strip()
+    gmetadata_cache_hours = parse_interval_to_hours(gmetadata_cache_ttl) if gmetadata_cache_ttl else None
+    if gmetadata_cache_ttl and gmetadata_cache_hours is None:
+        logging.error(f"Invalid 'general.gmetadata_cache_ttl': {gmetadata_cache_ttl}. Must include time unit (m/h/d). Gmetadata cache disabled.")
+    metadata_cache.configure(gmetadata_cache_hours)
+
+    # 下载并发设置：总工作线程数及各下载来源的并发上限
+    download_config = config_data.get('download', {})
+    max_workers = download_config.get('max_workers') or 5
+    provider_limits = {}
+    for provider in PROVIDERS:
+        limit = download_config.get(provider)
+        if isinstance(limit, int) and limit > 0:
+            provider_limits[provider] = limit
+    app_instance.config['DOWNLOAD_MAX_WORKERS'] = max_workers
+    app_instance.config['DOWNLOAD_PROVIDER_LIMITS'] = provider_limits
+    task_queue.configure(max_workers=max_workers, provider_limits=provider_limits)
+    download_pipeline.configure(process_workers=download_config.get('package_workers') or 2)
+    page_fetcher.configure('nhentai', workers=download_config.get('nhentai_page_workers'))
+    page_fetcher.configure('hitomi', workers=download_config.get('hitomi_page_workers'))
 
     # 高级设置
     advanced = config_data.get('advanced', {})
     app_instance.config['TAGS_TRANSLATION'] = advanced.get('tags_translation', False)
     app_instance.config['REMOVE_ADS'] = advanced.get('remove_ads', False)
+    # CBZ 中需要 deflate 压缩的格式，图片默认以 ZIP_STORED 原样存储
+    deflate_formats = advanced.get('cbz_deflate_formats', cbztool.DEFAULT_DEFLATE_FORMATS)
+    if isinstance(deflate_formats, str):
+        deflate_formats = [fmt for fmt in deflate_formats.split(',') if fmt.strip()]
+    app_instance.config['CBZ_DEFLATE_FORMATS'] = list(deflate_formats or [])
     app_instance.config['AGGRESSIVE_SERIES_DETECTION'] = advanced.get('aggressive_series_detection', False)
     app_instance.config['OPENAI_SERIES_DETECTION'] = advanced.get('openai_series_detection', False)
     app_instance.config['PREFER_OPENAI_SERIES'] = advanced.get('prefer_openai_series', False)
@@ -525,30 +589,66 @@ def get_eh_mode(config, mode):
     else:
         return "torrent"
 
-def send_to_aria2(url=None, torrent=None, dir=None, out=None, logger=None, task_id=None, tasks=None, tasks_lock=None):
+def get_download_provider(url, mode):
+    """判断下载任务占用的来源槽位：E-Hentai 种子下载由 aria2 执行，单独计数"""
+    if 'nhentai.net' in url:
+        return 'nhentai'
+    if 'hitomi.la' in url:
+        return 'hitomi'
+    if 'hdoujin.org' in url:
+        return 'hdoujin'
+    if get_eh_mode(app.config, mode) == 'torrent':
+        return 'aria2'
+    return 'ehentai'
+
+def start_aria2_download(url=None, torrent=None, dir=None, out=None, logger=None, task_id=None, tasks=None, tasks_lock=None):
+    """
+    提交到 aria2 并交给监控线程跟踪，返回下载结束时给出 aria2 文件路径的 Future，提交失败时返回 None
+
+    任务上次运行时提交的下载仍在 aria2 中时（应用重启后恢复任务），直接继续跟踪该下载
+    """
     # 检查任务是否被取消
     if task_id:
         check_task_cancelled(task_id, tasks, tasks_lock)
 
-    rpc = aria2.Aria2RPC(app.config.get('ARIA2_SERVER'), app.config.get('ARIA2_TOKEN'))
-    result = None
-    if url != None:
-        result = rpc.add_uri(url, dir=dir, out=out)
-        if logger: logger.info(result)
-    elif torrent != None:
-        result = rpc.add_torrent(torrent, dir=dir, out=out)
-        if not app.config.get('KEEP_TORRENTS') == True:
-            os.remove(torrent)
-        if logger: logger.info(result)
-    else:
-        if logger: logger.error("send_to_aria2: 必须提供 url 或 torrent 参数")
-        return None
+    # 所有任务共用同一个监控器及其 RPC 连接，由监控线程统一轮询下载状态
+    monitor = aria2.get_monitor(app.config.get('ARIA2_SERVER'), app.config.get('ARIA2_TOKEN'))
+    rpc = monitor.rpc
 
-    if result is None or 'result' not in result:
-        if logger: logger.error("send_to_aria2: 无法获取有效的下载任务结果")
-        return None
+    gid = task_db.get_job_external_id(task_id) if task_id else None
+    if gid:
+        try:
+            status = rpc.tell_status(gid).get('result', {}).get('status')
+        except Exception:
+            status = None
+        if status and status not in ('removed', 'error'):
+            if logger: logger.info(f"继续跟踪上次提交的 Aria2 任务，gid: {gid}")
+            if torrent != None and not app.config.get('KEEP_TORRENTS') == True:
+                os.remove(torrent)
+        else:
+            gid = None
+
+    if not gid:
+        result = None
+        if url != None:
+            result = rpc.add_uri(url, dir=dir, out=out)
+            if logger: logger.info(result)
+        elif torrent != None:
+            result = rpc.add_torrent(torrent, dir=dir, out=out)
+            if not app.config.get('KEEP_TORRENTS') == True:
+                os.remove(torrent)
+            if logger: logger.info(result)
+        else:
+            if logger: logger.error("send_to_aria2: 必须提供 url 或 torrent 参数")
+            return None
+
+        if result is None or 'result' not in result:
+            if logger: logger.error("send_to_aria2: 无法获取有效的下载任务结果")
+            return None
 
-    gid = result['result']
+        gid = result['result']
+        if task_id:
+            task_db.set_job_external_id(task_id, gid)
 
     # 保存 gid 到任务信息中
     if task_id and tasks and tasks_lock:
@@ -562,14 +662,19 @@ def send_to_aria2(url=None, torrent=None, dir=None, out=None, logger=None, task_
     if task_id:
         check_task_cancelled(task_id, tasks, tasks_lock)
 
-    # 监视 aria2 的下载进度
-    file = rpc.listen_status(gid, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
-    
+    # 交给监控线程跟踪下载进度
+    return monitor.watch(gid, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+
+
+def finish_aria2_download(file, logger=None, task_id=None, tasks=None, tasks_lock=None):
+    """aria2 下载结束后清除 gid，并将 aria2 中的文件路径映射为本地路径"""
     # 下载完成或取消后，清除 gid
     if task_id and tasks and tasks_lock:
         with tasks_lock:
             if task_id in tasks:
                 tasks[task_id].aria2_gid = None
+    if task_id:
+        task_db.set_job_external_id(task_id, None)
     if file == None:
         return None
     else:
@@ -587,6 +692,45 @@ def send_to_aria2(url=None, torrent=None, dir=None, out=None, logger=None, task_
     return local_file_path
 
 
+def park_aria2_download(download, resume, logger=None, task_id=None, tasks=None, tasks_lock=None):
+    """
+    挂起等待 aria2 下载的任务，立即返回 AwaitingFuture 以释放工作线程和来源槽位
+
+    download 为 start_aria2_download 返回的 Future，下载结束后在线程池中调用 resume(本地文件路径)，
+    resume 返回的后处理 Future 结束时 AwaitingFuture 随之结束
+    """
+    if download is None:
+        return resume(None)
+
+    parked = AwaitingFuture()
+    parked.set_running_or_notify_cancel()
+
+    def chain(done):
+        if done.exception() is not None:
+            parked.set_exception(done.exception())
+        else:
+            parked.set_result(done.result())
+
+    def resume_task(done):
+        try:
+            task_db.set_job_state(task_id, JobState.PROCESSING)
+            result = resume(finish_aria2_download(done.result(), logger, task_id, tasks, tasks_lock))
+        except Exception as e:
+            parked.set_exception(e)
+            return
+        if isinstance(result, AwaitingFuture):
+            # resume 又提交了一个 aria2 下载（如死种改用 archive 下载），任务继续挂起等待
+            task_db.set_job_state(task_id, JobState.AWAITING)
+        if isinstance(result, concurrent.futures.Future):
+            result.add_done_callback(chain)
+        else:
+            parked.set_result(result)
+
+    # 回调在监控线程中触发，后续可能涉及兜底下载和流水线背压等待，转交线程池执行
+    download.add_done_callback(lambda done: executor.submit(resume_task, done))
+    return parked
+
+
 def check_task_cancelled(task_id, tasks=None, tasks_lock=None):
     # 如果没有传入 tasks 和 tasks_lock，从 app.config 获取
     if tasks is None:
@@ -820,42 +964,149 @@ def prepare_metadata_and_path(metadata, filename, app, logger=None):
 
     return comicinfo_metadata, move_file_path
 
-def finalize_downloaded_file(dl, comicinfo_metadata, move_file_path, task_id, app, logger=None, tasks=None, tasks_lock=None):
+def replay_log_records(logger, records):
+    """将子进程中收集的日志写入任务日志"""
+    if not logger:
+        return
+    for level, message in records:
+        getattr(logger, level, logger.info)(message)
+
+def package_stage(job):
+    """后处理流水线 package 阶段：在进程池中写入 ComicInfo.xml、删除广告页并重新打包"""
+    ctx = job.context
+    logger = ctx['logger']
+    check_task_cancelled(job.task_id, ctx['tasks'], ctx['tasks_lock'])
+    try:
+        cbz, records = download_pipeline.run_in_process(
+            cbztool.package_archive, ctx['dl'], ctx['comicinfo_metadata'],
+            bool(app.config.get('KEEP_ORIGINAL_FILE', False)), bool(app.config.get('REMOVE_ADS', False)),
+            app.config.get('CBZ_DEFLATE_FORMATS')
+        )
+    except cbztool.PackageError as e:
+        replay_log_records(logger, e.records)
+        if logger: logger.error(f"Post-download processing failed: {e}")
+        raise
+    replay_log_records(logger, records)
+
+    if not cbz or not is_valid_zip(cbz):
+        # 此处直接抛出异常，任务失败回调会发送失败通知
+        raise ValueError("Downloaded file is not a valid zip archive.")
+    ctx['cbz'] = cbz
+
+def finalize_stage(job):
+    """后处理流水线 finalize 阶段：移动文件、触发 Komga 扫描并完成任务"""
+    ctx = job.context
+    task_id = job.task_id
+    logger = ctx['logger']
+    tasks = ctx['tasks']
+    tasks_lock = ctx['tasks_lock']
     try:
         check_task_cancelled(task_id, tasks, tasks_lock)
-        if not dl:
-            return None
 
+        dl = ctx['dl']
+        move_file_path = ctx['target_path']
         if not move_file_path:
             move_file_path = os.path.dirname(dl)
 
         if not os.path.basename(move_file_path).lower().endswith(('.7z', '.zip', '.cbz')):
             move_file_path = os.path.join(move_file_path, os.path.basename(dl))
 
-        cbz = cbztool.write_xml_to_zip(dl, comicinfo_metadata, app=app, logger=logger)
-        if cbz and is_valid_zip(cbz):
-            move_file_path = os.path.splitext(move_file_path)[0] + '.cbz'
-            os.makedirs(os.path.dirname(move_file_path), exist_ok=True)
-            shutil.move(cbz, move_file_path)
-            if logger: logger.info(f"文件移动到指定目录: {move_file_path}")
-            dl = move_file_path
-        else:
-            return None
+        move_file_path = os.path.splitext(move_file_path)[0] + '.cbz'
+        os.makedirs(os.path.dirname(move_file_path), exist_ok=True)
+        shutil.move(ctx['cbz'], move_file_path)
+        if logger: logger.info(f"文件移动到指定目录: {move_file_path}")
 
         check_task_cancelled(task_id, tasks, tasks_lock)
 
-        if app.config['KOMGA_TOGGLE'] and is_valid_zip(dl):
+        if app.config['KOMGA_TOGGLE'] and is_valid_zip(move_file_path):
             if app.config['KOMGA_LIBRARY_ID']:
                 kmg = komga.KomgaAPI(server=app.config['KOMGA_SERVER'], username=app.config['KOMGA_USERNAME'], password=app.config['KOMGA_PASSWORD'], logger=logger)
                 if app.config['KOMGA_LIBRARY_ID']:
                     kmg.scan_library(app.config['KOMGA_LIBRARY_ID'])
 
-        return dl
-
     except Exception as e:
         if logger: logger.error(f"Post-download processing failed: {e}")
         raise e
 
+    task_db.update_task(task_id, output_path=move_file_path)
+    complete_download_task(task_id, ctx, logger)
+
+def complete_download_task(task_id, ctx, logger=None):
+    """标记任务完成并执行完成通知、收藏夹同步等后续流程"""
+    tasks = ctx['tasks']
+    tasks_lock = ctx['tasks_lock']
+    original_url = ctx['url']
+    gmetadata = ctx['gmetadata']
+    metadata = ctx['metadata']
+    comicinfo_metadata = ctx['comicinfo_metadata']
+    favcat = ctx['favcat']
+    is_nhentai = ctx['is_nhentai']
+    is_hitomi = ctx['is_hitomi']
+    is_hdoujin = ctx['is_hdoujin']
+
+    if logger: logger.info(f"Task {task_id} completed successfully.")
+    if tasks_lock:
+        with tasks_lock:
+            if task_id in tasks:
+                tasks[task_id].status = TaskStatus.COMPLETED
+    task_db.update_task(task_id, status=TaskStatus.COMPLETED)
+
+    # 发送完成通知
+    if app.config['NOTIFICATION'].get('enable'):
+        event_data = {
+            "url": original_url,
+            "task_id": task_id,
+            "gmetadata": gmetadata,
+            "metadata": metadata,
+            }
+        notify(event="task.complete", data=event_data, logger=logger, notification_config=app.config['NOTIFICATION'])
+
+    # 如果是收藏夹任务 (且不是nhentai、hitomi和hdoujin)，执行特殊流程
+    if favcat is not False and not is_nhentai and not is_hitomi and not is_hdoujin:
+        if logger: logger.info(f"Task {task_id} is a favorite E-Hentai gallery, triggering special process...")
+        gid = gmetadata.get('gid')
+        if gid:
+            favorite_record = task_db.get_eh_favorite_by_gid(gid)
+            if favorite_record:
+                # 检查 favcat 是否需要更新
+                favorite_favcat = favorite_record.get('favcat')
+                if favorite_favcat and str(favorite_favcat) != str(favcat):
+                    if logger: logger.info(f"Favorite record found for gid {gid} with a different favcat. Updating from {favorite_favcat} to {favcat}.")
+                    task_db.update_favorite_favcat(gid, str(favcat))
+            else:
+                if logger: logger.info(f"No favorite record found for gid {gid}. Adding to online and local favorites.")
+                token = gmetadata.get('token')
+                if token:
+                    # 只有 EHentaiTools 才有 add_to_favorites 方法
+                    if app.config['EH_TOOLS'] and hasattr(app.config['EH_TOOLS'], 'add_to_favorites'):
+                        if app.config['EH_TOOLS'].add_to_favorites(gid=gid, token=token, favcat=str(favcat)):
+                            # 添加到线上成功后，同步到本地数据库
+                            # title 存储从 ComicInfo 提取的标题（Komga 标题）
+                            # downloaded 字段会在下次同步时由 trigger_undownloaded_favorites_download 标记
+                            title = comicinfo_metadata.get('Title') if comicinfo_metadata else None
+
+                            fav_data = [{
+                                'url': f"https://exhentai.org/g/{gid}/{token}/",
+                                'title': title,
+                                'favcat': str(favcat)
+                            }]
+                            task_db.add_eh_favorites(fav_data)
+                            if logger: logger.info(f"Successfully added gid {gid} as a local favorite.")
+                        else:
+                            if logger: logger.error(f"Failed to add gid {gid} to online favorites.")
+                    else:
+                        if logger: logger.warning(f"EHentaiTools not available for adding favorites")
+                else:
+                    if logger: logger.warning(f"Could not get token from gmetadata for favorite task {task_id}.")
+        else:
+            if logger: logger.warning(f"Could not get gid from gmetadata for favorite task {task_id}.")
+
+# 下载后处理流水线：封包在进程池中执行，收尾在线程池中执行，阶段之间以有界队列衔接
+download_pipeline = Pipeline([
+    Stage('package', package_stage, workers=2, max_queue=4),
+    Stage('finalize', finalize_stage, workers=2, max_queue=8),
+], preload=['cbztool'])
+
 def download_gallery_task(url, mode, task_id, logger=None, favcat=False, tasks=None, tasks_lock=None):
     if logger: logger.info(f"Task {task_id} started, downloading from: {url}, favcat: {favcat}")
     
@@ -995,7 +1246,11 @@ def download_gallery_task(url, mode, task_id, logger=None, favcat=False, tasks=N
     predicted_path = None
     eh_mode = get_eh_mode(app.config, mode)
     if is_nhentai or is_hitomi or is_hdoujin or original_url != url:
-        predicted_path = path
+        # nhentai 和 hitomi 下载时直接写入 <path>.cbz
+        if isinstance(gallery_tool, (nhentai.NHentaiTools, hitomi.HitomiTools)):
+            predicted_path = path + '.cbz'
+        else:
+            predicted_path = path
     elif app.config.get('DOWNLOAD_FORMAT') == 'archive' or eh_mode == 'archive':
         real_dir = app.config.get('REAL_DOWNLOAD_DIR') or '.'
         predicted_path = os.path.join(real_dir, filename)
@@ -1003,6 +1258,28 @@ def download_gallery_task(url, mode, task_id, logger=None, favcat=False, tasks=N
     if predicted_path:
         task_db.update_task(task_id, output_path=predicted_path)
 
+    def submit_downloaded(dl):
+        # 检查是否被取消
+        check_task_cancelled(task_id, tasks, tasks_lock)
+
+        if not dl:
+            raise ValueError("Downloaded file is not a valid zip archive.")
+        task_db.update_task(task_id, output_path=dl)
+
+        # 下载完成，封包和收尾交给后处理流水线（下游队列已满时在此等待），下载槽位随即释放
+        return download_pipeline.submit(PipelineJob(
+            task_id, dl=dl, target_path=target_path, comicinfo_metadata=comicinfo_metadata,
+            logger=logger, tasks=tasks, tasks_lock=tasks_lock,
+            url=original_url, gmetadata=gmetadata, metadata=metadata, favcat=favcat,
+            is_nhentai=is_nhentai, is_hitomi=is_hitomi, is_hdoujin=is_hdoujin,
+        ))
+
+    def download_fallback(fallback_url, fallback_tool):
+        # 兜底下载可能在 aria2 恢复回调中执行（不在队列工作线程内），先占用兜底来源的槽位，遵守其并发上限
+        provider = get_download_provider(fallback_url, None)
+        with task_queue.provider_slot(task_id, provider, check=lambda: check_task_cancelled(task_id, tasks, tasks_lock)):
+            return fallback_tool.download_gallery(fallback_url, path, task_id, tasks, tasks_lock)
+
     dl = None
     # 对于非 E-Hentai 平台，直接下载
     if is_nhentai or is_hitomi or is_hdoujin or original_url != url:
@@ -1024,25 +1301,29 @@ def download_gallery_task(url, mode, task_id, logger=None, favcat=False, tasks=N
 
         if result:
             if result[0] == 'torrent':
-                dl = send_to_aria2(torrent=result[1], dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
-                check_task_cancelled(task_id, tasks, tasks_lock)
-                if dl is None:
-                    # 死种尝试 archive
-                    if gp_value < 10 and gmetadata:
-                        if logger:
-                            logger.info(f"GP 不足 (当前: {gp_available})，尝试兜底方案下载")
-                        fallback_url, fallback_tool = try_fallback_download(gmetadata, logger)
-                        if fallback_url:
-                            url = fallback_url
-                            gallery_tool = fallback_tool
-
-                            dl = gallery_tool.download_gallery(url, path, task_id, tasks, tasks_lock)
-                    else:
-                        result = app.config['EH_TOOLS'].get_download_link(url=url, mode='archive')
-                        dl = send_to_aria2(url=result[1], dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+                def resume_torrent(dl):
+                    check_task_cancelled(task_id, tasks, tasks_lock)
+                    if dl is None:
+                        # 死种尝试 archive
+                        if gp_value < 10 and gmetadata:
+                            if logger:
+                                logger.info(f"GP 不足 (当前: {gp_available})，尝试兜底方案下载")
+                            fallback_url, fallback_tool = try_fallback_download(gmetadata, logger)
+                            if fallback_url:
+                                dl = download_fallback(fallback_url, fallback_tool)
+                        else:
+                            archive = app.config['EH_TOOLS'].get_download_link(url=url, mode='archive')
+                            download = start_aria2_download(url=archive[1], dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+                            return park_aria2_download(download, submit_downloaded, logger, task_id, tasks, tasks_lock)
+                    return submit_downloaded(dl)
+
+                # 种子下载可能持续数小时，挂起任务等待 aria2 完成，不占用下载槽位
+                download = start_aria2_download(torrent=result[1], dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+                return park_aria2_download(download, resume_torrent, logger, task_id, tasks, tasks_lock)
             elif result[0] == 'archive':
                 if app.config.get('ARIA2_TOGGLE'):
-                    dl = send_to_aria2(url=result[1], dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+                    download = start_aria2_download(url=result[1], dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+                    return park_aria2_download(download, submit_downloaded, logger, task_id, tasks, tasks_lock)
                 else:
                     dl = app.config['EH_TOOLS']._download(url=result[1], path=path, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
         else:
@@ -1052,150 +1333,112 @@ def download_gallery_task(url, mode, task_id, logger=None, favcat=False, tasks=N
 
             # 方案1: 尝试从 API 中找到有效的种子链接
             torrent_path = app.config['EH_TOOLS'].get_deleted_gallery_torrent(gmetadata)
-            if torrent_path:
-                if logger:
-                    logger.info("找到可用的种子文件，尝试下载...")
-                dl = send_to_aria2(torrent=torrent_path, dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+
+            def resume_deleted(dl):
                 check_task_cancelled(task_id, tasks, tasks_lock)
                 if dl:
                     if logger:
                         logger.info("通过种子下载成功")
-                else:
-                    if logger:
-                        logger.warning("种子下载失败，继续尝试其他方案")
-            else:
-                if logger:
-                    logger.warning("未找到可用的种子文件")
-
-            # 方案2: 如果种子下载失败，尝试回退 hitomi -> nhentai
-            if not dl and gmetadata:
-                fallback_url, fallback_tool = try_fallback_download(gmetadata, logger)
-                if fallback_url:
-                    url = fallback_url
-                    gallery_tool = fallback_tool
-
-                    dl = gallery_tool.download_gallery(url, path, task_id, tasks, tasks_lock)
-                    if dl and logger:
-                        logger.info("兜底下载成功")
-
-            # 如果所有方案都失败，抛出错误
-            if not dl:
-                raise ValueError("无法获取下载链接：画廊可能已被删除且所有回退方案均失败")
+                    return submit_downloaded(dl)
+                if torrent_path and logger:
+                    logger.warning("种子下载失败，继续尝试其他方案")
+
+                # 方案2: 如果种子下载失败，尝试回退 hitomi -> nhentai
+                if gmetadata:
+                    fallback_url, fallback_tool = try_fallback_download(gmetadata, logger)
+                    if fallback_url:
+                        dl = download_fallback(fallback_url, fallback_tool)
+                        if dl and logger:
+                            logger.info("兜底下载成功")
+
+                # 如果所有方案都失败，抛出错误
+                if not dl:
+                    raise ValueError("无法获取下载链接：画廊可能已被删除且所有回退方案均失败")
+                return submit_downloaded(dl)
 
-    # 检查是否被取消
-    check_task_cancelled(task_id, tasks, tasks_lock)
-
-    if dl:
-        task_db.update_task(task_id, output_path=dl)
+            if torrent_path:
+                if logger:
+                    logger.info("找到可用的种子文件，尝试下载...")
+                # 与正常种子下载一样挂起任务等待 aria2 完成，下载失败时在恢复回调中继续尝试方案2
+                download = start_aria2_download(torrent=torrent_path, dir=app.config.get('ARIA2_DOWNLOAD_DIR'), out=filename, logger=logger, task_id=task_id, tasks=tasks, tasks_lock=tasks_lock)
+                return park_aria2_download(download, resume_deleted, logger, task_id, tasks, tasks_lock)
+            if logger:
+                logger.warning("未找到可用的种子文件")
+            return resume_deleted(None)
 
-    # 统一后处理：封包和移动文件
-    final_path = finalize_downloaded_file(dl, comicinfo_metadata, target_path, task_id, app, logger, tasks, tasks_lock)
+    return submit_downloaded(dl)
 
-    # 验证处理结果
-    if final_path and is_valid_zip(final_path):
-        task_db.update_task(task_id, output_path=final_path)
-        
-        if logger: logger.info(f"Task {task_id} completed successfully.")
+def handle_task_failure(e, url, task_id, logger, tasks, tasks_lock):
+    """根据异常将任务标记为取消或错误，并发送失败通知"""
+    error_msg = str(e)
+    if "cancelled by user" in error_msg:
+        if logger: logger.info(f"Task {task_id} was cancelled by user")
         if tasks_lock:
             with tasks_lock:
                 if task_id in tasks:
-                    tasks[task_id].status = TaskStatus.COMPLETED
-        task_db.update_task(task_id, status=TaskStatus.COMPLETED)
+                    tasks[task_id].status = TaskStatus.CANCELLED
+        # 更新数据库状态
+        task_db.update_task(task_id, status=TaskStatus.CANCELLED)
+    else:
+        if logger: logger.error(f"Task {task_id} failed with error: {e}")
+        if tasks_lock:
+            with tasks_lock:
+                if task_id in tasks:
+                    tasks[task_id].status = TaskStatus.ERROR
+                    tasks[task_id].error = str(e)
+        # 更新数据库状态
+        task_db.update_task(task_id, status=TaskStatus.ERROR, error=str(e))
         
-        # 发送完成通知
         if app.config['NOTIFICATION'].get('enable'):
             event_data = {
-                "url": original_url,
                 "task_id": task_id,
-                "gmetadata": gmetadata,
-                "metadata": metadata,
-                }
-            notify(event="task.complete", data=event_data, logger=logger, notification_config=app.config['NOTIFICATION'])
-
-        # 如果是收藏夹任务 (且不是nhentai、hitomi和hdoujin)，执行特殊流程
-        if favcat is not False and not is_nhentai and not is_hitomi and not is_hdoujin:
-            if logger: logger.info(f"Task {task_id} is a favorite E-Hentai gallery, triggering special process...")
-            gid = gmetadata.get('gid')
-            if gid:
-                favorite_record = task_db.get_eh_favorite_by_gid(gid)
-                if favorite_record:
-                    # 检查 favcat 是否需要更新
-                    favorite_favcat = favorite_record.get('favcat')
-                    if favorite_favcat and str(favorite_favcat) != str(favcat):
-                        if logger: logger.info(f"Favorite record found for gid {gid} with a different favcat. Updating from {favorite_favcat} to {favcat}.")
-                        task_db.update_favorite_favcat(gid, str(favcat))
-                else:
-                    if logger: logger.info(f"No favorite record found for gid {gid}. Adding to online and local favorites.")
-                    token = gmetadata.get('token')
-                    if token:
-                        # 只有 EHentaiTools 才有 add_to_favorites 方法
-                        if app.config['EH_TOOLS'] and hasattr(app.config['EH_TOOLS'], 'add_to_favorites'):
-                            if app.config['EH_TOOLS'].add_to_favorites(gid=gid, token=token, favcat=str(favcat)):
-                                # 添加到线上成功后，同步到本地数据库
-                                # title 存储从 ComicInfo 提取的标题（Komga 标题）
-                                # downloaded 字段会在下次同步时由 trigger_undownloaded_favorites_download 标记
-                                title = comicinfo_metadata.get('Title') if comicinfo_metadata else None
-                                
-                                fav_data = [{
-                                    'url': f"https://exhentai.org/g/{gid}/{token}/",
-                                    'title': title,
-                                    'favcat': str(favcat)
-                                }]
-                                task_db.add_eh_favorites(fav_data)
-                                if logger: logger.info(f"Successfully added gid {gid} as a local favorite.")
-                            else:
-                                if logger: logger.error(f"Failed to add gid {gid} to online favorites.")
-                        else:
-                            if logger: logger.warning(f"EHentaiTools not available for adding favorites")
-                    else:
-                        if logger: logger.warning(f"Could not get token from gmetadata for favorite task {task_id}.")
-            else:
-                if logger: logger.warning(f"Could not get gid from gmetadata for favorite task {task_id}.")
-        return # 返回 metadata 以便装饰器或调用者处理完成通知
-    else:
-        error_message = "Downloaded file is not a valid zip archive."
-        # 此处直接抛出异常，装饰器会捕获并发送失败通知
-        raise ValueError(error_message)
-    
+                "url": url,
+                "error": str(e)
+            }
+            notify(event="task.error", data=event_data, logger=logger, notification_config=app.config['NOTIFICATION'])
+
 def task_failure_processing(url, task_id, logger, tasks, tasks_lock):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             try:
-                return func(*args, **kwargs)
+                result = func(*args, **kwargs)
             except Exception as e:
-                error_msg = str(e)
-                if "cancelled by user" in error_msg:
-                    if logger: logger.info(f"Task {task_id} was cancelled by user")
-                    if tasks_lock:
-                        with tasks_lock:
-                            if task_id in tasks:
-                                tasks[task_id].status = TaskStatus.CANCELLED
-                    # 更新数据库状态
-                    from database import task_db
-                    task_db.update_task(task_id, status=TaskStatus.CANCELLED)
-                else:
-                    if logger: logger.error(f"Task {task_id} failed with error: {e}")
-                    if tasks_lock:
-                        with tasks_lock:
-                            if task_id in tasks:
-                                tasks[task_id].status = TaskStatus.ERROR
-                                tasks[task_id].error = str(e)
-                    # 更新数据库状态
-                    from database import task_db
-                    task_db.update_task(task_id, status=TaskStatus.ERROR, error=str(e))
-                    
-                    if app.config['NOTIFICATION'].get('enable'):
-                        event_data = {
-                            "task_id": task_id,
-                            "url": url,
-                            "error": str(e)
-                        }
-                        notify(event="task.error", data=event_data, logger=logger, notification_config=app.config['NOTIFICATION'])
+                handle_task_failure(e, url, task_id, logger, tasks, tasks_lock)
                 raise e
+            if isinstance(result, concurrent.futures.Future):
+                # 后处理流水线中抛出的异常同样按任务失败处理
+                def on_done(done):
+                    if done.exception() is not None:
+                        handle_task_failure(done.exception(), url, task_id, logger, tasks, tasks_lock)
+                result.add_done_callback(on_done)
+            return result
         return wrapper
     return decorator
 
+def run_queued_download(job, future):
+    """持久化队列的任务执行函数，为重启后恢复的任务重建内存中的 TaskInfo"""
+    task_id = job['task_id']
+    url = job['url']
+    resumed = False
+    with tasks_lock:
+        task = tasks.get(task_id)
+        if task is None:
+            logger = get_task_logger(task_id)
+            tasks[task_id] = TaskInfo(future, logger, task_id)
+            resumed = True
+        else:
+            logger = task.logger
+    if resumed:
+        logger.info(f"Task {task_id} resumed from the persistent queue (attempt {job['attempts']})")
+
+    # 队列中 favcat 以字符串保存，还原为 '0'-'9' 或 False
+    favcat = job.get('favcat')
+    favcat = favcat if favcat and str(favcat).isdigit() else False
+
+    decorated_download_task = task_failure_processing(url, task_id, logger, tasks, tasks_lock)(download_gallery_task)
+    return decorated_download_task(url, job.get('mode'), task_id, logger, favcat, tasks, tasks_lock)
+
 # 确保这个路由在所有 API 路由之后定义
 # 只处理 GET 请求，避免拦截 API 的 POST/PUT/DELETE 等请求
 @app.route('/', defaults={'path': ''}, methods=['GET'])
@@ -1225,6 +1468,7 @@ if __name__ == '__main__':
     is_docker = os.path.exists('/.dockerenv') or os.environ.get('DOCKER_CONTAINER', False)
     debug_mode = not is_docker
     app.debug = debug_mode
+    init_global_logger()
 
     # 在加载配置前，先执行迁移脚本
     migrate_ini_to_yaml()
@@ -1238,8 +1482,11 @@ if __name__ == '__main__':
     app.config['TASKS'] = tasks
     app.config['TASKS_LOCK'] = tasks_lock
     app.config['EXECUTOR'] = executor
+    app.config['TASK_QUEUE'] = task_queue
+    app.config['DOWNLOAD_PIPELINE'] = download_pipeline
     # 将函数和类放入 app.config 供 Blueprint 使用
     app.config['GET_TASK_LOGGER'] = get_task_logger
+    app.config['GET_DOWNLOAD_PROVIDER'] = get_download_provider
     app.config['TASK_FAILURE_PROCESSING'] = task_failure_processing
     app.config['DOWNLOAD_GALLERY_TASK'] = download_gallery_task
     app.config['TASK_INFO_CLASS'] = TaskInfo
@@ -1270,23 +1517,19 @@ if __name__ == '__main__':
             else:
                 global_logger.error("任务迁移失败")
 
-        # 将重启前的进行中任务标记为失败
-        global_logger.info("正在检查并标记重启前的进行中任务...")
-        try:
-            with sqlite3.connect('./data/tasks.db') as conn:
-                cursor = conn.execute('SELECT id FROM tasks WHERE status = ?', (TaskStatus.IN_PROGRESS,))
-                in_progress_tasks = cursor.fetchall()
-                if in_progress_tasks:
-                    for task_row in in_progress_tasks:
-                        task_id = task_row[0]
-                        conn.execute('UPDATE tasks SET status = ?, error = ?, updated_at = ? WHERE id = ?',
-                                   (TaskStatus.ERROR, '任务因应用重启而中断', datetime.now(timezone.utc).isoformat(), task_id))
-                    conn.commit()
-                    global_logger.info(f"已将 {len(in_progress_tasks)} 个进行中任务标记为失败")
-                else:
-                    global_logger.info("没有发现进行中的任务")
-        except sqlite3.Error as e:
-            global_logger.error(f"标记进行中任务失败时发生数据库错误: {e}")
+        # 重启前已领取但未结束的队列任务重新排队，其余残留的进行中任务标记为失败
+        global_logger.info("正在检查重启前的进行中任务...")
+        requeued_count = task_db.requeue_interrupted_jobs()
+        if requeued_count:
+            global_logger.info(f"已将 {requeued_count} 个被中断的任务重新排队")
+        failed_count = task_db.fail_in_progress_tasks('任务因应用重启而中断')
+        if failed_count:
+            global_logger.info(f"已将 {failed_count} 个进行中任务标记为失败")
+        if not requeued_count and not failed_count:
+            global_logger.info("没有发现进行中的任务")
+
+        # 启动持久化下载队列（同时恢复排队中的任务）
+        task_queue.start(run_queued_download)
 
         # 初始化并启动调度器
         init_scheduler(app)
@@ -1298,6 +1541,7 @@ if __name__ == '__main__':
         # 端口优先从环境变量 API_PORT 读取,默认5001
         app.run(host='0.0.0.0', port=app.config.get('PORT', 5001), debug=app.debug)
     finally:
+        task_queue.stop()
         executor.shutdown()
         # 确保在主应用终止时关闭子进程
         stop_notification_process()
@@ -0,0 +1,67 @@
+"""
+gmetadata 持久化缓存
+各站点工具的 get_gmetadata 通过 cached_gmetadata 装饰，结果按站点及画廊标识存入数据库，
+重试、补抓元数据、兜底下载等流程在缓存有效期内重复获取同一画廊时不再请求站点 API
+"""
+import functools
+import inspect
+
+from database import task_db
+
+
+# 缓存有效期（小时），为 0 或 None 时不使用缓存，由 check_config 根据 general.gmetadata_cache_ttl 设置
+_ttl_hours = 24 * 7
+
+# 各站点工具的进程内缓存的清空函数，invalidate 时一并调用
+_memory_caches = []
+
+
+def configure(ttl_hours):
+    global _ttl_hours
+    _ttl_hours = ttl_hours
+
+
+def cached_gmetadata(key_func):
+    """
+    装饰 get_gmetadata(self, url)，key_func(self, url) 返回缓存键，无法解析链接时返回 None（不缓存）
+
+    被装饰的方法增加 refresh 参数：为 True 时忽略缓存重新获取，并用新结果覆盖缓存；
+    方法自身声明了 refresh 参数时会传入，以便同时跳过站点工具的进程内缓存
+    """
+    def decorator(func):
+        passes_refresh = 'refresh' in inspect.signature(func).parameters
+
+        @functools.wraps(func)
+        def wrapper(self, url, *args, refresh=False, **kwargs):
+            key = key_func(self, url) if _ttl_hours else None
+            if key and not refresh:
+                cached = task_db.get_cached_gmetadata(key, _ttl_hours * 3600)
+                if cached is not None:
+                    return cached
+            if passes_refresh:
+                kwargs['refresh'] = refresh
+            gmetadata = func(self, url, *args, **kwargs)
+            if key:
+                store(key, gmetadata)
+            return gmetadata
+        return wrapper
+    return decorator
+
+
+def store(key, gmetadata):
+    """写入缓存，不缓存获取失败或 API 返回错误（如 token 无效）的结果"""
+    if _ttl_hours and gmetadata and 'error' not in gmetadata:
+        task_db.set_cached_gmetadata(key, gmetadata)
+
+
+def register_memory_cache(clear_func):
+    """登记进程内缓存的清空函数，清空全部缓存时调用"""
+    _memory_caches.append(clear_func)
+
+
+def invalidate(key=None):
+    """删除指定键的缓存，key 为 None 时清空全部缓存（包括已登记的进程内缓存）"""
+    if key is None:
+        for clear_func in _memory_caches:
+            clear_func()
+    return task_db.invalidate_cached_gmetadata(key)
@@ -0,0 +1,166 @@
+"""
+下载后处理流水线
+下载线程只负责网络 I/O，下载完成后把文件交给后续阶段依次处理：
+  package  —— 在进程池中解压、检测广告页并重新打包（CPU 密集，不占用下载槽位，也不争用主进程的 GIL）
+  finalize —— 在线程池中移动文件、触发 Komga 扫描、发送通知等收尾工作
+阶段之间通过有界队列衔接：下游队列已满时上游阻塞等待（背压），避免下载速度远超打包速度时堆积大量待处理文件
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class PipelineJob:
+    """流经各阶段的任务上下文，future 在最后一个阶段完成或任一阶段出错时结束"""
+
+    def __init__(self, task_id: str, **context):
+        self.task_id = task_id
+        self.context = context
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+
+
+class Stage:
+    def __init__(self, name: str, handler: Callable[[PipelineJob], None], workers: int = 1, max_queue: int = 4):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.next: Optional['Stage'] = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+
+        # 阶段指标
+        self.processed = 0
+        self.failed = 0
+        self.active = 0
+        self.blocked_seconds = 0.0  # 上游因本阶段队列已满而阻塞的累计时长
+        self.wait_seconds = 0.0     # 任务在本阶段队列中等待的累计时长
+        self.busy_seconds = 0.0     # 本阶段处理任务的累计时长
+
+    def start(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f'Pipeline-{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, job: PipelineJob):
+        """放入本阶段队列，队列已满时阻塞直到有空位"""
+        started = time.monotonic()
+        self._queue.put((job, time.monotonic()))
+        blocked = time.monotonic() - started
+        if blocked > 0.001:
+            with self._lock:
+                self.blocked_seconds += blocked
+
+    def _loop(self):
+        while True:
+            job, enqueued = self._queue.get()
+            started = time.monotonic()
+            with self._lock:
+                self.wait_seconds += started - enqueued
+                self.active += 1
+            try:
+                self.handler(job)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                job.future.set_exception(e)
+            else:
+                with self._lock:
+                    self.processed += 1
+                if self.next is not None:
+                    self.next.put(job)
+                else:
+                    job.future.set_result(job.context.get('result'))
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.busy_seconds += time.monotonic() - started
+
+    def stats(self) -> Dict:
+        with self._lock:
+            done = self.processed + self.failed
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'queued': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'processed': self.processed,
+                'failed': self.failed,
+                'blocked_seconds': round(self.blocked_seconds, 3),
+                'avg_wait_seconds': round(self.wait_seconds / done, 3) if done else 0,
+                'avg_busy_seconds': round(self.busy_seconds / done, 3) if done else 0,
+            }
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], process_workers: int = 2, preload: Sequence[str] = ()):
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+        self.process_workers = process_workers
+        # forkserver 启动时预先导入的模块，工作进程 fork 后直接继承，无需各自导入
+        self.preload = list(preload)
+        self._process_pool = None
+        self._pool_lock = threading.Lock()
+
+    def submit(self, job: PipelineJob) -> Future:
+        """将任务放入第一个阶段（队列已满时阻塞），返回整条流水线完成时结束的 Future"""
+        for stage in self.stages:
+            stage.start()
+        self.stages[0].put(job)
+        return job.future
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._process_pool is None:
+                context = None
+                # 工作进程由单线程的 forkserver 进程 fork 出来，而不是直接从运行着下载线程、Flask 线程的主进程 fork
+                # （fork 时其他线程持有的锁会在子进程中永远无法释放）；工作进程会以 __mp_main__ 导入主模块，
+                # 因此主模块在导入时不能有副作用（main.py 的启动逻辑都在 __main__ 中执行）
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(self.preload)
+                self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers, mp_context=context)
+            return self._process_pool
+
+    def run_in_process(self, fn: Callable, *args):
+        """
+        在进程池中执行 fn 并等待结果，fn 必须定义在可导入的模块中（而不是 main.py），fn 的参数和返回值必须可以被 pickle
+
+        工作进程异常退出（如被 OOM 杀死）后整个进程池都不能再使用：丢弃进程池并重建，当前任务重试一次，
+        再次失败时只让当前任务失败，后续任务使用新的进程池
+        """
+        for attempt in range(2):
+            pool = self._get_process_pool()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                with self._pool_lock:
+                    if self._process_pool is pool:
+                        self._process_pool = None
+                pool.shutdown(wait=False)
+                if attempt:
+                    raise
+
+    def configure(self, process_workers: Optional[int] = None):
+        """调整进程池大小，已创建的进程池在当前任务完成后关闭，下次使用时按新大小重建"""
+        if not process_workers or process_workers == self.process_workers:
+            return
+        with self._pool_lock:
+            self.process_workers = process_workers
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False)
+                self._process_pool = None
+
+    def stats(self) -> List[Dict]:
+        return [stage.stats() for stage in self.stages]
@@ -3,6 +3,8 @@ import requests
 import base64
 import time
 import sys
+import threading
+from concurrent.futures import Future
 
 class Aria2RPC:
     def __init__(self, url, token, logger=None):
@@ -10,8 +12,10 @@ class Aria2RPC:
         self.token = token
         self.headers = {'Content-Type':'application/json'}
         self.id = 0
+        # 复用 HTTP 连接，监控线程每个周期都会请求一次
+        self.session = requests.Session()
 
-    def _request(self, method, params=None, max_retries=3):
+    def _request(self, method, params=None, max_retries=3, with_token=True):
         """发送 JSON-RPC 请求,带重试机制"""
         last_exception = None
         
@@ -22,12 +26,12 @@ class Aria2RPC:
                     'jsonrpc': '2.0',
                     'id': self.id,
                     'method': method,
-                    'params': [f'token:{self.token}']
+                    'params': [f'token:{self.token}'] if with_token else []
                 }
                 if params:
                     payload['params'].extend(params)
                 
-                response = requests.post(
+                response = self.session.post(
                     self.url,
                     headers=self.headers,
                     data=json.dumps(payload),
@@ -101,179 +105,18 @@ class Aria2RPC:
     def get_version(self):
         return self._request('aria2.getVersion')
 
-    def listen_status(self, gid, logger=None, task_id=None, tasks=None, tasks_lock=None):
-        """监听 aria2 下载状态,只依赖 aria2 的明确失败信号"""
-        last_logged_progress = -1  # 上次记录的进度
-        last_log_time = 0  # 上次记录日志的时间
-        first_error_time = None  # 首次 API 错误时间
-        max_error_duration = 3600  # 最大容忍 API 错误时长(秒),默认1小时
-        elapsed_time = 0  # 无进度累计时间(用于判断死种)
-        elapsed_time_2 = 0  # 无速度累计时间(用于判断死种)
+    def multicall(self, calls, max_retries=3):
+        """
+        通过 system.multicall 在一次请求中执行多个方法
 
-        while True:
-            # 检查任务是否被用户取消
-            if task_id and tasks and tasks_lock:
-                with tasks_lock:
-                    task = tasks.get(task_id)
-                    if task and task.cancelled:
-                        if logger:
-                            logger.info(f"任务 {task_id} 被用户取消，正在停止 aria2 下载")
-                        try:
-                            self.remove(gid)
-                        except Exception as e:
-                            if logger:
-                                logger.warning(f"停止 aria2 下载失败: {e}")
-                        return None
-
-            try:
-                result = self.tell_status(gid)
-                first_error_time = None  # API 请求成功,重置错误时间
-                status = result['result']['status']
-                
-                # 如果下载文件已经存在, 且未在 Aria2 开启 --allow-overwrite, 则会报错并返回 errorCode 13, 此时直接返回文件路径
-                if status == 'error' and result['result'].get('errorCode') == "13":
-                    if logger:
-                        logger.info("文件已存在，下载任务将被跳过")
-                    return result['result']['files'][0]['path']
-                
-                completelen = int(result['result']['completedLength'])
-                totallen = int(result['result']['totalLength'])
-                download_speed = int(result['result']['downloadSpeed'])
-
-                # 计算进度百分比
-                progress = 0
-                if totallen > 0:
-                    progress = min(100, int((completelen / totallen) * 100))
-
-                # 更新任务进度信息
-                if task_id and tasks and tasks_lock:
-                    with tasks_lock:
-                        if task_id in tasks:
-                            tasks[task_id].progress = progress
-                            tasks[task_id].downloaded = completelen
-                            tasks[task_id].total_size = totallen
-                            tasks[task_id].speed = download_speed
-
-                # 智能日志策略：根据进度调整日志频率
-                current_time = time.time()
-                
-                # 早期频繁打印（前10%）
-                if progress < 10:
-                    log_interval = 10  # 10秒
-                    progress_threshold = 2  # 2%
-                # 中期适中（10%-90%）
-                elif progress < 90:
-                    log_interval = 30  # 30秒
-                    progress_threshold = 5  # 5%
-                # 后期频繁（90%+）
-                else:
-                    log_interval = 10  # 10秒
-                    progress_threshold = 2  # 2%
-                
-                should_log = (
-                    abs(progress - last_logged_progress) >= progress_threshold or
-                    current_time - last_log_time >= log_interval or
-                    status in ['complete', 'error', 'removed']
-                )
-                
-                if should_log and logger:
-                    # 格式化速度显示
-                    if download_speed >= 1024 * 1024:
-                        speed_str = f"{download_speed / (1024 * 1024):.2f} MB/s"
-                    elif download_speed >= 1024:
-                        speed_str = f"{download_speed / 1024:.2f} KB/s"
-                    else:
-                        speed_str = f"{download_speed} B/s"
-                    
-                    logger.info(
-                        f"Aria2 [{status}] {progress}% "
-                        f"({self._format_size(completelen)}/{self._format_size(totallen)}) "
-                        f"@ {speed_str}"
-                    )
-                    last_logged_progress = progress
-                    last_log_time = current_time
-
-                # 文件已完成长度达到总长度
-                if completelen >= totallen and totallen > 0:
-                    if logger:
-                        logger.info("文件已下载完成，等待最多 5 秒确认 status 完成")
-                    wait_sec = 0
-                    while status != 'complete' and wait_sec < 5:
-                        time.sleep(1)
-                        wait_sec += 1
-                        result = self.tell_status(gid)
-                        status = result['result']['status']
-                    if status != 'complete' and logger:
-                        logger.info("status 仍未更新为 complete，但已视为完成")
-                    return result['result']['files'][0]['path']
-
-                # 任务完成
-                if status == 'complete':
-                    if logger:
-                        logger.info("Download complete.")
-                    time.sleep(5)
-                    return result['result']['files'][0]['path']
-
-                # 任务失败或被移除
-                if status in ['removed', 'error']:
-                    if logger:
-                        error_msg = result['result'].get('errorMessage', 'Unknown error')
-                        logger.error(f"Aria2 任务失败: status={status}, error={error_msg}")
-                    return None
-
-                # 判断死种: 5分钟无进度
-                if completelen == 0:
-                    elapsed_time += 5
-                    if elapsed_time >= 300:
-                        if logger:
-                            logger.warning("No progress for 5 minutes, removing task.")
-                        self.remove(gid)
-                        return None
-                else:
-                    elapsed_time = 0  # 有进度则重置计时器
-
-                # 判断死种: 2小时无速度
-                if download_speed == 0:
-                    elapsed_time_2 += 5
-                    if elapsed_time_2 >= 7200:
-                        if logger:
-                            logger.warning("No speed for 2 hours, removing task.")
-                        self.remove(gid)
-                        return None
-                else:
-                    elapsed_time_2 = 0  # 有速度则重置计时器
-
-                # 其他状态(active, waiting, paused)继续监听
-                time.sleep(5)
-                
-            except Exception as e:
-                # API 请求失败,记录警告但不立即判定任务失败
-                current_time = time.time()
-                
-                # 记录首次错误时间
-                if first_error_time is None:
-                    first_error_time = current_time
-                
-                # 计算持续错误时长
-                error_duration = current_time - first_error_time
-                
-                if logger:
-                    logger.warning(
-                        f"获取 aria2 状态时发生异常，将继续重试 "
-                        f"(已持续 {int(error_duration)}秒): {e}"
-                    )
-                
-                # 超过最大容忍时长,判定为 aria2 服务不可用
-                if error_duration > max_error_duration:
-                    if logger:
-                        logger.error(
-                            f"连续 {int(error_duration)}秒 无法连接 aria2 服务，"
-                            f"判定为服务不可用，任务失败"
-                        )
-                    return None
-                
-                time.sleep(5)
-                continue
+        calls 为 [(方法名, 参数列表), ...]，返回的 result 与 calls 一一对应，
+        成功的调用为 [返回值]，失败的调用为 {'code': ..., 'message': ...}
+        """
+        methods = [
+            {'methodName': method, 'params': [f'token:{self.token}', *(params or [])]}
+            for method, params in calls
+        ]
+        return self._request('system.multicall', [methods], max_retries=max_retries, with_token=False)
 
     def _format_size(self, bytes_value):
         """格式化文件大小显示"""
@@ -282,3 +125,285 @@ class Aria2RPC:
                 return f"{bytes_value:.1f} {unit}"
             bytes_value /= 1024
         return f"{bytes_value:.1f} TB"
+
+
+class _Watch:
+    """监控中的单个 aria2 下载"""
+
+    def __init__(self, gid, logger=None, task_id=None, tasks=None, tasks_lock=None):
+        self.gid = gid
+        self.logger = logger
+        self.task_id = task_id
+        self.tasks = tasks
+        self.tasks_lock = tasks_lock
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+
+        self.last_logged_progress = -1  # 上次记录的进度
+        self.last_log_time = 0  # 上次记录日志的时间
+        self.first_error_time = None  # 首次 API 错误时间
+        self.no_progress_since = None  # 开始无进度的时间(用于判断死种)
+        self.no_speed_since = None  # 开始无速度的时间(用于判断死种)
+        self.complete_since = None  # 已下载完成、等待 status 变为 complete 的起始时间
+        self.resolve_at = None  # 延迟返回结果的时间点
+        self.result = None
+
+
+class Aria2Monitor:
+    """
+    aria2 下载状态监控器
+
+    单个后台线程通过 system.multicall 在一次请求中查询所有被监控 gid 的状态，
+    更新任务进度、判断完成/失败/死种，并通过 Future 唤醒等待结果的任务；
+    没有被监控的下载时线程自动退出，下次 watch 时重新启动
+    """
+
+    STATUS_KEYS = ['gid', 'status', 'completedLength', 'totalLength', 'downloadSpeed',
+                   'errorCode', 'errorMessage', 'files']
+
+    def __init__(self, url, token, interval=5, max_error_duration=3600):
+        self.rpc = Aria2RPC(url, token)
+        self.interval = interval
+        self.max_error_duration = max_error_duration  # 最大容忍 API 错误时长(秒),默认1小时
+        self._watches = {}
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def watch(self, gid, logger=None, task_id=None, tasks=None, tasks_lock=None) -> Future:
+        """开始监控 gid，返回的 Future 在下载结束时给出文件路径（失败、取消或死种时为 None）"""
+        watch = _Watch(gid, logger, task_id, tasks, tasks_lock)
+        with self._lock:
+            self._watches[gid] = watch
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='Aria2Monitor', daemon=True)
+                self._thread.start()
+            self._lock.notify()
+        return watch.future
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._watches:
+                    self._thread = None
+                    return
+                watches = list(self._watches.values())
+            self._poll(watches)
+            # 有等待确认完成的下载时缩短轮询间隔
+            pending = any(w.complete_since or w.resolve_at for w in watches if not w.future.done())
+            with self._lock:
+                self._lock.wait(1 if pending else self.interval)
+
+    def _resolve(self, watch, result):
+        with self._lock:
+            self._watches.pop(watch.gid, None)
+        watch.future.set_result(result)
+
+    def _poll(self, watches):
+        now = time.time()
+        active = []
+        for watch in watches:
+            if watch.resolve_at is not None:
+                if now >= watch.resolve_at:
+                    self._resolve(watch, watch.result)
+                continue
+            if self._is_cancelled(watch):
+                continue
+            active.append(watch)
+        if not active:
+            return
+
+        try:
+            response = self.rpc.multicall(
+                [('aria2.tellStatus', [watch.gid, self.STATUS_KEYS]) for watch in active], max_retries=1
+            )
+            results = response['result']
+        except Exception as e:
+            for watch in active:
+                self._handle_error(watch, e, now)
+            return
+
+        for watch, result in zip(active, results):
+            if isinstance(result, list) and result:
+                watch.first_error_time = None  # API 请求成功,重置错误时间
+                try:
+                    self._handle_status(watch, result[0], now)
+                except Exception as e:
+                    self._handle_error(watch, e, now)
+            else:
+                message = result.get('message') if isinstance(result, dict) else result
+                self._handle_error(watch, Exception(message), now)
+
+    def _is_cancelled(self, watch):
+        """检查任务是否被用户取消，取消时停止 aria2 下载"""
+        if not (watch.task_id and watch.tasks and watch.tasks_lock):
+            return False
+        with watch.tasks_lock:
+            task = watch.tasks.get(watch.task_id)
+            cancelled = bool(task and task.cancelled)
+        if cancelled:
+            if watch.logger:
+                watch.logger.info(f"任务 {watch.task_id} 被用户取消，正在停止 aria2 下载")
+            try:
+                self.rpc.remove(watch.gid)
+            except Exception as e:
+                if watch.logger:
+                    watch.logger.warning(f"停止 aria2 下载失败: {e}")
+            self._resolve(watch, None)
+        return cancelled
+
+    def _handle_status(self, watch, status_info, now):
+        logger = watch.logger
+        status = status_info['status']
+
+        # 如果下载文件已经存在, 且未在 Aria2 开启 --allow-overwrite, 则会报错并返回 errorCode 13, 此时直接返回文件路径
+        if status == 'error' and status_info.get('errorCode') == "13":
+            if logger:
+                logger.info("文件已存在，下载任务将被跳过")
+            self._resolve(watch, status_info['files'][0]['path'])
+            return
+
+        completelen = int(status_info['completedLength'])
+        totallen = int(status_info['totalLength'])
+        download_speed = int(status_info['downloadSpeed'])
+
+        # 计算进度百分比
+        progress = 0
+        if totallen > 0:
+            progress = min(100, int((completelen / totallen) * 100))
+
+        # 更新任务进度信息
+        if watch.task_id and watch.tasks and watch.tasks_lock:
+            with watch.tasks_lock:
+                task = watch.tasks.get(watch.task_id)
+                if task:
+                    task.progress = progress
+                    task.downloaded = completelen
+                    task.total_size = totallen
+                    task.speed = download_speed
+
+        # 智能日志策略：根据进度调整日志频率
+        # 早期频繁打印（前10%）
+        if progress < 10:
+            log_interval = 10  # 10秒
+            progress_threshold = 2  # 2%
+        # 中期适中（10%-90%）
+        elif progress < 90:
+            log_interval = 30  # 30秒
+            progress_threshold = 5  # 5%
+        # 后期频繁（90%+）
+        else:
+            log_interval = 10  # 10秒
+            progress_threshold = 2  # 2%
+
+        should_log = (
+            abs(progress - watch.last_logged_progress) >= progress_threshold or
+            now - watch.last_log_time >= log_interval or
+            status in ['complete', 'error', 'removed']
+        )
+
+        if should_log and logger and watch.complete_since is None:
+            # 格式化速度显示
+            if download_speed >= 1024 * 1024:
+                speed_str = f"{download_speed / (1024 * 1024):.2f} MB/s"
+            elif download_speed >= 1024:
+                speed_str = f"{download_speed / 1024:.2f} KB/s"
+            else:
+                speed_str = f"{download_speed} B/s"
+
+            logger.info(
+                f"Aria2 [{status}] {progress}% "
+                f"({self.rpc._format_size(completelen)}/{self.rpc._format_size(totallen)}) "
+                f"@ {speed_str}"
+            )
+            watch.last_logged_progress = progress
+            watch.last_log_time = now
+
+        # 文件已完成长度达到总长度，等待最多 5 秒确认 status 完成
+        if completelen >= totallen and totallen > 0:
+            if watch.complete_since is None:
+                watch.complete_since = now
+                if logger and status != 'complete':
+                    logger.info("文件已下载完成，等待最多 5 秒确认 status 完成")
+            if status == 'complete' or now - watch.complete_since >= 5:
+                if status != 'complete' and logger:
+                    logger.info("status 仍未更新为 complete，但已视为完成")
+                self._resolve(watch, status_info['files'][0]['path'])
+            return
+
+        # 任务完成，等待 5 秒后返回
+        if status == 'complete':
+            if logger:
+                logger.info("Download complete.")
+            watch.result = status_info['files'][0]['path']
+            watch.resolve_at = now + 5
+            return
+
+        # 任务失败或被移除
+        if status in ['removed', 'error']:
+            if logger:
+                error_msg = status_info.get('errorMessage', 'Unknown error')
+                logger.error(f"Aria2 任务失败: status={status}, error={error_msg}")
+            self._resolve(watch, None)
+            return
+
+        # 判断死种: 5分钟无进度
+        if completelen == 0:
+            watch.no_progress_since = watch.no_progress_since or now
+            if now - watch.no_progress_since >= 300:
+                if logger:
+                    logger.warning("No progress for 5 minutes, removing task.")
+                self.rpc.remove(watch.gid)
+                self._resolve(watch, None)
+                return
+        else:
+            watch.no_progress_since = None  # 有进度则重置计时器
+
+        # 判断死种: 2小时无速度
+        if download_speed == 0:
+            watch.no_speed_since = watch.no_speed_since or now
+            if now - watch.no_speed_since >= 7200:
+                if logger:
+                    logger.warning("No speed for 2 hours, removing task.")
+                self.rpc.remove(watch.gid)
+                self._resolve(watch, None)
+        else:
+            watch.no_speed_since = None  # 有速度则重置计时器
+
+        # 其他状态(active, waiting, paused)继续监听
+
+    def _handle_error(self, watch, e, now):
+        """API 请求失败,记录警告但不立即判定任务失败"""
+        # 记录首次错误时间
+        if watch.first_error_time is None:
+            watch.first_error_time = now
+
+        # 计算持续错误时长
+        error_duration = now - watch.first_error_time
+
+        if watch.logger:
+            watch.logger.warning(
+                f"获取 aria2 状态时发生异常，将继续重试 "
+                f"(已持续 {int(error_duration)}秒): {e}"
+            )
+
+        # 超过最大容忍时长,判定为 aria2 服务不可用
+        if error_duration > self.max_error_duration:
+            if watch.logger:
+                watch.logger.error(
+                    f"连续 {int(error_duration)}秒 无法连接 aria2 服务，"
+                    f"判定为服务不可用，任务失败"
+                )
+            self._resolve(watch, None)
+
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(url, token) -> Aria2Monitor:
+    """按 aria2 服务地址和 token 获取共享的监控器"""
+    with _monitors_lock:
+        monitor = _monitors.get((url, token))
+        if monitor is None:
+            monitor = _monitors[(url, token)] = Aria2Monitor(url, token)
+        return monitor
@@ -1,9 +1,14 @@
 import re, os, json, time
+import threading
 import requests
 from bs4 import BeautifulSoup
+from concurrent.futures import Future
 from datetime import datetime
 
 from utils import check_dirs
+import metadata_cache
+from metadata_cache import cached_gmetadata, store as store_cached_gmetadata
+from providers.page_fetcher import TokenBucket
 
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.102 Safari/537.36',
@@ -70,11 +75,127 @@ def male_only_taglist():
     except Exception as e:
         print(f"获取 male_only_taglist 时发生错误: {e}")
 
+def _gmetadata_cache_key(tools, url):
+    searchUrl = re.search(r'g\/(\d+?)\/(.+?)(\/|$)', url)
+    return f"ehentai:{searchUrl.group(1)}/{searchUrl.group(2)}" if searchUrl else None
+
+
+class GdataClient:
+    """
+    E-Hentai gdata API 批量客户端
+
+    并发的查询在 window 秒内合并为一次请求（每次最多 25 个 gid/token），
+    请求频率由令牌桶限制（允许连续 4 次请求，之后约每 1.25 秒一次），成功的结果按 (gid, token) 缓存 cache_ttl 秒；
+    所有 EHentaiTools 共用模块级的 gdata_client，共享请求频率限制和缓存，没有待查询的画廊时请求线程退出
+    """
+    API = 'https://api.e-hentai.org/api.php'
+    BATCH_SIZE = 25
+
+    def __init__(self, session, window=0.2, cache_ttl=3600):
+        self.session = session
+        self.window = window
+        self.cache_ttl = cache_ttl
+        self.bucket = TokenBucket(rate=0.8, burst=4)
+        self._cache = {}  # (gid, token) -> (gmetadata, 过期时间)
+        self._pending = {}  # (gid, token) -> Future
+        self._lock = threading.Condition()
+        self._thread = None
+        metadata_cache.register_memory_cache(self.clear_cache)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get(self, gid, token, timeout=120, logger=None, refresh=False):
+        """查询单个画廊，返回 gmetadata 条目（gid/token 无效时为带 error 字段的条目），请求失败时返回 None"""
+        return self.get_many([(gid, token)], timeout=timeout, logger=logger, refresh=refresh).get(str(gid))
+
+    def get_many(self, pairs, timeout=120, logger=None, refresh=False):
+        """查询多个画廊，返回 {gid: gmetadata 条目}，请求失败的 gid 不在结果中；refresh 为 True 时不读取内存缓存"""
+        results = {}
+        futures = {}
+        now = time.time()
+        with self._lock:
+            for gid, token in pairs:
+                gid = str(gid)
+                key = (gid, token)
+                cached = None if refresh else self._cache.get(key)
+                if cached and cached[1] > now:
+                    results[gid] = cached[0]
+                    continue
+                if key not in self._pending:
+                    self._pending[key] = Future()
+                futures[gid] = self._pending[key]
+            if futures:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='GdataClient', daemon=True)
+                    self._thread.start()
+                self._lock.notify()
+        for gid, future in futures.items():
+            try:
+                metadata = future.result(timeout=timeout)
+            except Exception as e:
+                if logger: logger.error(f"获取画廊 {gid} 的 gmetadata 失败: {e}")
+                continue
+            if metadata is not None:
+                results[gid] = metadata
+        return results
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+            # 等待一小段时间，合并同一时间窗口内的查询
+            time.sleep(self.window)
+            with self._lock:
+                batch = list(self._pending.items())[:self.BATCH_SIZE]
+                for key, _ in batch:
+                    del self._pending[key]
+            self.bucket.acquire()
+            self._fetch(batch)
+
+    def _fetch(self, batch):
+        data = {
+            "method": "gdata",
+            "gidlist": [[gid, token] for (gid, token), _ in batch],
+            "namespace": 1
+        }
+        try:
+            response = self.session.post(self.API, json=data, timeout=30)
+            response.raise_for_status()
+            gmetadata = {str(item.get('gid')): item for item in response.json().get('gmetadata', [])}
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        now = time.time()
+        expires = now + self.cache_ttl
+        with self._lock:
+            for key in [key for key, (_, expiry) in self._cache.items() if expiry <= now]:
+                del self._cache[key]
+            for (gid, token), _ in batch:
+                item = gmetadata.get(gid)
+                if item and 'error' not in item:
+                    self._cache[(gid, token)] = (item, expires)
+        for (gid, _), future in batch:
+            future.set_result(gmetadata.get(gid))
+
+
+# gdata API 不需要登录 cookie，使用独立的会话
+_gdata_session = requests.Session()
+_gdata_session.headers.update(headers)
+gdata_client = GdataClient(_gdata_session)
+
+
 class EHentaiTools:
     def __init__(self, ipb_member_id=None, ipb_pass_hash=None, logger=None):
         self.logger = logger
         self.session = requests.Session()
         self.session.headers.update(headers)
+        self.gdata = gdata_client
 
         # 临时cookie缓存（运行时自动获取）
         self.cached_sk = None
@@ -257,26 +378,34 @@ class EHentaiTools:
             return None
 
     # 从 E-Hentai API 获取画廊信息
-    def get_gmetadata(self, url):
-        API = 'https://api.e-hentai.org/api.php'
+    @cached_gmetadata(_gmetadata_cache_key)
+    def get_gmetadata(self, url, refresh=False):
         searchUrl = re.search(r'g\/(\d+?)\/(.+?)(\/|$)', url)
         if not searchUrl == None:
             gid = searchUrl.group(1)
             gtoken = searchUrl.group(2)
-            data = {
-                "method": "gdata",
-                "gidlist": [
-                    [gid,gtoken]
-                ],
-                "namespace": 1
-                }
-            response = self.session.post(API,json=data)
-            if response.status_code == 200:
-                if self.logger: self.logger.info(response.json())
-                return response.json()['gmetadata'][0]
+            gmetadata = self.gdata.get(gid, gtoken, logger=self.logger, refresh=refresh)
+            if gmetadata is not None:
+                if self.logger: self.logger.info(gmetadata)
+                return gmetadata
         else:
             if self.logger: self.logger.error(f'解析{url}时遇到了错误')
 
+    def get_gmetadata_batch(self, urls):
+        """批量获取画廊信息（不读取缓存，结果写入缓存），返回 {url: gmetadata}，解析失败或获取失败的链接不在结果中"""
+        gids = {}
+        for url in urls:
+            searchUrl = re.search(r'g\/(\d+?)\/(.+?)(\/|$)', url)
+            if searchUrl:
+                gids[url] = (searchUrl.group(1), searchUrl.group(2))
+            elif self.logger:
+                self.logger.error(f'解析{url}时遇到了错误')
+        results = self.gdata.get_many(set(gids.values()), logger=self.logger, refresh=True)
+        for gid, token in set(gids.values()):
+            if gid in results:
+                store_cached_gmetadata(f"ehentai:{gid}/{token}", results[gid])
+        return {url: results[gid] for url, (gid, _) in gids.items() if gid in results}
+
     def _download(self, url, path, task_id=None, tasks=None, tasks_lock=None):
         try:
             with self.session.get(url, stream=True, timeout=30) as r:
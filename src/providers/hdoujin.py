@@ -13,6 +13,12 @@ from providers.hdoujin_api import (
     set_user_agent
 )
 from utils import check_dirs
+from metadata_cache import cached_gmetadata
+
+def _gmetadata_cache_key(tools, url):
+    match = re.search(r'/g/(\d+)/([^/?]+)', url)
+    return f"hdoujin:{match.group(1)}/{match.group(2)}" if match else None
+
 
 class HDoujinTools:
     def __init__(self, session_token=None, refresh_token=None, clearance_token=None, user_agent=None, logger=None):
@@ -202,6 +208,7 @@ class HDoujinTools:
                 self.logger.error(f"搜索 hdoujin 时出错: {e}")
             return None, None
 
+    @cached_gmetadata(_gmetadata_cache_key)
     def get_gmetadata(self, url):
         """获取画廊元数据"""
         try:
@@ -2,22 +2,234 @@ import os
 import json
 import requests
 import subprocess
-import tempfile
+import hashlib
 import time
 import re
+import atexit
+import threading
 from utils import check_dirs
+from providers.page_fetcher import PageFetcher
+from metadata_cache import cached_gmetadata
+from cbztool import StreamingCbzWriter
+
+class GGState:
+    """
+    gg.js 中的图片路由参数（纯 Python 实现）
+
+    mapping/default 对应 gg.m 中 switch (g) 的各个 case 及默认值，b 为图片路径前缀，
+    gg.s 取 hash 的最后三位按 JS 中的顺序拼接后转为十进制
+    """
+
+    def __init__(self, mapping, default, b):
+        self.mapping = mapping
+        self.default = default
+        self.b = b
+
+    def m(self, g):
+        return self.mapping.get(g, self.default)
+
+    def s(self, h):
+        return str(int(h[-1] + h[-3:-1], 16))
+
+    def close(self):
+        pass
+
+
+def parse_gg(script):
+    """解析 gg.js，脚本结构与已知格式不符时返回 None"""
+    b = re.search(r"b:\s*[\"']([^\"']+)[\"']", script)
+    # gg.s 应为 /(..)(.)$/ 匹配后 parseInt(m[2]+m[1], 16)
+    if not b or not re.search(r"/\(\.\.\)\(\.\)\$/", script) \
+            or not re.search(r"parseInt\(\s*m\[2\]\s*\+\s*m\[1\]\s*,\s*16\s*\)", script):
+        return None
+
+    mapping = {}
+    keys = []
+    # case 1: case 2: o = 1; break; 形式：连续的 case 共享随后的赋值
+    for match in re.finditer(r"case\s+(\d+):(?:\s*o\s*=\s*(\d+))?", script):
+        key, value = match.groups()
+        keys.append(int(key))
+        if value:
+            for key in keys:
+                mapping[key] = int(value)
+            keys = []
+    # if (g === 1) { o = 1; } 形式
+    for match in re.finditer(r"if\s*\(\s*g\s*===?\s*(\d+)\s*\)[\s{]*o\s*=\s*(\d+)", script):
+        mapping[int(match.group(1))] = int(match.group(2))
+    if keys or not mapping:
+        return None
+    default = re.search(r"(?:var\s|default:)\s*o\s*=\s*(\d+)", script)
+    return GGState(mapping, int(default.group(1)) if default else 0, b.group(1))
+
+
+# 常驻 Node.js 进程：启动时输出 gg.b，之后每行读取一个 {"fn": "m"|"s", "arg": ...} 请求并输出结果
+NODE_GG_WORKER = """
+var gg;
+__GG_SCRIPT__
+process.stdout.write(JSON.stringify({b: gg.b}) + '\\n');
+require('readline').createInterface({input: process.stdin}).on('line', function(line) {
+    var req = JSON.parse(line);
+    var out;
+    try { out = {result: String(gg[req.fn](req.arg))}; } catch (e) { out = {error: String(e)}; }
+    process.stdout.write(JSON.stringify(out) + '\\n');
+});
+"""
+
+
+class NodeGG:
+    """gg.js 无法解析时的回退：在一个常驻的 Node.js 进程中执行 gg.m/gg.s，通过 stdin/stdout 逐行通信"""
+
+    def __init__(self, script):
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(
+            ['node', '-e', NODE_GG_WORKER.replace('__GG_SCRIPT__', script)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1
+        )
+        self.b = self._read()['b']
+
+    def _read(self):
+        line = self._process.stdout.readline()
+        if not line:
+            raise ValueError("Node.js gg worker exited unexpectedly")
+        return json.loads(line)
+
+    def _call(self, fn, arg):
+        with self._lock:
+            self._process.stdin.write(json.dumps({'fn': fn, 'arg': arg}) + '\n')
+            self._process.stdin.flush()
+            out = self._read()
+        if 'error' in out:
+            raise ValueError(f"Node.js gg.{fn} failed: {out['error']}")
+        return out['result']
+
+    def m(self, g):
+        return int(self._call('m', g))
+
+    def s(self, h):
+        return self._call('s', h)
+
+    @property
+    def alive(self):
+        return self._process.poll() is None
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.kill()
+
+
+# 解析结果按 gg.js 内容缓存，同一份脚本只解析一次（回退时只启动一个 Node.js 进程）
+GG_STATE_TTL = 3600
+_gg_states = {}
+# 正在使用的状态 -> 使用中的下载数；移出缓存的状态在最后一个使用者释放时才关闭（结束 Node.js 进程）
+_gg_leases = {}
+_gg_states_lock = threading.Lock()
+
+
+def load_gg_state(script):
+    """
+    返回 gg.js 对应的 GGState（或回退的 NodeGG）并登记一次使用，用完后须调用 release_gg_state
+
+    结果缓存 GG_STATE_TTL 秒，Node.js 进程已退出的 NodeGG 会被移出缓存并重新启动
+    """
+    key = hashlib.sha1(script.encode('utf-8')).hexdigest()
+    now = time.time()
+    with _gg_states_lock:
+        for cached_key, (state, expires) in list(_gg_states.items()):
+            if expires < now or not getattr(state, 'alive', True):
+                del _gg_states[cached_key]
+                if not _gg_leases.get(state):
+                    state.close()
+        cached = _gg_states.get(key)
+        if cached:
+            state = cached[0]
+        else:
+            state = parse_gg(script) or NodeGG(script)
+            _gg_states[key] = (state, now + GG_STATE_TTL)
+        _gg_leases[state] = _gg_leases.get(state, 0) + 1
+        return state
+
+
+def release_gg_state(state):
+    """释放一次 load_gg_state 登记的使用，已移出缓存且不再有使用者的状态随即关闭"""
+    with _gg_states_lock:
+        users = _gg_leases.pop(state, 0) - 1
+        if users > 0:
+            _gg_leases[state] = users
+        elif not any(cached is state for cached, _ in _gg_states.values()):
+            state.close()
+
+
+@atexit.register
+def _close_gg_states():
+    """进程退出时结束所有 Node.js 进程（包括仍被下载使用的）"""
+    with _gg_states_lock:
+        for state in [cached for cached, _ in _gg_states.values()] + list(_gg_leases):
+            state.close()
+        _gg_states.clear()
+        _gg_leases.clear()
+
+
+class TTLCache:
+    """线程安全的内存缓存，条目在 ttl 秒后过期，超过 max_entries 时淘汰最早写入的条目"""
+
+    def __init__(self, ttl, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            if time.time() >= entry[1]:
+                del self.cache[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.cache.pop(key, None)
+            while len(self.cache) >= self.max_entries:
+                del self.cache[next(iter(self.cache))]
+            self.cache[key] = (value, time.time() + self.ttl)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+
+# 所有 HitomiTools 实例共享连接池和缓存：回退探测、元数据获取和随后的下载复用同一份响应
+GG_SCRIPT_TTL = 300
+GALLERY_DATA_TTL = 600
+_session = requests.Session()
+_session.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+})
+_gg_cache = TTLCache(GG_SCRIPT_TTL, max_entries=1)  # domain -> gg.js 内容
+_gallery_cache = TTLCache(GALLERY_DATA_TTL)
+
+
+def _gmetadata_cache_key(tools, url):
+    gallery_id = tools._extract_gallery_id(url)
+    return f"hitomi:{gallery_id}" if gallery_id else None
+
 
 class HitomiTools:
     def __init__(self, logger=None):
         self.logger = logger
         self.domain = 'gold-usergeneratedcontent.net'
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.session = _session
+        # download_image 自身会重试，页面级不再重试
+        self.page_fetcher = PageFetcher('hitomi', logger=logger, retries=1)
 
     def get_gallery_data(self, gallery_id):
-        """获取完整的画廊元数据 - 模拟JS脚本的行为"""
+        """获取完整的画廊元数据 - 模拟JS脚本的行为，结果缓存 GALLERY_DATA_TTL 秒"""
+        data = _gallery_cache.get(str(gallery_id))
+        if data is not None:
+            return data
+
         url = f"https://ltn.{self.domain}/galleries/{gallery_id}.js"
         try:
             response = self.session.get(url)
@@ -48,6 +260,7 @@ class HitomiTools:
             # 解析JSON
             data = json.loads(json_part)
 
+            _gallery_cache.set(str(gallery_id), data)
             return data
 
         except requests.exceptions.HTTPError as e:
@@ -58,153 +271,65 @@ class HitomiTools:
             raise ValueError(f"Failed to get gallery data: {e}")
 
     def get_gg_script(self):
-        """获取并执行GG脚本 - 使用Node.js正确执行"""
-        url = f"https://ltn.{self.domain}/gg.js?_={int(time.time()*1000)}"
-        try:
-            response = self.session.get(url)
-            response.raise_for_status()
-
-            gg_script = response.text
-
-            # 创建临时Node.js脚本 - 先定义gg变量，然后执行脚本
-            node_script = f"""
-    var gg;
-    {gg_script}
-    console.log(JSON.stringify(gg));
-    """
-
-            # 使用Node.js执行脚本
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as f:
-                f.write(node_script)
-                temp_file = f.name
-
-            try:
-                result = subprocess.run(['node', temp_file], capture_output=True, text=True, timeout=10)
-                if result.returncode != 0:
-                    raise ValueError(f"Node.js execution failed: {result.stderr}")
-
-                gg_json = result.stdout.strip()
-                gg = json.loads(gg_json)
-
-                print(f"GG object from Node.js: {gg}")
-
-                # 检查GG对象 - 由于JSON序列化，函数会丢失，需要特殊处理
-                if 'b' not in gg:
-                    raise ValueError("GG object missing 'b' property")
-
-                # 保存GG脚本以供后续使用
-                self._gg_script = gg_script
-
-                # 由于函数无法JSON序列化，我们需要创建一个包装器来调用函数
-                gg_wrapper = {
-                    'b': gg['b'],
-                    'm': self.create_gg_function_caller('m', gg_script),
-                    's': self.create_gg_function_caller('s', gg_script)
-                }
-
-                return gg_wrapper
-
-            finally:
-                os.unlink(temp_file)
+        """
+        获取 gg.js 并解析为图片路由参数，无法解析时回退到常驻的 Node.js 进程执行，用完后须调用 release_gg_state
 
+        gg.js 会定期更新，脚本内容缓存 GG_SCRIPT_TTL 秒
+        """
+        script = _gg_cache.get(self.domain)
+        try:
+            if script is None:
+                url = f"https://ltn.{self.domain}/gg.js?_={int(time.time()*1000)}"
+                response = self.session.get(url)
+                response.raise_for_status()
+                script = response.text
+                _gg_cache.set(self.domain, script)
+            return load_gg_state(script)
         except Exception as e:
             raise ValueError(f"Failed to get GG script: {e}")
 
     def calculate_image_url(self, file_info, gg):
-        """计算图片URL - 使用Node.js执行原始JS逻辑"""
+        """按 gg.js 的规则计算图片URL"""
         hash_value = file_info['hash']
 
         try:
-            # 获取GG脚本（需要传递给这个方法）
-            gg_script = getattr(self, '_gg_script', None)
-            if not gg_script:
-                raise ValueError("GG script not available")
-
-            # 创建Node.js脚本来计算URL
-            node_script = f"""
-    var gg;
-    {gg_script}
-    var hash = "{hash_value}";
-
-    // 原始JS逻辑
-    var m = /([\\da-f]{{61}})([\\da-f]{{2}})([\\da-f])/.exec(hash);
-    if (!m) throw new Error("Invalid hash format: " + hash);
-
-    var g = parseInt(m[3] + m[2], 16);
-    var imageId = gg.s(hash);
-    var subdomain = gg.m(g) + 1;
-    var url = "https://w" + subdomain + ".{self.domain}/" + gg.b + imageId + "/" + hash + ".webp";
-
-    console.log(url);
-    """
-
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as f:
-                f.write(node_script)
-                temp_file = f.name
+            m = re.search(r'([\da-f]{61})([\da-f]{2})([\da-f])', hash_value)
+            if not m:
+                raise ValueError(f"Invalid hash format: {hash_value}")
 
-            try:
-                result = subprocess.run(['node', temp_file], capture_output=True, text=True, timeout=10)
-                if result.returncode != 0:
-                    raise ValueError(f"Node.js URL calculation failed: {result.stderr}")
-
-                url = result.stdout.strip()
-                return url
-
-            finally:
-                os.unlink(temp_file)
+            g = int(m.group(3) + m.group(2), 16)
+            image_id = gg.s(hash_value)
+            subdomain = gg.m(g) + 1
+            return f"https://w{subdomain}.{self.domain}/{gg.b}{image_id}/{hash_value}.webp"
 
         except Exception as e:
             print(f"Error calculating URL for hash {hash_value}: {e}")
             raise
 
     def download_image(self, url, filename, referer):
-        """下载单张图片"""
+        """下载单张图片，返回图片内容，失败时返回 None"""
         headers = {
             'Referer': referer
         }
 
         for attempt in range(3):
             try:
-                response = self.session.get(url, headers=headers, timeout=30)
+                # 受图片主机的连接数和请求速率限制
+                with self.page_fetcher.limit(url):
+                    response = self.session.get(url, headers=headers, timeout=30)
                 response.raise_for_status()
-
-                with open(filename, 'wb') as f:
-                    f.write(response.content)
-
-                return True
+                return response.content
             except Exception as e:
                 print(f"Failed to download {filename} (attempt {attempt+1}/3): {e}")
                 if attempt < 2:  # 如果不是最后一次尝试，等待一下
                     time.sleep(1)
 
-        return False
-
-    def create_gg_function_caller(self, func_name, gg_script):
-        """创建GG函数调用器"""
-        def caller(arg):
-            node_script = f"""
-    var gg;
-    {gg_script}
-    console.log(gg.{func_name}({json.dumps(arg)}));
-    """
-
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as f:
-                f.write(node_script)
-                temp_file = f.name
-
-            try:
-                result = subprocess.run(['node', temp_file], capture_output=True, text=True, timeout=10)
-                if result.returncode != 0:
-                    raise ValueError(f"Node.js function call failed: {result.stderr}")
-
-                return int(result.stdout.strip())
-            finally:
-                os.unlink(temp_file)
-
-        return caller
+        return None
 
     def download_gallery(self, url, output_dir, task_id=None, tasks=None, tasks_lock=None):
-        """下载整个画廊"""
+        """下载整个画廊，页面按顺序直接写入 output_dir.cbz（output_dir 只用于暂存提前完成、尚未轮到的页面），返回 CBZ 路径"""
+        writer = None
+        gg = None
         try:
             # 从URL中提取gallery_id
             gallery_id = self._extract_gallery_id(url)
@@ -216,82 +341,84 @@ class HitomiTools:
             if not gallery_data:
                 return None
 
-            gallery_dir = output_dir
-            os.makedirs(gallery_dir, exist_ok=True)
-
             # 获取GG脚本
             gg = self.get_gg_script()
 
-            # 下载每张图片
+            # 并发下载图片，文件名按页码编号，按页码顺序写入 CBZ
             referer = f"https://hitomi.la/reader/{gallery_id}.html"
+            files = gallery_data['files']
+            total_imgs = len(files)
             downloaded_files = []
-            total_imgs = len(gallery_data['files'])
+            downloaded_lock = threading.Lock()
+            writer = StreamingCbzWriter(output_dir + '.cbz', output_dir, total_imgs, logger=self.logger)
 
             if self.logger:
-                self.logger.info(f"开始下载 Hitomi 画廊 {gallery_id}，共 {total_imgs} 张图片")
+                self.logger.info(f"开始下载 Hitomi 画廊 {gallery_id}，共 {total_imgs} 张图片，并发 {self.page_fetcher.workers} 页")
 
-            for i, file_info in enumerate(gallery_data['files'], 1):
-                # 检查任务是否被取消
+            def is_cancelled():
                 if task_id and tasks and tasks_lock:
                     with tasks_lock:
                         task = tasks.get(task_id)
-                        if task and task.cancelled:
-                            # 清理已下载的文件
-                            for file_path in downloaded_files:
-                                if os.path.exists(file_path):
-                                    os.remove(file_path)
-                            return None
+                        return bool(task and task.cancelled)
+                return False
 
+            def download(i, file_info):
                 try:
                     # 计算图片URL
                     image_url = self.calculate_image_url(file_info, gg)
-
-                    # 生成文件名
-                    ext = os.path.splitext(file_info['name'])[1] or '.webp'
-                    filename = f"{i:03d}{ext}"
-                    filepath = os.path.join(gallery_dir, filename)
-
-                    if self.logger:
-                        self.logger.info(f"下载图片 {i}/{total_imgs}: {filename}")
-
-                    # 下载图片
-                    if self.download_image(image_url, filepath, referer):
-                        downloaded_files.append(filepath)
-                    else:
-                        if self.logger:
-                            self.logger.error(f"图片 {i}/{total_imgs} 下载失败: {filename}")
-                        # 如果下载失败，退出整个下载过程
-                        if self.logger:
-                            self.logger.error(f"图片下载失败，退出下载过程")
-                        # 清理已下载的文件
-                        for file_path in downloaded_files:
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                        return None
-
-                    # 更新进度
-                    if task_id and tasks and tasks_lock:
-                        with tasks_lock:
-                            if task_id in tasks:
-                                tasks[task_id].progress = int((i / total_imgs) * 100)
-
-                    # 添加延迟避免被限制
-                    time.sleep(0.5)
-
                 except Exception as e:
                     if self.logger:
                         self.logger.error(f"处理图片 {i} 时出错: {e}")
-                    continue
+                    writer.skip(i)
+                    return True
+
+                # 生成文件名
+                ext = os.path.splitext(file_info['name'])[1] or '.webp'
+                filename = f"{i:03d}{ext}"
+
+                if self.logger:
+                    self.logger.info(f"下载图片 {i}/{total_imgs}: {filename}")
+
+                # 下载图片
+                data = self.download_image(image_url, filename, referer)
+                if data is not None:
+                    with downloaded_lock:
+                        downloaded_files.append(filename)
+                    writer.add_bytes(i, filename, data)
+                    return True
+                if self.logger:
+                    self.logger.error(f"图片 {i}/{total_imgs} 下载失败: {filename}")
+                return False
+
+            def on_progress(done, total):
+                if task_id and tasks and tasks_lock:
+                    with tasks_lock:
+                        if task_id in tasks:
+                            tasks[task_id].progress = int((done / total) * 100)
+
+            if not self.page_fetcher.run(files, download, is_cancelled, on_progress):
+                # 如果下载失败或任务被取消，退出整个下载过程
+                if self.logger and not is_cancelled():
+                    self.logger.error(f"图片下载失败，退出下载过程")
+                # 清理已下载的文件
+                writer.abort()
+                return None
 
+            cbz_path = writer.close()
             if self.logger:
                 self.logger.info(f"Hitomi 画廊 {gallery_id} 下载完成，共下载 {len(downloaded_files)}/{total_imgs} 张图片")
 
-            return gallery_dir
+            return cbz_path
 
         except Exception as e:
             if self.logger:
                 self.logger.error(f"下载 Hitomi 画廊失败: {e}")
+            if writer:
+                writer.abort()
             return None
+        finally:
+            if gg is not None:
+                release_gg_state(gg)
 
     def _extract_gallery_id(self, url):
         """从URL中提取gallery ID"""
@@ -310,6 +437,7 @@ class HitomiTools:
                 return match.group(1)
         return None
 
+    @cached_gmetadata(_gmetadata_cache_key)
     def get_gmetadata(self, url):
         """获取画廊元数据"""
         try:
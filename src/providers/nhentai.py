@@ -1,10 +1,12 @@
 import cloudscraper
 import re
 import json
-import os
 import time
 import urllib.parse
 from utils import check_dirs
+from metadata_cache import cached_gmetadata
+from providers.page_fetcher import PageFetcher
+from cbztool import StreamingCbzWriter
 
 def try_n(retries):
     def decorator(func):
@@ -176,6 +178,10 @@ def get_imgs(id, session):
     except Exception as e:
         return None, []
 
+def _gmetadata_cache_key(tools, url):
+    gallery_id = get_id(url)
+    return f"nhentai:{gallery_id}" if gallery_id else None
+
 class NHentaiTools:
     def __init__(self, cookie=None, logger=None):
         self.logger = logger
@@ -183,6 +189,7 @@ class NHentaiTools:
         if cookie:
             self.session.cookies.update(cookie)
         self.timeout = 60
+        self.page_fetcher = PageFetcher('nhentai', logger=logger, retries=2)
 
     def _create_session(self, delay=3):
         session = cloudscraper.create_scraper(
@@ -263,43 +270,44 @@ class NHentaiTools:
                 print(f"搜索 nhentai 时出错: {e}")
         return None
 
-    def _download_file(self, url, path, headers=None, task_id=None, tasks=None, tasks_lock=None):
+    def _download_file(self, url, name, headers=None, task_id=None, tasks=None, tasks_lock=None):
+        """下载单张图片，返回图片内容，失败时返回 None"""
         try:
             request_headers = dict(self.session.headers)
             if headers:
                 request_headers.update(headers)
 
             if self.logger:
-                self.logger.debug(f"开始下载: {url} ==> {path}")
+                self.logger.debug(f"开始下载: {url} ==> {name}")
 
-            with self.session.get(url, stream=True, timeout=self.timeout, headers=request_headers) as r:
+            # 受图片主机的连接数和请求速率限制
+            chunks = []
+            with self.page_fetcher.limit(url), \
+                    self.session.get(url, stream=True, timeout=self.timeout, headers=request_headers) as r:
                 r.raise_for_status()
-                with open(path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        # 只有在有任务参数时才检查任务取消状态，避免不必要的开销
-                        if task_id and tasks and tasks_lock:
-                            with tasks_lock:
-                                task = tasks.get(task_id)
-                                if task and task.cancelled:
-                                    if os.path.exists(path):
-                                        os.remove(path)
-                                    raise Exception("Task was cancelled by user")
-                        if chunk:
-                            f.write(chunk)
+                for chunk in r.iter_content(chunk_size=8192):
+                    # 只有在有任务参数时才检查任务取消状态，避免不必要的开销
+                    if task_id and tasks and tasks_lock:
+                        with tasks_lock:
+                            task = tasks.get(task_id)
+                            if task and task.cancelled:
+                                raise Exception("Task was cancelled by user")
+                    if chunk:
+                        chunks.append(chunk)
 
             if self.logger:
-                self.logger.info(f"下载完成: {path}")
-            return True
+                self.logger.info(f"下载完成: {name}")
+            return b''.join(chunks)
         except Exception as e:
             if self.logger:
                 self.logger.error(f"下载失败: {url} - {e}")
-            return False
+            return None
 
-    def _try_backup_urls(self, primary_url, backup_urls, path, headers=None, task_id=None, tasks=None, tasks_lock=None):
+    def _try_backup_urls(self, primary_url, backup_urls, name, headers=None, task_id=None, tasks=None, tasks_lock=None):
         # 首先尝试主URL
-        success = self._download_file(primary_url, path, headers, task_id, tasks, tasks_lock)
-        if success:
-            return True
+        data = self._download_file(primary_url, name, headers, task_id, tasks, tasks_lock)
+        if data is not None:
+            return data
 
         # 主URL失败，尝试备用URL
         if self.logger:
@@ -312,16 +320,16 @@ class NHentaiTools:
             if self.logger:
                 self.logger.debug(f"尝试备用URL: {backup_url}")
 
-            success = self._download_file(backup_url, path, headers, task_id, tasks, tasks_lock)
-            if success:
+            data = self._download_file(backup_url, name, headers, task_id, tasks, tasks_lock)
+            if data is not None:
                 if self.logger:
-                    self.logger.info(f"通过备用URL下载成功: {path}")
-                return True
+                    self.logger.info(f"通过备用URL下载成功: {name}")
+                return data
             else:
                 if self.logger:
                     self.logger.warning(f"备用URL下载失败: {backup_url}")
 
-        return False
+        return None
     
     def is_valid_cookie(self):
         try:
@@ -337,6 +345,7 @@ class NHentaiTools:
             if self.logger: self.logger.info(f"无法打开 https://nhentai.net/favorites/, 请检查网络: {e}")
             return None
 
+    @cached_gmetadata(_gmetadata_cache_key)
     @try_n(3)
     def get_gmetadata(self, url):
         try:
@@ -376,6 +385,8 @@ class NHentaiTools:
 
     @try_n(3)
     def download_gallery(self, url, output_dir, task_id=None, tasks=None, tasks_lock=None):
+        """下载画廊，页面按顺序直接写入 output_dir.cbz（output_dir 只用于暂存提前完成、尚未轮到的页面），返回 CBZ 路径"""
+        writer = None
         try:
             gallery_id = get_id(url)
             if not gallery_id:
@@ -383,86 +394,88 @@ class NHentaiTools:
             info, imgs = get_imgs(gallery_id, self.session)
             if not info or not imgs:
                 return None
-            gallery_dir = output_dir
-            os.makedirs(gallery_dir, exist_ok=True)
-            downloaded_files = []
             total_imgs = len(imgs)
+            writer = StreamingCbzWriter(output_dir + '.cbz', output_dir, total_imgs, logger=self.logger)
             if self.logger:
-                self.logger.info(f"开始下载 nhentai 画廊 {gallery_id}，共 {total_imgs} 张图片")
-            for i, img in enumerate(imgs, 1):
+                self.logger.info(f"开始下载 nhentai 画廊 {gallery_id}，共 {total_imgs} 张图片，并发 {self.page_fetcher.workers} 页")
+
+            def is_cancelled():
                 if task_id and tasks and tasks_lock:
                     with tasks_lock:
                         task = tasks.get(task_id)
-                        if task and task.cancelled:
-                            for file_path in downloaded_files:
-                                if os.path.exists(file_path):
-                                    os.remove(file_path)
-                            return None
+                        return bool(task and task.cancelled)
+                return False
+
+            def download(i, img):
                 headers = {'Referer': img.referer}
-                img_path = os.path.join(gallery_dir, img.name)
                 # 使用统一的备用URL尝试方法
                 if hasattr(img, 'possible_urls') and img.possible_urls:
-                    success = self._try_backup_urls(img.url, img.possible_urls, img_path, headers, task_id, tasks, tasks_lock)
+                    data = self._try_backup_urls(img.url, img.possible_urls, img.name, headers, task_id, tasks, tasks_lock)
                 else:
-                    success = self._download_with_referer(img.url, img_path, headers, task_id, tasks, tasks_lock)
-
+                    data = self._download_with_referer(img.url, img.name, headers, task_id, tasks, tasks_lock)
+                success = data is not None
                 if success:
-                    downloaded_files.append(img_path)
-                    if self.logger:
+                    writer.add_bytes(i, img.name, data)
+                if self.logger:
+                    if success:
                         self.logger.info(f"图片 {i}/{total_imgs} 下载成功: {img.name}")
-                else:
-                    if self.logger:
+                    else:
                         self.logger.error(f"图片 {i}/{total_imgs} 所有链接下载失败: {img.name}")
-                    # 如果下载失败，退出整个下载过程
-                    if self.logger:
-                        self.logger.error(f"图片下载失败，退出下载过程")
-                    # 清理已下载的文件
-                    for file_path in downloaded_files:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                    return None
+                return success
+
+            def on_progress(done, total):
                 if task_id and tasks and tasks_lock:
                     with tasks_lock:
                         if task_id in tasks:
-                            tasks[task_id].progress = int((i / total_imgs) * 100)
-                time.sleep(0.5)
+                            tasks[task_id].progress = int((done / total) * 100)
+
+            if not self.page_fetcher.run(imgs, download, is_cancelled, on_progress):
+                # 如果下载失败或任务被取消，退出整个下载过程
+                if self.logger and not is_cancelled():
+                    self.logger.error(f"图片下载失败，退出下载过程")
+                # 清理已下载的文件
+                writer.abort()
+                return None
+            cbz_path = writer.close()
             if self.logger:
-                self.logger.info(f"nhentai 画廊 {gallery_id} 下载完成，共下载 {len(downloaded_files)}/{total_imgs} 张图片")
-            return gallery_dir
+                self.logger.info(f"nhentai 画廊 {gallery_id} 下载完成，共下载 {total_imgs}/{total_imgs} 张图片")
+            return cbz_path
         except Exception as e:
             if self.logger:
                 self.logger.error(f"下载 nhentai 画廊失败: {e}")
+            if writer:
+                writer.abort()
             return None
 
     @try_n(3)
-    def _download_with_referer(self, url, path, headers=None, task_id=None, tasks=None, tasks_lock=None):
+    def _download_with_referer(self, url, name, headers=None, task_id=None, tasks=None, tasks_lock=None):
         # 检查是否为nhentai图片链接
         if 'nhentai.net' in url and '/galleries/' in url:
-            return self._download_nhentai_image(url, path, headers, task_id, tasks, tasks_lock)
+            return self._download_nhentai_image(url, name, headers, task_id, tasks, tasks_lock)
 
         # 通用下载逻辑（日志已在_download_file中统一处理）
-        return self._download_file(url, path, headers, task_id, tasks, tasks_lock)
+        return self._download_file(url, name, headers, task_id, tasks, tasks_lock)
 
     @try_n(3)
-    def _download_nhentai_image(self, url, path, headers=None, task_id=None, tasks=None, tasks_lock=None):
+    def _download_nhentai_image(self, url, name, headers=None, task_id=None, tasks=None, tasks_lock=None):
         # 检查URL格式是否为nhentai图片链接
         match = re.search(r'https://i(\d*)\.nhentai\.net/galleries/(\d+)/(\d+)\.(\w+)', url)
         if not match:
-            # 如果不是nhentai格式的URL，直接返回False，让调用者处理
-            return False
+            # 如果不是nhentai格式的URL，直接返回None，让调用者处理
+            return None
 
         domain_num, media_id, page_num, ext = match.groups()
 
         if self.logger:
-            self.logger.info(f"开始下载 nhentai 图片: {page_num}.{ext} ==> {path}")
+            self.logger.info(f"开始下载 nhentai 图片: {page_num}.{ext} ==> {name}")
 
         # 获取所有可能的URL
         possible_urls = build_nhentai_image_urls(media_id, int(page_num), ext)
 
         # 使用统一的备用URL尝试方法
-        success = self._try_backup_urls(url, possible_urls, path, headers, task_id, tasks, tasks_lock)
+        data = self._try_backup_urls(url, possible_urls, name, headers, task_id, tasks, tasks_lock)
 
-        if not success and self.logger:
+        if data is None and self.logger:
             self.logger.error(f"所有域名下载失败: {url}")
 
-        return success
+        return data
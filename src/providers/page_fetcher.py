@@ -0,0 +1,122 @@
+"""
+画廊图片并发下载
+按下载来源配置同时下载的页数，同一图片主机的连接数和请求速率在所有任务间共享限制：
+  - 每个主机的并发连接数由信号量限制
+  - 每个主机的请求速率由令牌桶限制（允许短时突发，长期平均不超过设定速率）
+单页下载失败时按指数退避重试，仍失败则停止剩余页面的下载
+"""
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+
+# 各下载来源的默认设置：workers 为同时下载的页数，host_connections 为每个图片主机的最大连接数，
+# rate 为每个图片主机每秒请求数
+DEFAULT_SETTINGS = {
+    'nhentai': {'workers': 4, 'host_connections': 4, 'rate': 4.0},
+    'hitomi': {'workers': 4, 'host_connections': 4, 'rate': 4.0},
+}
+
+_settings = {provider: dict(settings) for provider, settings in DEFAULT_SETTINGS.items()}
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+def configure(provider, workers=None):
+    """更新下载来源同时下载的页数"""
+    if workers and workers > 0:
+        _settings.setdefault(provider, {'workers': workers, 'host_connections': workers, 'rate': 4.0})['workers'] = workers
+
+
+class TokenBucket:
+    """令牌桶：容量为 burst，每秒补充 rate 个令牌"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取出一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _host_limits(host, connections, rate):
+    with _hosts_lock:
+        limits = _hosts.get(host)
+        if limits is None:
+            limits = _hosts[host] = (threading.BoundedSemaphore(connections), TokenBucket(rate))
+        return limits
+
+
+class PageFetcher:
+    def __init__(self, provider, logger=None, retries=3, backoff=1.0):
+        settings = _settings.get(provider) or DEFAULT_SETTINGS['nhentai']
+        self.provider = provider
+        self.workers = settings['workers']
+        self.host_connections = settings['host_connections']
+        self.rate = settings['rate']
+        self.logger = logger
+        self.retries = retries
+        self.backoff = backoff
+
+    @contextmanager
+    def limit(self, url):
+        """在请求 url 前获取其主机的连接槽位和速率令牌"""
+        semaphore, bucket = _host_limits(urllib.parse.urlsplit(url).netloc, self.host_connections, self.rate)
+        with semaphore:
+            bucket.acquire()
+            yield
+
+    def run(self, pages, download, is_cancelled=None, on_progress=None):
+        """
+        并发下载所有页面，全部成功时返回 True
+
+        pages 为按顺序排列的页面列表，download(index, page) 下载第 index 页（从 1 开始）并返回是否成功；
+        is_cancelled() 返回 True 或任一页重试后仍失败时，不再开始剩余页面的下载并返回 False；
+        on_progress(done, total) 在每页下载完成后调用
+        """
+        total = len(pages)
+        stop = threading.Event()
+
+        def fetch(index, page):
+            for attempt in range(self.retries):
+                if stop.is_set() or (is_cancelled and is_cancelled()):
+                    stop.set()
+                    return False
+                try:
+                    if download(index, page):
+                        return True
+                except Exception as e:
+                    if self.logger:
+                        self.logger.warning(f"第 {index} 页下载出错 (尝试 {attempt + 1}/{self.retries}): {e}")
+                if attempt < self.retries - 1:
+                    time.sleep(self.backoff * (2 ** attempt))
+            stop.set()
+            return False
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, total or 1)),
+                                thread_name_prefix=f'PageFetcher-{self.provider}') as pool:
+            futures = [pool.submit(fetch, index, page) for index, page in enumerate(pages, 1)]
+            for future in as_completed(futures):
+                if not future.result():
+                    stop.set()
+                    continue
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+        return done == total and not stop.is_set()
@@ -22,6 +22,10 @@ def download_url():
             - true/t/1/y/yes: 添加到收藏夹 0
             - 0-9: 添加到指定收藏夹
             - false/其他: 不添加到收藏夹
+        priority: 队列优先级（可选）
+            - manual: 手动提交（默认）
+            - favorite: 收藏夹自动下载
+            - retry: 重试（重新提交失败或取消的任务时的默认值）
     
     返回:
         200: 任务已存在（已完成或进行中）
@@ -33,6 +37,7 @@ def download_url():
     try:
         url = request.args.get('url')
         mode = request.args.get('mode')
+        priority = request.args.get('priority')
         fav_param = request.args.get('fav', 'false').lower()
         
         # 新的 fav 参数处理逻辑
@@ -52,15 +57,14 @@ def download_url():
         # 从 current_app.config 获取共享对象
         tasks = current_app.config.get('TASKS', {})
         tasks_lock = current_app.config.get('TASKS_LOCK')
-        executor = current_app.config.get('EXECUTOR')
+        task_queue = current_app.config.get('TASK_QUEUE')
         
-        if not executor or not tasks_lock:
+        if not task_queue or not tasks_lock:
             return json_response({'error': 'Server not properly initialized'}), 500
         
         # 导入必要的模块
         from database import task_db
         from utils import TaskStatus
-        import sqlite3
         
         # 规范化 URL 并检查重复任务
         try:
@@ -90,21 +94,15 @@ def download_url():
                         global_logger.info(f"Task for URL {url} has status {existing_status}, retrying with new task ID")
                     
                     # 删除旧任务（数据库）
-                    try:
-                        with sqlite3.connect('./data/tasks.db') as conn:
-                            conn.execute('DELETE FROM tasks WHERE id = ?', (existing_task_id,))
-                            conn.commit()
+                    if task_db.delete_task(existing_task_id):
                         if global_logger:
                             global_logger.info(f"已从数据库删除任务 {existing_task_id}")
-                    except sqlite3.Error as e:
-                        if global_logger:
-                            global_logger.error(f"删除旧任务时发生数据库错误: {e}")
+                    elif global_logger:
+                        global_logger.error(f"删除旧任务 {existing_task_id} 时发生数据库错误")
                     
                     # 从内存中删除旧任务
                     with tasks_lock:
                         if existing_task_id in tasks:
-                            if hasattr(tasks[existing_task_id], 'log_buffer'):
-                                tasks[existing_task_id].log_buffer.close()
                             del tasks[existing_task_id]
                     
                     # 使用原任务的参数（如果当前请求没有提供）
@@ -138,27 +136,26 @@ def download_url():
         
         # 从 current_app.config 获取函数和类
         get_task_logger = current_app.config.get('GET_TASK_LOGGER')
-        task_failure_processing = current_app.config.get('TASK_FAILURE_PROCESSING')
-        download_gallery_task = current_app.config.get('DOWNLOAD_GALLERY_TASK')
+        get_download_provider = current_app.config.get('GET_DOWNLOAD_PROVIDER')
         TaskInfo = current_app.config.get('TASK_INFO_CLASS')
         
-        if not all([get_task_logger, task_failure_processing, download_gallery_task, TaskInfo]):
+        if not all([get_task_logger, get_download_provider, TaskInfo]):
             return json_response({'error': 'Server functions not properly initialized'}), 500
         
-        logger, log_buffer = get_task_logger(task_id)
-        
-        # 动态应用装饰器
-        decorated_download_task = task_failure_processing(url, task_id, logger, tasks, tasks_lock)(download_gallery_task)
-        
-        future = executor.submit(decorated_download_task, url, mode, task_id, logger, favcat, tasks, tasks_lock)
-        with tasks_lock:
-            tasks[task_id] = TaskInfo(future, logger, log_buffer)
+        logger = get_task_logger(task_id)
 
         # 添加任务到数据库，包含URL、mode和favcat信息用于重试
         # 将 favcat 转换为字符串存储（False -> None）
         favcat_to_save = str(favcat) if favcat is not False else None
         task_db.add_task(task_id, status=TaskStatus.IN_PROGRESS, url=url, mode=mode, favcat=favcat_to_save)
 
+        # 加入持久化下载队列，持有 tasks_lock 保证工作线程领取前 TaskInfo 已就绪
+        provider = get_download_provider(url, mode)
+        priority = priority or ('retry' if is_retry else 'manual')
+        with tasks_lock:
+            future = task_queue.submit(task_id, url, mode, favcat_to_save, provider=provider, priority=priority)
+            tasks[task_id] = TaskInfo(future, logger, task_id)
+
         # 根据是否是重试返回不同的消息
         if is_retry:
             return json_response({
@@ -3,23 +3,54 @@ Task 相关路由
 这个模块包含所有与任务管理相关的 API 路由
 使用 Flask Blueprint 实现
 """
-from flask import Blueprint, current_app, request
+from flask import Blueprint, Response, current_app, request
 import sqlite3
+import threading
 from utils import json_response
 
+def task_etag(app):
+    """任务数据的 ETag：任务数据版本号 + 影响响应内容的配置项"""
+    import zlib
+    from database import task_db
+    config_key = f"{app.config.get('MOVE_PATH')}|{app.config.get('KOMGA_SERVER')}"
+    return f"{task_db.version_tag}-{zlib.crc32(config_key.encode('utf-8')):08x}"
+
+def not_modified(etag):
+    """客户端缓存的 ETag 与当前一致时直接返回 304 响应（不查询数据库、不序列化 JSON），否则返回 None"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+def with_etag(response, etag):
+    """为响应附加 ETag，并要求客户端每次使用前重新验证"""
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 def enrich_task_data(task_dict, app):
     """为任务实体注入 has_path_difference 字段以支持前端智能移动亮起交互"""
     if not task_dict:
         return task_dict
-    from utils_move import calculate_task_move_path
+    from utils_move import calculate_task_move_path, move_path_needs_metadata
     import os
     current_path = task_dict.get('output_path')
-    suggested = calculate_task_move_path(task_dict, app)
+    # 只有已完成的任务才需要计算建议路径（避免为其它任务解码 metadata）
+    suggested = None
+    if current_path and task_dict.get('status') == '完成':
+        move_info = task_dict
+        # 列表视图不查询 metadata，仅当移动模板用到 comicinfo 提供不了的变量时才单独读取
+        if 'metadata' not in task_dict and move_path_needs_metadata(app, task_dict.get('comicinfo')):
+            from database import task_db
+            move_info = dict(task_dict, metadata=task_db.get_task_metadata(task_dict.get('id')))
+        suggested = calculate_task_move_path(move_info, app)
     
-    # 将只读的 sqlite3.Row 或内存 dict 统一规范化为可写 dict
-    task_data = dict(task_dict)
+    # 将只读的 sqlite3.Row 或内存 dict 统一规范化为可写 dict（TaskRow.copy 保持 JSON 字段延迟解码）
+    task_data = task_dict.copy() if isinstance(task_dict, dict) else dict(task_dict)
     
-    if current_path and suggested and task_dict.get('status') == '完成':
+    if suggested:
         task_data['has_path_difference'] = os.path.normpath(current_path) != os.path.normpath(suggested)
         task_data['target_path'] = suggested
     else:
@@ -158,7 +189,8 @@ def fetch_and_update_gmetadata_async(app, task_id, url):
                                         allowed_keys.add(key_map.get(k.lower(), k.capitalize()))
                                         
                                     filtered_metadata = {k: v for k, v in comicinfo_metadata.items() if k in allowed_keys}
-                                    cbztool.update_comicinfo_in_cbz(cbz_path, filtered_metadata, logger=global_logger)
+                                    cbztool.update_comicinfo_in_cbz(cbz_path, filtered_metadata, logger=global_logger,
+                                                                    deflate_formats=app.config.get('CBZ_DEFLATE_FORMATS'))
                     except Exception as meta_err:
                         if global_logger:
                             global_logger.warning(f"后台自动生成/打包 comicinfo 失败 (task_id: {task_id}): {meta_err}")
@@ -181,48 +213,64 @@ def get_task_stats():
         # 导入 TaskStatus 枚举
         from utils import TaskStatus
 
-        with sqlite3.connect('./data/tasks.db') as conn:
-            conn.row_factory = sqlite3.Row
-            # 获取各种状态的任务数量
-            cursor = conn.execute('''
-                SELECT
-                    status,
-                    COUNT(*) as count
-                FROM tasks
-                GROUP BY status
-            ''')
-            status_counts = {row['status']: row['count'] for row in cursor.fetchall()}
+        from database import task_db
 
-            # 获取总任务数
-            cursor = conn.execute('SELECT COUNT(*) as total FROM tasks')
-            total_tasks = cursor.fetchone()['total']
+        etag = task_etag(current_app)
+        cached = not_modified(etag)
+        if cached:
+            return cached
 
-            # 获取进行中任务数
-            in_progress = status_counts.get(TaskStatus.IN_PROGRESS, 0)
+        # 获取各种状态的任务数量
+        status_counts = task_db.get_status_counts()
 
-            # 获取已完成任务数
-            completed = status_counts.get(TaskStatus.COMPLETED, 0)
+        # 获取总任务数
+        total_tasks = sum(status_counts.values())
 
-            # 获取取消任务数
-            cancelled = status_counts.get(TaskStatus.CANCELLED, 0)
+        # 获取进行中任务数
+        in_progress = status_counts.get(TaskStatus.IN_PROGRESS, 0)
 
-            # 获取失败任务数（只包括错误）
-            failed = status_counts.get(TaskStatus.ERROR, 0)
+        # 获取已完成任务数
+        completed = status_counts.get(TaskStatus.COMPLETED, 0)
 
-            return json_response({
-                'total': total_tasks,
-                'in_progress': in_progress,
-                'completed': completed,
-                'cancelled': cancelled,
-                'failed': failed,
-                'status_counts': status_counts
-            })
+        # 获取取消任务数
+        cancelled = status_counts.get(TaskStatus.CANCELLED, 0)
+
+        # 获取失败任务数（只包括错误）
+        failed = status_counts.get(TaskStatus.ERROR, 0)
+
+        return with_etag(json_response({
+            'total': total_tasks,
+            'in_progress': in_progress,
+            'completed': completed,
+            'cancelled': cancelled,
+            'failed': failed,
+            'status_counts': status_counts
+        }), etag)
 
     except sqlite3.Error as e:
         if global_logger:
             global_logger.error(f"Database error getting task stats: {e}")
         return json_response({'error': 'Failed to get task statistics'}), 500
 
+@bp.route('/api/tasks/pipeline', methods=['GET'])
+def get_pipeline_stats():
+    """获取下载队列和后处理流水线各阶段的运行指标"""
+    global_logger = current_app.config.get('GLOBAL_LOGGER')
+    try:
+        from database import task_db
+
+        pipeline = current_app.config.get('DOWNLOAD_PIPELINE')
+        return json_response({
+            'queue': task_db.get_queue_counts(),
+            'provider_limits': current_app.config.get('DOWNLOAD_PROVIDER_LIMITS', {}),
+            'stages': pipeline.stats() if pipeline else []
+        })
+
+    except sqlite3.Error as e:
+        if global_logger:
+            global_logger.error(f"Database error getting pipeline stats: {e}")
+        return json_response({'error': 'Failed to get pipeline statistics'}), 500
+
 @bp.route('/api/covers/<filename>', methods=['GET'])
 def get_cover(filename):
     """获取任务的本地缓存封面，若丢失则尝试重新下载或重定向回原始 URL"""
@@ -312,15 +360,13 @@ def clear_tasks():
                     # 直接状态匹配
                     should_clear = task_info.status == status_to_clear
 
-                if should_clear:
-                    # 清除日志缓冲区
-                    if hasattr(task_info, 'log_buffer'):
-                        task_info.log_buffer.close()
-                else:
+                if not should_clear:
                     tasks_to_keep[tid] = task_info
 
             tasks.clear()
             tasks.update(tasks_to_keep)
+        # 内存中的任务也已清除，再次递增版本号，避免清除期间生成的响应仍被 304 复用
+        task_db.touch()
 
         return json_response({'message': f'Tasks with status "{status_to_clear}" cleared successfully'}), 200
 
@@ -344,6 +390,12 @@ def get_task(task_id):
         if not tasks_lock:
             return json_response({'error': 'Server not properly initialized'}), 500
 
+        # 版本号必须在读取数据之前获取，保证返回的 ETag 不会比数据更新
+        etag = task_etag(current_app)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
         # 先从数据库获取任务（作为基准数据源，包含异步更新的 metadata/comicinfo 等）
         db_task = task_db.get_task(task_id)
         
@@ -356,14 +408,14 @@ def get_task(task_id):
                 db_task.update({
                     'status': memory_task.status,
                     'error': memory_task.error,
-                    'log': memory_task.log_buffer.getvalue(),
                     'filename': memory_task.filename,
                     'progress': memory_task.progress,
                     'downloaded': memory_task.downloaded,
                     'total_size': memory_task.total_size,
                     'speed': memory_task.speed
                 })
-            return json_response(enrich_task_data(db_task, current_app))
+            db_task['log'] = '\n'.join(task_db.get_task_logs(task_id)[0])
+            return with_etag(json_response(enrich_task_data(db_task, current_app)), etag)
 
         # 如果数据库没有，但内存中有（极端罕见情况）
         if memory_task:
@@ -383,9 +435,9 @@ def get_task(task_id):
                 'output_path': getattr(memory_task, 'output_path', None),
                 'target_path': getattr(memory_task, 'target_path', None),
                 'cover_url': getattr(memory_task, 'cover_url', None),
-                'log': memory_task.log_buffer.getvalue()
+                'log': '\n'.join(task_db.get_task_logs(task_id)[0])
             }
-            return json_response(enrich_task_data(task_data, current_app))
+            return with_etag(json_response(enrich_task_data(task_data, current_app)), etag)
 
         return json_response({'error': 'Task not found'}), 404
 
@@ -394,6 +446,73 @@ def get_task(task_id):
             global_logger.error(f"Error getting task {task_id}: {e}")
         return json_response({'error': f'Failed to get task: {str(e)}'}), 500
 
+@bp.route('/api/tasks/events', methods=['GET'])
+def task_events():
+    """
+    任务增量事件流（Server-Sent Events）
+
+    下载线程发布的状态、进度、速度和新日志经事件总线推送，同一推送间隔内的多次更新按任务合并，
+    没有更新时只发送心跳，不访问数据库
+    """
+    import json
+    import time
+    from flask import Response, stream_with_context
+    from events import event_bus
+
+    # 两次推送之间的最小间隔（秒），期间的更新会被合并为一次推送
+    min_interval = 0.5
+    keepalive_interval = 15
+
+    def stream():
+        subscription = event_bus.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                deltas = subscription.get(timeout=keepalive_interval)
+                if deltas:
+                    yield f"event: tasks\ndata: {json.dumps(deltas, ensure_ascii=False)}\n\n"
+                    time.sleep(min_interval)
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/tasks/<task_id>/logs', methods=['GET'])
+def get_task_logs(task_id):
+    """增量获取任务日志，传入上次返回的 cursor 作为 after 参数即可只获取新增日志"""
+    global_logger = current_app.config.get('GLOBAL_LOGGER')
+    try:
+        from database import task_db
+
+        try:
+            after = max(int(request.args.get('after', 0)), 0)
+        except (ValueError, TypeError):
+            after = 0
+
+        try:
+            limit = min(max(int(request.args.get('limit', 1000)), 1), 5000)
+        except (ValueError, TypeError):
+            limit = 1000
+
+        lines, cursor = task_db.get_task_logs(task_id, after=after, limit=limit)
+        return json_response({
+            'task_id': task_id,
+            'lines': lines,
+            'cursor': cursor,
+            'has_more': len(lines) >= limit
+        })
+
+    except Exception as e:
+        if global_logger:
+            global_logger.error(f"Error getting logs for task {task_id}: {e}")
+        return json_response({'error': f'Failed to get task logs: {str(e)}'}), 500
+
 @bp.route('/api/tasks/<task_id>', methods=['DELETE'])
 def delete_task(task_id):
     """删除指定任务（仅限非进行中的任务）"""
@@ -426,9 +545,6 @@ def delete_task(task_id):
         # 从内存中删除任务（如果存在）
         with tasks_lock:
             if task_id in tasks:
-                # 关闭日志缓冲区
-                if hasattr(tasks[task_id], 'log_buffer'):
-                    tasks[task_id].log_buffer.close()
                 del tasks[task_id]
 
         # 如果要求删除物理文件且路径存在，则尝试删除文件
@@ -566,15 +682,14 @@ def retry_task(task_id):
         from utils import TaskStatus
         from database import task_db
         from datetime import datetime, timezone
-        import sqlite3
         import main
 
-        # 从 current_app.config 获取 tasks、tasks_lock 和 executor
+        # 从 current_app.config 获取 tasks、tasks_lock 和下载队列
         tasks = current_app.config.get('TASKS', {})
         tasks_lock = current_app.config.get('TASKS_LOCK')
-        executor = current_app.config.get('EXECUTOR')
+        task_queue = current_app.config.get('TASK_QUEUE')
 
-        if not tasks_lock or not executor:
+        if not tasks_lock or not task_queue:
             return json_response({'error': 'Server not properly initialized'}), 500
 
         # 从数据库获取任务信息
@@ -602,47 +717,26 @@ def retry_task(task_id):
         task_db.add_task(new_task_id, status=TaskStatus.IN_PROGRESS, url=url, mode=mode, favcat=favcat)
 
         # 删除原来的失败任务
-        try:
-            with sqlite3.connect('./data/tasks.db') as conn:
-                conn.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-                conn.commit()
+        if task_db.delete_task(task_id):
             if global_logger:
                 global_logger.info(f"已从数据库删除失败任务 {task_id}")
-        except sqlite3.Error as e:
-            if global_logger:
-                global_logger.error(f"删除失败任务时发生数据库错误: {e}")
+        elif global_logger:
+            global_logger.error(f"删除失败任务 {task_id} 时发生数据库错误")
 
         # 从内存中删除原来的失败任务
         with tasks_lock:
             if task_id in tasks:
-                # 关闭日志缓冲区
-                if hasattr(tasks[task_id], 'log_buffer'):
-                    tasks[task_id].log_buffer.close()
                 del tasks[task_id]
 
         # 创建新的任务执行
-        # 将 favcat 从字符串转换回原始格式（'0'-'9' 或 False）
-        if favcat and favcat.isdigit():
-            favcat_param = favcat  # 保持为字符串 '0'-'9'
-        else:
-            favcat_param = False
-        
-        logger, log_buffer = main.get_task_logger(new_task_id)
-        
-        # 从 current_app.config 获取函数和类
-        get_task_logger = current_app.config.get('GET_TASK_LOGGER')
-        task_failure_processing = current_app.config.get('TASK_FAILURE_PROCESSING')
-        download_gallery_task = current_app.config.get('DOWNLOAD_GALLERY_TASK')
+        logger = main.get_task_logger(new_task_id)
         TaskInfo = current_app.config.get('TASK_INFO_CLASS')
-        
-        # 动态应用装饰器
-        decorated_download_task = task_failure_processing(url, new_task_id, logger, tasks, tasks_lock)(download_gallery_task)
-        
-        future = executor.submit(decorated_download_task, url, mode, new_task_id, logger, favcat_param, tasks, tasks_lock)
+        provider = current_app.config.get('GET_DOWNLOAD_PROVIDER')(url, mode)
 
-        # 更新内存中的任务信息
+        # 加入持久化下载队列并更新内存中的任务信息
         with tasks_lock:
-            tasks[new_task_id] = TaskInfo(future, logger, log_buffer)
+            future = task_queue.submit(new_task_id, url, mode, favcat, provider=provider, priority='retry')
+            tasks[new_task_id] = TaskInfo(future, logger, new_task_id)
 
         if global_logger:
             global_logger.info(f"Task retry started with new ID {new_task_id}")
@@ -660,8 +754,7 @@ def get_tasks():
     try:
         # 导入必要的模块和变量
         from database import task_db
-        from utils import TaskStatus
-        import sqlite3
+        from utils import TaskStatus, encode_cursor, decode_cursor
 
         # 从 current_app.config 获取 tasks 和 tasks_lock
         tasks = current_app.config.get('TASKS', {})
@@ -670,6 +763,12 @@ def get_tasks():
         if not tasks_lock:
             return json_response({'error': 'Server not properly initialized'}), 500
 
+        # 版本号必须在读取数据之前获取，保证返回的 ETag 不会比数据更新
+        etag = task_etag(current_app)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
         status_filter = request.args.get('status')
         search_query = request.args.get('search', '').strip()
         
@@ -691,13 +790,27 @@ def get_tasks():
             page_size = 20
 
         sort_by = request.args.get('sort', 'created_at')
-        if sort_by not in ['created_at', 'updated_at', 'id']:
+        if sort_by not in ['created_at', 'updated_at', 'id', 'relevance']:
             sort_by = 'created_at'
 
-        order_by_sql = f"{sort_by} DESC"
+        # 游标分页模式：带 after 参数（首页可为空）时按 (created_at, id) 倒序翻页，忽略 page 与 sort
+        keyset_mode = 'after' in request.args
+        next_cursor = None
+        if keyset_mode:
+            sort_by = 'created_at'
+            after = None
+            after_token = request.args.get('after', '').strip()
+            if after_token:
+                after = decode_cursor(after_token)
+                if after is None:
+                    return json_response({'error': 'Invalid cursor'}), 400
+
+            db_tasks, next_cursor = task_db.get_tasks_after(status_filter, search_query if search_query else None, after, page_size, view='list')
+        else:
+            order_by_sql = 'relevance' if sort_by == 'relevance' else f"{sort_by} DESC"
 
-        # 从数据库获取任务列表
-        db_tasks, total = task_db.get_tasks(status_filter, search_query if search_query else None, page, page_size, order_by=order_by_sql)
+            # 从数据库获取任务列表
+            db_tasks, total = task_db.get_tasks(status_filter, search_query if search_query else None, page, page_size, order_by=order_by_sql, view='list')
 
         # 合并内存中的活跃任务信息
         with tasks_lock:
@@ -705,99 +818,70 @@ def get_tasks():
                 task_id = db_task['id']
                 if task_id in tasks:
                     memory_task = tasks[task_id]
-                    # 用内存中的最新信息更新数据库任务
-                    db_task.update({
+                    memory_state = {
                         'status': memory_task.status,
                         'error': memory_task.error,
-                        'log': memory_task.log_buffer.getvalue(),
                         'filename': memory_task.filename,
                         'progress': memory_task.progress,
                         'downloaded': memory_task.downloaded,
                         'total_size': memory_task.total_size,
                         'speed': memory_task.speed
-                    })
-
-                    # 同步更新数据库
-                    task_db.update_task(
-                        task_id,
-                        status=memory_task.status,
-                        error=memory_task.error,
-                        log=memory_task.log_buffer.getvalue(),
-                        filename=memory_task.filename,
-                        progress=memory_task.progress,
-                        downloaded=memory_task.downloaded,
-                        total_size=memory_task.total_size,
-                        speed=memory_task.speed
-                    )
+                    }
+                    # 只把与数据库不一致的字段同步回数据库，避免没有变化时也产生写入（并递增 ETag 版本号）
+                    changed = {key: value for key, value in memory_state.items() if db_task.get(key) != value}
+
+                    # 用内存中的最新信息更新数据库任务
+                    db_task.update(memory_state)
+
+                    if changed:
+                        task_db.update_task(task_id, **changed)
 
         # 兜底内存排序
         if sort_by == 'updated_at':
             db_tasks.sort(key=lambda x: x.get('updated_at', x.get('created_at', '')), reverse=True)
-        else:
+        elif sort_by != 'relevance':
             db_tasks.sort(key=lambda x: x.get('id', ''), reverse=True)
 
         # 获取各个状态的任务数量统计
         # 如果存在搜索条件，则状态统计也应该基于搜索条件过滤
-        try:
-            with sqlite3.connect('./data/tasks.db') as conn:
-                conn.row_factory = sqlite3.Row
-                
-                where_clauses = []
-                params = []
-                if search_query:
-                    import re
-                    terms = [t.strip() for t in re.split(r'[,|\n]+', search_query) if t.strip()]
-                    if terms:
-                        term_clauses = []
-                        for term in terms:
-                            term_clauses.append("(id LIKE ? OR filename LIKE ? OR url LIKE ?)")
-                            search_term = f"%{term}%"
-                            params.extend([search_term, search_term, search_term])
-                        where_clauses.append("(" + " OR ".join(term_clauses) + ")")
-                
-                where_clause = ""
-                if where_clauses:
-                    where_clause = "WHERE " + " AND ".join(where_clauses)
-
-                cursor = conn.execute(f'''
-                    SELECT
-                        status,
-                        COUNT(*) as count
-                    FROM tasks
-                    {where_clause}
-                    GROUP BY status
-                ''', params)
-                status_counts = {row['status']: row['count'] for row in cursor.fetchall()}
-
-                # 获取各个状态的总数
-                all_count = sum(status_counts.values())
-                in_progress_count = status_counts.get(TaskStatus.IN_PROGRESS, 0)
-                completed_count = status_counts.get(TaskStatus.COMPLETED, 0)
-                cancelled_count = status_counts.get(TaskStatus.CANCELLED, 0)
-                failed_count = status_counts.get(TaskStatus.ERROR, 0)
-        except sqlite3.Error as e:
-            if global_logger:
-                global_logger.error(f"Database error getting status counts: {e}")
-            all_count = total
-            in_progress_count = 0
-            completed_count = 0
-            cancelled_count = 0
-            failed_count = 0
+        status_counts = task_db.get_status_counts(search_query if search_query else None)
+
+        # 获取各个状态的总数
+        all_count = sum(status_counts.values())
+        in_progress_count = status_counts.get(TaskStatus.IN_PROGRESS, 0)
+        completed_count = status_counts.get(TaskStatus.COMPLETED, 0)
+        cancelled_count = status_counts.get(TaskStatus.CANCELLED, 0)
+        failed_count = status_counts.get(TaskStatus.ERROR, 0)
+
+        # 列表视图不返回原始 gmetadata，需要时通过任务详情接口获取
+        list_tasks = [enrich_task_data(t, current_app) for t in db_tasks]
+
+        counts = {
+            'all': all_count,
+            'in-progress': in_progress_count,
+            'completed': completed_count,
+            'cancelled': cancelled_count,
+            'failed': failed_count
+        }
 
-        return json_response({
-            'tasks': [enrich_task_data(t, current_app) for t in db_tasks],
+        if keyset_mode:
+            return with_etag(json_response({
+                'tasks': list_tasks,
+                'total': counts.get(status_filter, all_count) if status_filter else all_count,
+                'page_size': page_size,
+                'next_cursor': encode_cursor(next_cursor) if next_cursor else None,
+                'has_more': next_cursor is not None,
+                'status_counts': counts
+            }), etag)
+
+        return with_etag(json_response({
+            'tasks': list_tasks,
             'total': total,
             'page': page,
             'page_size': page_size,
             'total_pages': (total + page_size - 1) // page_size,
-            'status_counts': {
-                'all': all_count,
-                'in-progress': in_progress_count,
-                'completed': completed_count,
-                'cancelled': cancelled_count,
-                'failed': failed_count
-            }
-        })
+            'status_counts': counts
+        }), etag)
 
     except Exception as e:
         if global_logger:
@@ -835,6 +919,36 @@ def get_movable_tasks():
             global_logger.error(f"Error getting movable tasks: {e}")
         return json_response({'error': f'Failed to get movable tasks: {str(e)}'}), 500
 
+def get_gallery_tool(url, config, logger=None):
+    """按链接所属站点返回对应的画廊工具，E-Hentai 使用全局共享的 EH_TOOLS（未初始化时为 None）"""
+    if 'nhentai.net' in url:
+        from providers import nhentai
+        return nhentai.NHentaiTools(cookie=config.get('NHENTAI_COOKIE'), logger=logger)
+    elif 'hitomi.la' in url:
+        from providers import hitomi
+        return hitomi.HitomiTools(logger=logger)
+    elif 'hdoujin.org' in url:
+        from providers import hdoujin
+        return hdoujin.HDoujinTools(
+            session_token=config.get('HDOUJIN_SESSION_TOKEN'),
+            refresh_token=config.get('HDOUJIN_REFRESH_TOKEN'),
+            clearance_token=config.get('HDOUJIN_CLEARANCE_TOKEN'),
+            user_agent=config.get('HDOUJIN_USER_AGENT'),
+            logger=logger
+        )
+    return config.get('EH_TOOLS')
+
+def apply_refreshed_gmetadata(task_id, gmetadata, config, logger=None):
+    """保存重新获取的 gmetadata 并更新封面"""
+    from database import task_db
+    updates = {'metadata': gmetadata}
+    raw_cover_url = gmetadata.get('thumb') or gmetadata.get('thumbnail_url')
+    if raw_cover_url:
+        from utils import download_cover
+        cover_url = download_cover(raw_cover_url, task_id, config, logger)
+        updates['cover_url'] = cover_url
+    task_db.update_task(task_id, **updates)
+
 @bp.route('/api/tasks/<task_id>/refresh-gmetadata', methods=['POST'])
 def refresh_task_gmetadata(task_id):
     """从网络重新获取最新的 gmetadata.json"""
@@ -844,48 +958,21 @@ def refresh_task_gmetadata(task_id):
         task_info = task_db.get_task(task_id)
         if not task_info:
             return json_response({'error': 'Task not found'}), 404
-            
+
         url = task_info.get('url')
         if not url:
             return json_response({'error': 'Task has no url'}), 400
-            
-        is_nhentai = 'nhentai.net' in url
-        is_hitomi = 'hitomi.la' in url
-        is_hdoujin = 'hdoujin.org' in url
-
-        if is_nhentai:
-            from providers import nhentai
-            gallery_tool = nhentai.NHentaiTools(cookie=current_app.config.get('NHENTAI_COOKIE'), logger=global_logger)
-        elif is_hitomi:
-            from providers import hitomi
-            gallery_tool = hitomi.HitomiTools(logger=global_logger)
-        elif is_hdoujin:
-            from providers import hdoujin
-            gallery_tool = hdoujin.HDoujinTools(
-                session_token=current_app.config.get('HDOUJIN_SESSION_TOKEN'),
-                refresh_token=current_app.config.get('HDOUJIN_REFRESH_TOKEN'),
-                clearance_token=current_app.config.get('HDOUJIN_CLEARANCE_TOKEN'),
-                user_agent=current_app.config.get('HDOUJIN_USER_AGENT'),
-                logger=global_logger
-            )
-        else:
-            gallery_tool = current_app.config.get('EH_TOOLS')
-            if not gallery_tool:
-                 return json_response({'error': 'EH_TOOLS not initialized'}), 500
 
-        gmetadata = gallery_tool.get_gmetadata(url)
+        gallery_tool = get_gallery_tool(url, current_app.config, global_logger)
+        if not gallery_tool:
+             return json_response({'error': 'EH_TOOLS not initialized'}), 500
+
+        gmetadata = gallery_tool.get_gmetadata(url, refresh=True)
         if not gmetadata:
              return json_response({'error': 'Failed to get gmetadata from network'}), 500
-             
-        updates = {'metadata': gmetadata}
-        raw_cover_url = gmetadata.get('thumb') or gmetadata.get('thumbnail_url')
-        if raw_cover_url:
-            from utils import download_cover
-            cover_url = download_cover(raw_cover_url, task_id, current_app.config, global_logger)
-            updates['cover_url'] = cover_url
-            
-        task_db.update_task(task_id, **updates)
-        
+
+        apply_refreshed_gmetadata(task_id, gmetadata, current_app.config, global_logger)
+
         updated_task = task_db.get_task(task_id)
         return json_response({'message': 'gmetadata refreshed and cover updated successfully', 'task': enrich_task_data(updated_task, current_app)})
         
@@ -894,6 +981,82 @@ def refresh_task_gmetadata(task_id):
             global_logger.error(f"Error refreshing gmetadata for task {task_id}: {e}")
         return json_response({'error': f'Failed to refresh gmetadata: {str(e)}'}), 500
 
+@bp.route('/api/tasks/refresh-gmetadata', methods=['POST'])
+def refresh_tasks_gmetadata():
+    """
+    批量重新获取多个任务的 gmetadata
+
+    请求体为 {"task_ids": [...]}，E-Hentai 任务通过 gdata API 批量查询（每次请求最多 25 个画廊），
+    其他站点逐个获取；返回成功刷新的任务 ID 列表和失败原因
+    """
+    global_logger = current_app.config.get('GLOBAL_LOGGER')
+    try:
+        from database import task_db
+        data = request.get_json() or {}
+        task_ids = data.get('task_ids')
+        if not isinstance(task_ids, list) or not task_ids:
+            return json_response({'error': 'No task_ids provided'}), 400
+
+        refreshed = []
+        failed = {}
+        eh_urls = {}
+        for task_id in dict.fromkeys(str(task_id) for task_id in task_ids):
+            task_info = task_db.get_task(task_id)
+            if not task_info:
+                failed[task_id] = 'Task not found'
+                continue
+            url = task_info.get('url')
+            if not url:
+                failed[task_id] = 'Task has no url'
+                continue
+            if any(site in url for site in ('nhentai.net', 'hitomi.la', 'hdoujin.org')):
+                try:
+                    gmetadata = get_gallery_tool(url, current_app.config, global_logger).get_gmetadata(url, refresh=True)
+                except Exception as e:
+                    gmetadata = None
+                    if global_logger:
+                        global_logger.warning(f"Error refreshing gmetadata for task {task_id}: {e}")
+                if gmetadata:
+                    apply_refreshed_gmetadata(task_id, gmetadata, current_app.config, global_logger)
+                    refreshed.append(task_id)
+                else:
+                    failed[task_id] = 'Failed to get gmetadata from network'
+            else:
+                eh_urls[task_id] = url
+
+        if eh_urls:
+            eh_tools = current_app.config.get('EH_TOOLS')
+            results = eh_tools.get_gmetadata_batch(eh_urls.values()) if eh_tools else {}
+            for task_id, url in eh_urls.items():
+                gmetadata = results.get(url)
+                if not eh_tools:
+                    failed[task_id] = 'EH_TOOLS not initialized'
+                elif not gmetadata or 'error' in gmetadata:
+                    failed[task_id] = (gmetadata or {}).get('error') or 'Failed to get gmetadata from network'
+                else:
+                    apply_refreshed_gmetadata(task_id, gmetadata, current_app.config, global_logger)
+                    refreshed.append(task_id)
+
+        return json_response({'refreshed': refreshed, 'failed': failed})
+
+    except Exception as e:
+        if global_logger:
+            global_logger.error(f"Error refreshing gmetadata in bulk: {e}")
+        return json_response({'error': f'Failed to refresh gmetadata: {str(e)}'}), 500
+
+@bp.route('/api/gmetadata-cache', methods=['DELETE'])
+def clear_gmetadata_cache():
+    """清空 gmetadata 缓存"""
+    global_logger = current_app.config.get('GLOBAL_LOGGER')
+    try:
+        import metadata_cache
+        deleted = metadata_cache.invalidate()
+        return json_response({'message': f'Cleared {deleted} cached gmetadata entries', 'deleted': deleted})
+    except Exception as e:
+        if global_logger:
+            global_logger.error(f"Error clearing gmetadata cache: {e}")
+        return json_response({'error': f'Failed to clear gmetadata cache: {str(e)}'}), 500
+
 @bp.route('/api/tasks/<task_id>/generate-comicinfo', methods=['GET'])
 def generate_comicinfo_from_metadata(task_id):
     """从数据库的原始 metadata（gmetadata）通过格式化和模板渲染生成 comicinfo"""
@@ -939,6 +1102,100 @@ def generate_comicinfo_from_metadata(task_id):
             global_logger.error(f"Error generating comicinfo for task {task_id}: {e}")
         return json_response({'error': f'Failed to generate comicinfo: {str(e)}'}), 500
 
+class TaskOperationError(Exception):
+    """任务文件操作失败，status_code 为对应接口返回的 HTTP 状态码"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def save_task_comicinfo(task_id, task_info, data, config, logger=None):
+    """
+    将编辑后的元数据保存为任务的 comicinfo，ComicInfo 字段有变化（或上次打包失败/待处理）时同时更新 CBZ 中的 ComicInfo.xml
+
+    返回 (repack_status, last_error)
+    """
+    from database import task_db
+    import os
+    import cbztool
+
+    # 移除之前的 SourceURL 逻辑，使用更符合 ComicInfo 规范的 Web 字段
+
+    # 定义所有支持的 ComicInfo 标准字段
+    key_map = {
+        'agerating': 'AgeRating', 'languageiso': 'LanguageISO',
+        'alternateseries': 'AlternateSeries', 'alternatenumber': 'AlternateNumber',
+        'storyarc': 'StoryArc', 'storyarcnumber': 'StoryArcNumber',
+        'seriesgroup': 'SeriesGroup', 'coverartist': 'CoverArtist',
+        'gtin': 'GTIN', 'number': 'Number', 'series': 'Series',
+        'title': 'Title', 'writer': 'Writer', 'penciller': 'Penciller',
+        'translator': 'Translator', 'tags': 'Tags', 'web': 'Web',
+        'manga': 'Manga', 'genre': 'Genre', 'summary': 'Summary',
+        'publisher': 'Publisher'
+    }
+    
+    # 允许修改并写入的字段，不再严格依赖 config.yaml，而是开放所有支持的规范字段
+    # 这样用户在前端手动编辑如 SeriesGroup, Summary 时才能生效
+    allowed_keys = set(key_map.values())
+
+    # 检查这些需要在 ComicInfo.xml 中写入的字段是否真的发生了变化
+    old_metadata = task_info.get('comicinfo') or {}
+    pending_changes_diff = {}
+    for key in allowed_keys:
+        if key not in data and key not in old_metadata:
+            continue
+        new_val = data.get(key)
+        old_val = old_metadata.get(key)
+        
+        # 将 None 和空字符串等同处理，避免因为空值类型不一致误触发打包
+        new_val_str = str(new_val).strip() if new_val is not None else ""
+        old_val_str = str(old_val).strip() if old_val is not None else ""
+        if new_val_str != old_val_str:
+            pending_changes_diff[key] = new_val
+
+    # 尝试自动进行重新打包物理文件
+    cbz_path = task_info.get('output_path')
+    
+    # 默认设定：不需要或成功打包
+    pending_changes = {}
+    repack_status = 'completed'
+    last_error = None
+    
+    # 性能优化：如果数据有差异，或者上一次打包状态是失败/待处理（比如之前文件丢失现在修复了），则强制执行打包
+    needs_repack = bool(pending_changes_diff) or task_info.get('repack_status') in ['failed', 'pending']
+
+    if needs_repack and cbz_path and os.path.exists(cbz_path):
+        # 将新数据按照白名单过滤，只写入配置允许的字段到 ComicInfo.xml
+        filtered_metadata = {k: v for k, v in data.items() if k in allowed_keys}
+        try:
+            # 临时标记重新打包中，以便有据可查
+            task_db.update_task(task_id, repack_status='in_progress')
+            result = cbztool.update_comicinfo_in_cbz(cbz_path, filtered_metadata, logger=logger,
+                                                     deflate_formats=config.get('CBZ_DEFLATE_FORMATS'))
+            if not result:
+                pending_changes = pending_changes_diff
+                repack_status = 'failed'
+                last_error = '写入 ComicInfo.xml 失败'
+        except Exception as e:
+            pending_changes = pending_changes_diff
+            repack_status = 'failed'
+            last_error = f'自动打包失败: {str(e)}'
+    elif needs_repack and cbz_path:
+        # 有 output_path 但文件不存在，此时无法打包
+        pending_changes = pending_changes_diff
+        repack_status = 'failed'
+        last_error = f'物理文件不存在，无法打包: {cbz_path}'
+
+    # 将提交的数据保存为 comicinfo
+    task_db.update_task(
+        task_id,
+        comicinfo=data,
+        pending_changes=pending_changes,
+        repack_status=repack_status,
+        last_error=last_error
+    )
+
+    return repack_status, last_error
+
 @bp.route('/api/tasks/<task_id>/metadata', methods=['PATCH'])
 def update_task_metadata(task_id):
     """更新任务的元数据（保存编辑结果到 comicinfo 和 pending_changes）"""
@@ -955,83 +1212,8 @@ def update_task_metadata(task_id):
         task_info = task_db.get_task(task_id)
         if not task_info:
             return json_response({'error': 'Task not found'}), 404
-            
-        # 移除之前的 SourceURL 逻辑，使用更符合 ComicInfo 规范的 Web 字段
-
-        # 定义所有支持的 ComicInfo 标准字段
-        key_map = {
-            'agerating': 'AgeRating', 'languageiso': 'LanguageISO',
-            'alternateseries': 'AlternateSeries', 'alternatenumber': 'AlternateNumber',
-            'storyarc': 'StoryArc', 'storyarcnumber': 'StoryArcNumber',
-            'seriesgroup': 'SeriesGroup', 'coverartist': 'CoverArtist',
-            'gtin': 'GTIN', 'number': 'Number', 'series': 'Series',
-            'title': 'Title', 'writer': 'Writer', 'penciller': 'Penciller',
-            'translator': 'Translator', 'tags': 'Tags', 'web': 'Web',
-            'manga': 'Manga', 'genre': 'Genre', 'summary': 'Summary',
-            'publisher': 'Publisher'
-        }
-        
-        # 允许修改并写入的字段，不再严格依赖 config.yaml，而是开放所有支持的规范字段
-        # 这样用户在前端手动编辑如 SeriesGroup, Summary 时才能生效
-        allowed_keys = set(key_map.values())
-
-        # 检查这些需要在 ComicInfo.xml 中写入的字段是否真的发生了变化
-        old_metadata = task_info.get('comicinfo') or {}
-        pending_changes_diff = {}
-        for key in allowed_keys:
-            if key not in data and key not in old_metadata:
-                continue
-            new_val = data.get(key)
-            old_val = old_metadata.get(key)
-            
-            # 将 None 和空字符串等同处理，避免因为空值类型不一致误触发打包
-            new_val_str = str(new_val).strip() if new_val is not None else ""
-            old_val_str = str(old_val).strip() if old_val is not None else ""
-            if new_val_str != old_val_str:
-                pending_changes_diff[key] = new_val
-
-        # 尝试自动进行重新打包物理文件
-        import os
-        import cbztool
-        cbz_path = task_info.get('output_path')
-        
-        # 默认设定：不需要或成功打包
-        pending_changes = {}
-        repack_status = 'completed'
-        last_error = None
-        
-        # 性能优化：如果数据有差异，或者上一次打包状态是失败/待处理（比如之前文件丢失现在修复了），则强制执行打包
-        needs_repack = bool(pending_changes_diff) or task_info.get('repack_status') in ['failed', 'pending']
-
-        if needs_repack and cbz_path and os.path.exists(cbz_path):
-            # 将新数据按照白名单过滤，只写入配置允许的字段到 ComicInfo.xml
-            filtered_metadata = {k: v for k, v in data.items() if k in allowed_keys}
-            try:
-                # 临时标记重新打包中，以便有据可查
-                task_db.update_task(task_id, repack_status='in_progress')
-                result = cbztool.update_comicinfo_in_cbz(cbz_path, filtered_metadata, logger=global_logger)
-                if not result:
-                    pending_changes = pending_changes_diff
-                    repack_status = 'failed'
-                    last_error = '写入 ComicInfo.xml 失败'
-            except Exception as e:
-                pending_changes = pending_changes_diff
-                repack_status = 'failed'
-                last_error = f'自动打包失败: {str(e)}'
-        elif needs_repack and cbz_path:
-            # 有 output_path 但文件不存在，此时无法打包
-            pending_changes = pending_changes_diff
-            repack_status = 'failed'
-            last_error = f'物理文件不存在，无法打包: {cbz_path}'
 
-        # 将提交的数据保存为 comicinfo
-        task_db.update_task(
-            task_id,
-            comicinfo=data,
-            pending_changes=pending_changes,
-            repack_status=repack_status,
-            last_error=last_error
-        )
+        repack_status, _ = save_task_comicinfo(task_id, task_info, data, current_app.config, global_logger)
 
         if global_logger:
             global_logger.info(f"Task {task_id} metadata saved and repack executed (status: {repack_status})")
@@ -1072,85 +1254,93 @@ def update_task_metadata(task_id):
             global_logger.error(f"Error updating task metadata {task_id}: {e}")
         return json_response({'error': f'Failed to update metadata: {str(e)}'}), 500
 
+def repack_task_file(task_id, config, logger=None):
+    """使用任务 comicinfo 中的元数据更新 CBZ 中的 ComicInfo.xml，返回 CBZ 路径，失败时抛出 TaskOperationError"""
+    from database import task_db
+    import os
+    import cbztool
+
+    # 检查任务是否存在
+    task_info = task_db.get_task(task_id)
+    if not task_info:
+        raise TaskOperationError('Task not found', 404)
+
+    # 检查是否有 comicinfo
+    comicinfo = task_info.get('comicinfo')
+    if not comicinfo:
+        raise TaskOperationError('No comicinfo available. Save metadata first.', 400)
+
+    # 确定要操作的文件路径
+    cbz_path = task_info.get('output_path')
+    if not cbz_path:
+        raise TaskOperationError('No output_path set for this task', 400)
+
+    if not os.path.exists(cbz_path):
+        task_db.update_task(task_id, repack_status='failed', last_error=f'文件不存在: {cbz_path}')
+        raise TaskOperationError(f'CBZ file does not exist: {cbz_path}', 404)
+
+    # 标记重新打包进行中
+    task_db.update_task(task_id, repack_status='in_progress')
+
+    # 根据 config 中的 comicinfo 配置白名单过滤元数据，避免把物理属性（如默认不写入的 Series）误写进 ComicInfo.xml
+    comicinfo_config = config.get('COMICINFO', {}) or {}
+    key_map = {
+        'agerating': 'AgeRating',
+        'languageiso': 'LanguageISO',
+        'alternateseries': 'AlternateSeries',
+        'alternatenumber': 'AlternateNumber',
+        'storyarc': 'StoryArc',
+        'storyarcnumber': 'StoryArcNumber',
+        'seriesgroup': 'SeriesGroup',
+        'coverartist': 'CoverArtist',
+        'gtin': 'GTIN',
+        'number': 'Number',
+        'series': 'Series',
+        'title': 'Title',
+        'writer': 'Writer',
+        'penciller': 'Penciller',
+        'translator': 'Translator',
+        'tags': 'Tags',
+        'web': 'Web',
+        'manga': 'Manga',
+        'genre': 'Genre',
+        'publisher': 'Publisher'
+    }
+    allowed_keys = set()
+    for k in comicinfo_config.keys():
+        allowed_keys.add(key_map.get(k.lower(), k.capitalize()))
+        
+    filtered_metadata = {k: v for k, v in comicinfo.items() if k in allowed_keys}
+
+    # 执行重新打包（仅替换 ComicInfo.xml）
+    result = cbztool.update_comicinfo_in_cbz(cbz_path, filtered_metadata, logger=logger,
+                                             deflate_formats=config.get('CBZ_DEFLATE_FORMATS'))
+
+    if not result:
+        task_db.update_task(task_id, repack_status='failed', last_error='CBZ 更新失败')
+        raise TaskOperationError('Repack failed', 500)
+
+    # 成功：清除 pending_changes，更新状态
+    task_db.update_task(
+        task_id,
+        repack_status='completed',
+        pending_changes={},
+        last_error=None
+    )
+    if logger:
+        logger.info(f"Task {task_id} repack completed: {cbz_path}")
+    return result
+
 @bp.route('/api/tasks/<task_id>/repack', methods=['POST'])
 def repack_task(task_id):
     """重新打包任务的 CBZ 文件（使用 comicinfo 中的元数据更新 ComicInfo.xml）"""
     global_logger = current_app.config.get('GLOBAL_LOGGER')
     try:
-        from database import task_db
-        import cbztool
-
-        # 检查任务是否存在
-        task_info = task_db.get_task(task_id)
-        if not task_info:
-            return json_response({'error': 'Task not found'}), 404
-
-        # 检查是否有 comicinfo
-        comicinfo = task_info.get('comicinfo')
-        if not comicinfo:
-            return json_response({'error': 'No comicinfo available. Save metadata first.'}), 400
-
-        # 确定要操作的文件路径
-        cbz_path = task_info.get('output_path')
-        if not cbz_path:
-            return json_response({'error': 'No output_path set for this task'}), 400
-
-        import os
-        if not os.path.exists(cbz_path):
-            task_db.update_task(task_id, repack_status='failed', last_error=f'文件不存在: {cbz_path}')
-            return json_response({'error': f'CBZ file does not exist: {cbz_path}'}), 404
-
-        # 标记重新打包进行中
-        task_db.update_task(task_id, repack_status='in_progress')
-
-        # 根据 config 中的 comicinfo 配置白名单过滤元数据，避免把物理属性（如默认不写入的 Series）误写进 ComicInfo.xml
-        comicinfo_config = current_app.config.get('COMICINFO', {}) or {}
-        key_map = {
-            'agerating': 'AgeRating',
-            'languageiso': 'LanguageISO',
-            'alternateseries': 'AlternateSeries',
-            'alternatenumber': 'AlternateNumber',
-            'storyarc': 'StoryArc',
-            'storyarcnumber': 'StoryArcNumber',
-            'seriesgroup': 'SeriesGroup',
-            'coverartist': 'CoverArtist',
-            'gtin': 'GTIN',
-            'number': 'Number',
-            'series': 'Series',
-            'title': 'Title',
-            'writer': 'Writer',
-            'penciller': 'Penciller',
-            'translator': 'Translator',
-            'tags': 'Tags',
-            'web': 'Web',
-            'manga': 'Manga',
-            'genre': 'Genre',
-            'publisher': 'Publisher'
-        }
-        allowed_keys = set()
-        for k in comicinfo_config.keys():
-            allowed_keys.add(key_map.get(k.lower(), k.capitalize()))
-            
-        filtered_metadata = {k: v for k, v in comicinfo.items() if k in allowed_keys}
-
-        # 执行重新打包（仅替换 ComicInfo.xml）
-        result = cbztool.update_comicinfo_in_cbz(cbz_path, filtered_metadata, logger=global_logger)
-
-        if result:
-            # 成功：清除 pending_changes，更新状态
-            task_db.update_task(
-                task_id,
-                repack_status='completed',
-                pending_changes={},
-                last_error=None
-            )
-            if global_logger:
-                global_logger.info(f"Task {task_id} repack completed: {cbz_path}")
-            return json_response({'message': 'Repack completed successfully', 'output_path': result})
-        else:
-            task_db.update_task(task_id, repack_status='failed', last_error='CBZ 更新失败')
-            return json_response({'error': 'Repack failed'}), 500
+        result = repack_task_file(task_id, current_app.config, global_logger)
+        return json_response({'message': 'Repack completed successfully', 'output_path': result})
 
+    except TaskOperationError as e:
+        return json_response({'error': str(e)}), e.status_code
     except Exception as e:
         if global_logger:
             global_logger.error(f"Error repacking task {task_id}: {e}")
@@ -1202,103 +1392,252 @@ def get_task_move_path(task_id):
             global_logger.error(f"Error calculating task move path {task_id}: {e}")
         return json_response({'error': f'Failed to calculate move path: {str(e)}'}), 500
 
+def trigger_komga_scan(config, logger=None, reason='file move'):
+    """启用了 Komga 时触发一次媒体库扫描，reason 仅用于日志"""
+    komga_toggle = config.get('KOMGA_TOGGLE', False)
+    komga_library_id = config.get('KOMGA_LIBRARY_ID', '')
+    if komga_toggle and komga_library_id:
+        try:
+            from providers import komga
+            kmg = komga.KomgaAPI(
+                server=config['KOMGA_SERVER'],
+                username=config['KOMGA_USERNAME'],
+                password=config['KOMGA_PASSWORD'],
+                logger=logger
+            )
+            kmg.scan_library(komga_library_id)
+            if logger:
+                logger.info(f"Triggered Komga library scan after {reason}")
+        except Exception as scan_err:
+            if logger:
+                logger.warning(f"Failed to trigger Komga scan: {scan_err}")
+
+# 正在移动中的目标路径，防止并发移动（如批量任务）的两个任务同时写入同一目标
+_moving_targets = set()
+_moving_targets_lock = threading.Lock()
+
+def move_task_output(task_id, app, target_path=None, logger=None):
+    """
+    移动任务的输出文件，target_path 为空时按移动模板计算目标路径（不触发 Komga 扫描）
+
+    返回 (输出路径, 是否移动了文件)，失败时抛出 TaskOperationError；目标文件已存在时不覆盖（409）
+    """
+    from database import task_db
+    from utils_move import calculate_task_move_path
+    import os
+    import shutil
+
+    # 检查任务是否存在
+    task_info = task_db.get_task(task_id)
+    if not task_info:
+        raise TaskOperationError('Task not found', 404)
+
+    if not target_path:
+        target_path = calculate_task_move_path(task_info, app, logger=logger)
+        if not target_path:
+            raise TaskOperationError('No target_path provided and automatic path calculation failed', 400)
+
+    # 确定源文件路径
+    source_path = task_info.get('output_path')
+    if not source_path:
+        raise TaskOperationError('No output_path set for this task', 400)
+
+    if not os.path.exists(source_path):
+        task_db.update_task(task_id, move_status='failed', last_error=f'源文件不存在: {source_path}')
+        raise TaskOperationError(f'Source file does not exist: {source_path}', 404)
+
+    # 检查源路径和目标路径是否一致
+    if os.path.normpath(source_path) == os.path.normpath(target_path):
+        task_db.update_task(task_id, move_status='completed', last_error=None)
+        return source_path, False
+
+    # 目标已存在（或正被其他任务移入）时不覆盖：同一文件系统内 shutil.move 即 os.rename，会直接替换已有文件
+    target_key = os.path.normcase(os.path.abspath(target_path))
+    with _moving_targets_lock:
+        conflict = target_key in _moving_targets or (
+            os.path.exists(target_path) and not os.path.samefile(source_path, target_path)
+        )
+        if not conflict:
+            _moving_targets.add(target_key)
+    if conflict:
+        error = f'目标文件已存在: {target_path}'
+        task_db.update_task(task_id, move_status='failed', last_error=error)
+        raise TaskOperationError(f'Target file already exists: {target_path}', 409)
+
+    # 标记移动进行中
+    task_db.update_task(task_id, move_status='in_progress')
+
+    try:
+        # 确保目标目录存在
+        target_dir = os.path.dirname(target_path)
+        if target_dir:
+            os.makedirs(target_dir, exist_ok=True)
+
+        # 移动文件
+        shutil.move(source_path, target_path)
+
+        # 更新数据库
+        task_db.update_task(
+            task_id,
+            output_path=target_path,
+            target_path=target_path,
+            move_status='completed',
+            last_error=None
+        )
+    except Exception as move_err:
+        task_db.update_task(task_id, move_status='failed', last_error=str(move_err))
+        raise move_err
+    finally:
+        with _moving_targets_lock:
+            _moving_targets.discard(target_key)
+
+    if logger:
+        logger.info(f"Task {task_id} file moved: {source_path} -> {target_path}")
+    return target_path, True
+
 @bp.route('/api/tasks/<task_id>/move', methods=['POST'])
 def move_task_file(task_id):
     """移动任务的输出文件到新路径"""
     global_logger = current_app.config.get('GLOBAL_LOGGER')
     try:
-        from database import task_db
-        from utils_move import calculate_task_move_path
-        import os
-        import shutil
-
-        # 检查任务是否存在
-        task_info = task_db.get_task(task_id)
-        if not task_info:
-            return json_response({'error': 'Task not found'}), 404
-
         # 获取请求体，支持自动计算目标路径
         data = request.get_json() or {}
-        target_path = data.get('target_path')
-        
-        if not target_path:
-            target_path = calculate_task_move_path(task_info, current_app, logger=global_logger)
-            if not target_path:
-                return json_response({'error': 'No target_path provided and automatic path calculation failed'}), 400
-
-        # 确定源文件路径
-        source_path = task_info.get('output_path')
-        if not source_path:
-            return json_response({'error': 'No output_path set for this task'}), 400
-
-        if not os.path.exists(source_path):
-            task_db.update_task(task_id, move_status='failed', last_error=f'源文件不存在: {source_path}')
-            return json_response({'error': f'Source file does not exist: {source_path}'}), 404
-
-        # 检查源路径和目标路径是否一致
-        if os.path.normpath(source_path) == os.path.normpath(target_path):
-            task_db.update_task(task_id, move_status='completed', last_error=None)
+        output_path, moved = move_task_output(
+            task_id, current_app._get_current_object(), data.get('target_path'), logger=global_logger
+        )
+        if not moved:
             return json_response({
                 'message': 'Source and target paths are identical. No movement required.',
-                'output_path': source_path
+                'output_path': output_path
             })
 
-        # 标记移动进行中
-        task_db.update_task(task_id, move_status='in_progress')
+        # 如果启用了 Komga，触发媒体库扫描
+        trigger_komga_scan(current_app.config, global_logger)
 
-        try:
-            # 确保目标目录存在
-            target_dir = os.path.dirname(target_path)
-            if target_dir:
-                os.makedirs(target_dir, exist_ok=True)
-
-            # 移动文件
-            shutil.move(source_path, target_path)
-
-            # 更新数据库
-            task_db.update_task(
-                task_id,
-                output_path=target_path,
-                target_path=target_path,
-                move_status='completed',
-                last_error=None
-            )
+        return json_response({
+            'message': 'File moved successfully',
+            'output_path': output_path
+        })
 
-            if global_logger:
-                global_logger.info(f"Task {task_id} file moved: {source_path} -> {target_path}")
+    except TaskOperationError as e:
+        return json_response({'error': str(e)}), e.status_code
+    except Exception as e:
+        if global_logger:
+            global_logger.error(f"Error moving task file {task_id}: {e}")
+        return json_response({'error': f'Failed to move file: {str(e)}'}), 500
 
-            # 如果启用了 Komga，触发媒体库扫描
-            komga_toggle = current_app.config.get('KOMGA_TOGGLE', False)
-            komga_library_id = current_app.config.get('KOMGA_LIBRARY_ID', '')
-            if komga_toggle and komga_library_id:
-                try:
-                    from providers import komga
-                    kmg = komga.KomgaAPI(
-                        server=current_app.config['KOMGA_SERVER'],
-                        username=current_app.config['KOMGA_USERNAME'],
-                        password=current_app.config['KOMGA_PASSWORD'],
-                        logger=global_logger
-                    )
-                    kmg.scan_library(komga_library_id)
-                    if global_logger:
-                        global_logger.info(f"Triggered Komga library scan after file move")
-                except Exception as scan_err:
-                    if global_logger:
-                        global_logger.warning(f"Failed to trigger Komga scan: {scan_err}")
+# 批量作业支持的操作，按此顺序对每个任务执行
+BULK_ACTIONS = ('metadata', 'repack', 'move')
 
-            return json_response({
-                'message': 'File moved successfully',
-                'output_path': target_path
-            })
+def run_bulk_actions(task_id, actions, metadata, app, logger=None):
+    """批量作业中对单个任务依次执行 metadata、repack、move，返回是否修改了文件"""
+    from database import task_db
+    changed = False
+    if 'metadata' in actions:
+        task_info = task_db.get_task(task_id)
+        if not task_info:
+            raise TaskOperationError('Task not found', 404)
+        old_comicinfo = task_info.get('comicinfo') or {}
+        data = dict(old_comicinfo)
+        data.update(metadata)
+        repack_status, last_error = save_task_comicinfo(task_id, task_info, data, app.config, logger)
+        if repack_status == 'failed':
+            raise TaskOperationError(last_error or 'Repack failed', 500)
+        changed = data != old_comicinfo
+    if 'repack' in actions:
+        repack_task_file(task_id, app.config, logger)
+        changed = True
+    if 'move' in actions:
+        _, moved = move_task_output(task_id, app, logger=logger)
+        changed = changed or moved
+    return changed
+
+@bp.route('/api/tasks/bulk-jobs', methods=['POST'])
+def create_bulk_job():
+    """
+    创建批量作业：对多个任务执行 metadata（合并写入元数据并更新 ComicInfo.xml）、repack、move
+
+    请求体: {"actions": ["move"], "task_ids": [...]} 或用 "filter": {"status": ..., "search": ...} 选择任务，
+    metadata 操作需提供 "metadata": {...}。作业在后台线程池中执行，结束后只触发一次 Komga 媒体库扫描
+    """
+    global_logger = current_app.config.get('GLOBAL_LOGGER')
+    try:
+        from database import task_db
+        from bulk_jobs import bulk_jobs
+
+        data = request.get_json() or {}
+        actions = data.get('actions')
+        if isinstance(actions, str):
+            actions = [actions]
+        if not actions or not isinstance(actions, list) or any(action not in BULK_ACTIONS for action in actions):
+            return json_response({'error': f'actions must be a list of {", ".join(BULK_ACTIONS)}'}), 400
+        actions = [action for action in BULK_ACTIONS if action in actions]
+
+        metadata = data.get('metadata')
+        if 'metadata' in actions and (not isinstance(metadata, dict) or not metadata):
+            return json_response({'error': 'No metadata provided'}), 400
+
+        task_ids = data.get('task_ids')
+        task_filter = data.get('filter')
+        if task_ids is not None:
+            if not isinstance(task_ids, list):
+                return json_response({'error': 'task_ids must be a list'}), 400
+        elif isinstance(task_filter, dict):
+            from utils import TaskStatus
+            task_ids = task_db.get_task_ids(
+                status_filter=task_filter.get('status') or TaskStatus.COMPLETED,
+                search_query=(task_filter.get('search') or '').strip() or None
+            )
+        else:
+            return json_response({'error': 'No task_ids or filter provided'}), 400
 
-        except Exception as move_err:
-            task_db.update_task(task_id, move_status='failed', last_error=str(move_err))
-            raise move_err
+        app = current_app._get_current_object()
+
+        def on_finish(job):
+            if global_logger:
+                global_logger.info(f"Bulk job {job.id} finished: {job.succeeded} changed, "
+                                   f"{job.skipped} skipped, {job.failed} failed")
+            # 所有任务结束后合并为一次 Komga 扫描
+            if job.succeeded:
+                trigger_komga_scan(app.config, global_logger, reason=f"bulk job {job.id} ({', '.join(job.actions)})")
+
+        job = bulk_jobs.submit(
+            actions, task_ids,
+            lambda task_id: run_bulk_actions(task_id, actions, metadata, app, global_logger),
+            on_finish=on_finish
+        )
+        if global_logger:
+            global_logger.info(f"Bulk job {job.id} created: {', '.join(actions)} on {job.total} tasks")
+        return json_response({'job': job.to_dict()}), 202
 
     except Exception as e:
         if global_logger:
-            global_logger.error(f"Error moving task file {task_id}: {e}")
-        return json_response({'error': f'Failed to move file: {str(e)}'}), 500
+            global_logger.error(f"Error creating bulk job: {e}")
+        return json_response({'error': f'Failed to create bulk job: {str(e)}'}), 500
+
+@bp.route('/api/tasks/bulk-jobs', methods=['GET'])
+def list_bulk_jobs():
+    """获取最近的批量作业及其进度"""
+    from bulk_jobs import bulk_jobs
+    return json_response({'jobs': [job.to_dict() for job in bulk_jobs.list()]})
+
+@bp.route('/api/tasks/bulk-jobs/<job_id>', methods=['GET'])
+def get_bulk_job(job_id):
+    """获取批量作业的进度"""
+    from bulk_jobs import bulk_jobs
+    job = bulk_jobs.get(job_id)
+    if not job:
+        return json_response({'error': 'Bulk job not found'}), 404
+    return json_response({'job': job.to_dict()})
+
+@bp.route('/api/tasks/bulk-jobs/<job_id>/cancel', methods=['POST'])
+def cancel_bulk_job(job_id):
+    """取消批量作业：正在处理的任务会完成，尚未开始的任务被跳过"""
+    from bulk_jobs import bulk_jobs
+    job = bulk_jobs.cancel(job_id)
+    if not job:
+        return json_response({'error': 'Bulk job not found'}), 404
+    return json_response({'job': job.to_dict()})
 
 @bp.route('/api/tasks/<task_id>/read-cbz', methods=['POST'])
 def read_cbz_metadata(task_id):
@@ -52,7 +52,7 @@ def trigger_undownloaded_favorites_download(logger=None, config=None):
         try:
             logger.info(f"为新画廊创建下载任务: {url}")
             favcat_id = fav.get('favcat')
-            response = requests.get(f"{api_base_url}/api/download", params={"url": url, "fav": favcat_id, "download": "true"}, timeout=10)
+            response = requests.get(f"{api_base_url}/api/download", params={"url": url, "fav": favcat_id, "download": "true", "priority": "favorite"}, timeout=10)
             
             if response.status_code == 202:
                 logger.info(f"成功为 {url} 创建下载任务。")
@@ -355,6 +355,33 @@ def sync_komga_url_index_job():
             logger.error(f"同步 Komga URL 索引时发生错误: {e}", exc_info=True)
 
 
+def reconcile_task_status_counts_job():
+    """
+    定期校准任务状态计数表的调度任务。
+    状态计数由触发器实时维护，该任务按 tasks 表重新计算一次，防止计数出现偏差。
+    """
+    with scheduler.app.app_context():
+        logger = current_app.logger
+        drift = task_db.reconcile_status_counts()
+        if drift:
+            logger.warning(f"任务状态计数存在偏差，已重新校准: {drift}")
+
+
+def archive_tasks_job():
+    """
+    定期归档历史任务的调度任务。
+    将最后更新时间超过 general.archive_tasks_after 的任务移入压缩归档表，保持任务表精简。
+    """
+    with scheduler.app.app_context():
+        logger = current_app.logger
+        archive_after_hours = current_app.config.get('TASK_ARCHIVE_AFTER_HOURS')
+        if not archive_after_hours:
+            return
+        archived = task_db.archive_tasks(archive_after_hours)
+        if archived:
+            logger.info(f"已归档 {archived} 个历史任务")
+
+
 def update_scheduler_jobs(app):
     """
     根据当前应用配置更新调度器中的任务。
@@ -424,6 +451,39 @@ def update_scheduler_jobs(app):
         )
         app.logger.info("HDoujin Token 验证任务已添加，将每 24 小时运行一次。")
 
+        # 添加任务状态计数校准任务（每小时运行一次）
+        reconcile_job_id = 'reconcile_task_status_counts'
+        if scheduler.get_job(reconcile_job_id):
+            scheduler.remove_job(reconcile_job_id)
+
+        scheduler.add_job(
+            id=reconcile_job_id,
+            func=reconcile_task_status_counts_job,
+            trigger='interval',
+            hours=1,
+            misfire_grace_time=600
+        )
+
+        # 添加历史任务归档任务（每天运行一次）
+        archive_job_id = 'archive_tasks'
+        archive_after_hours = app.config.get('TASK_ARCHIVE_AFTER_HOURS')
+        existing_archive_job = scheduler.get_job(archive_job_id)
+
+        if existing_archive_job:
+            scheduler.remove_job(archive_job_id)
+
+        if archive_after_hours:
+            scheduler.add_job(
+                id=archive_job_id,
+                func=archive_tasks_job,
+                trigger='interval',
+                hours=24,
+                misfire_grace_time=3600
+            )
+            app.logger.info(f"历史任务归档任务已添加，最后更新超过 {archive_after_hours} 小时的任务将被归档。")
+        elif existing_archive_job:
+            app.logger.info("历史任务归档任务已禁用并移除。")
+
         # 添加 H@H 状态检查任务
         hath_job_id = 'check_hath_status'
         is_hath_enabled = app.config.get('HATH_CHECK_ENABLED', False)
@@ -0,0 +1,214 @@
+"""
+持久化下载队列
+下载任务提交时先写入数据库 task_queue 表，再由工作线程租约领取执行，
+执行期间心跳线程定期续约；应用重启后已领取但未结束的任务会重新排队并自动恢复执行
+
+领取时按下载来源（ehentai/nhentai/hitomi/hdoujin/aria2）限制并发槽位，
+并按优先级（手动提交 > 收藏夹自动下载 > 重试）和来源间公平轮转选择下一个任务
+
+执行函数返回 Future 时任务不再占用工作线程和来源槽位：AwaitingFuture 表示正在等待外部下载（aria2），
+其他 Future 表示已进入后处理流水线，Future 结束后任务才标记为完成
+"""
+import contextlib
+import logging
+import threading
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from utils import TaskStatus, JobState
+
+
+# 下载来源，对应配置文件 download 部分的槽位上限
+PROVIDERS = ('ehentai', 'nhentai', 'hitomi', 'hdoujin', 'aria2')
+
+# 任务优先级：数值越大越先执行
+PRIORITIES = {
+    'manual': 20,    # 手动提交
+    'favorite': 10,  # 收藏夹自动下载
+    'retry': 0,      # 重试
+}
+
+
+class AwaitingFuture(Future):
+    """执行函数返回此 Future 表示任务已挂起等待外部下载完成，由外部回调继续执行后续步骤"""
+
+
+class TaskQueue:
+    def __init__(self, db, max_workers: int = 5, provider_limits: Optional[Dict[str, int]] = None,
+                 lease_seconds: float = 60, heartbeat_interval: float = 15,
+                 poll_interval: float = 5, max_attempts: int = 3):
+        self.db = db
+        self.max_workers = max_workers
+        # 各下载来源的并发上限，未配置的来源只受 max_workers 限制
+        self.provider_limits = dict(provider_limits or {})
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        # 同一任务被领取的次数上限，防止每次执行都导致进程崩溃的任务被无限恢复
+        self.max_attempts = max_attempts
+        # 租约持有者标识，每个进程唯一
+        self.owner = uuid.uuid4().hex
+
+        # task_id -> Future：提交时创建，供取消接口和 TaskInfo 使用；重启后恢复的任务在领取时创建
+        self._futures: Dict[str, Future] = {}
+        self._futures_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopped = threading.Event()
+        self._handler: Optional[Callable] = None
+        # 正在运行的工作线程编号，编号不小于 max_workers 的线程在完成当前任务后退出
+        self._workers = set()
+        self._workers_lock = threading.Lock()
+        self._heartbeat = None
+
+    def submit(self, task_id: str, url: str, mode: Optional[str] = None, favcat: Optional[str] = None,
+               provider: Optional[str] = None, priority: str = 'manual') -> Future:
+        """
+        将下载任务写入持久化队列，返回在任务开始执行前可取消的 Future
+
+        provider 为下载来源（见 PROVIDERS），priority 为 PRIORITIES 中的键
+        """
+        future = Future()
+        with self._futures_lock:
+            self._futures[task_id] = future
+        if not self.db.enqueue_job(task_id, url, mode, favcat, provider, PRIORITIES.get(priority, 0)):
+            with self._futures_lock:
+                self._futures.pop(task_id, None)
+            raise RuntimeError(f"Failed to enqueue task {task_id}")
+        with self._wakeup:
+            self._wakeup.notify()
+        return future
+
+    @contextlib.contextmanager
+    def provider_slot(self, task_id: str, provider: str, check: Optional[Callable[[], None]] = None):
+        """
+        在执行函数之外占用下载来源槽位（如 aria2 种子失败后改由 hitomi/nhentai 兜底下载），槽位已满时等待
+
+        check 在每次等待前调用，可抛出异常中止等待（如任务已被取消）；退出时任务恢复原来源并进入后处理状态
+        """
+        limit = self.provider_limits.get(provider)
+        while True:
+            if check:
+                check()
+            claimed, previous = self.db.claim_job_slot(task_id, provider, limit)
+            if claimed:
+                break
+            with self._wakeup:
+                self._wakeup.wait(self.poll_interval)
+        try:
+            yield
+        finally:
+            self.db.set_job_state(task_id, JobState.PROCESSING, provider=previous)
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+    def start(self, handler: Callable[[Dict, Future], object]):
+        """
+        启动工作线程和心跳线程
+
+        handler(job, future) 负责执行领取到的任务，job 为 task_queue 中的记录
+        """
+        if self._heartbeat is not None:
+            return
+        self._handler = handler
+        self._stopped.clear()
+        self._spawn_workers()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='TaskQueueHeartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def configure(self, max_workers: Optional[int] = None, provider_limits: Optional[Dict[str, int]] = None):
+        """更新总工作线程数和各来源并发上限，已启动时立即按新的线程数增减工作线程"""
+        if provider_limits is not None:
+            self.provider_limits = dict(provider_limits)
+        if max_workers:
+            self.max_workers = max_workers
+        if self._handler is not None:
+            self._spawn_workers()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _spawn_workers(self):
+        with self._workers_lock:
+            for index in range(self.max_workers):
+                if index not in self._workers:
+                    self._workers.add(index)
+                    threading.Thread(target=self._worker_loop, args=(index,),
+                                     name=f'TaskQueueWorker-{index}', daemon=True).start()
+
+    def stop(self):
+        """停止领取新任务；正在执行的任务保持 running 状态，下次启动时重新排队"""
+        self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _worker_loop(self, index: int):
+        try:
+            while not self._stopped.is_set() and index < self.max_workers:
+                job = self.db.lease_job(self.owner, self.lease_seconds, self.provider_limits)
+                if job is None:
+                    with self._wakeup:
+                        self._wakeup.wait(self.poll_interval)
+                    continue
+                try:
+                    self._run(job)
+                except Exception as e:
+                    logging.error(f"Task queue worker failed to run job {job['task_id']}: {e}", exc_info=True)
+                    self.db.set_job_state(job['task_id'], JobState.DONE)
+                # 释放了一个来源槽位，唤醒因槽位已满而等待的线程
+                with self._wakeup:
+                    self._wakeup.notify_all()
+        finally:
+            with self._workers_lock:
+                self._workers.discard(index)
+
+    def _run(self, job: Dict):
+        task_id = job['task_id']
+        with self._futures_lock:
+            future = self._futures.pop(task_id, None) or Future()
+
+        # 排队期间已通过 Future 取消
+        if not future.set_running_or_notify_cancel():
+            self.db.set_job_state(task_id, JobState.DONE)
+            return
+
+        # 任务已被删除、取消或由其他途径结束
+        task = self.db.get_task(task_id)
+        if not task or task['status'] != TaskStatus.IN_PROGRESS:
+            future.set_result(None)
+            self.db.set_job_state(task_id, JobState.DONE)
+            return
+
+        if job['attempts'] > self.max_attempts:
+            error = f"任务已被中断 {job['attempts'] - 1} 次，不再自动恢复"
+            self.db.update_task(task_id, status=TaskStatus.ERROR, error=error)
+            future.set_result(None)
+            self.db.set_job_state(task_id, JobState.DONE)
+            return
+
+        self.db.set_job_state(task_id, JobState.RUNNING)
+        try:
+            result = self._handler(job, future)
+        except Exception as e:
+            self._finish(task_id, future, exception=e)
+            return
+
+        if isinstance(result, Future):
+            # 等待外部下载或下载已完成、封包/收尾在后处理流水线中继续：释放来源槽位，Future 结束后再标记完成
+            self.db.set_job_state(task_id, JobState.AWAITING if isinstance(result, AwaitingFuture) else JobState.PROCESSING)
+            def on_done(done: Future):
+                exception = done.exception()
+                self._finish(task_id, future, exception, None if exception else done.result())
+            result.add_done_callback(on_done)
+        else:
+            self._finish(task_id, future, result=result)
+
+    def _finish(self, task_id: str, future: Future, exception: Optional[BaseException] = None, result=None):
+        self.db.set_job_state(task_id, JobState.DONE)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            self.db.heartbeat_jobs(self.owner, self.lease_seconds)
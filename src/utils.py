@@ -1,4 +1,5 @@
 import os, json, re
+import base64
 import zipfile
 import unicodedata
 import logging
@@ -15,6 +16,16 @@ class TaskStatus(str, Enum):
     @classmethod
     def all(cls):
         return [item.value for item in cls]
+
+
+class JobState(str, Enum):
+    """持久化下载队列中任务的执行状态"""
+    QUEUED = "queued"    # 等待领取
+    LEASED = "leased"    # 已被工作线程领取（租约有效期内）
+    RUNNING = "running"  # 正在执行，工作线程定期续约
+    AWAITING = "awaiting"  # 等待外部下载（如 aria2 种子）完成，不占用工作线程和来源槽位
+    PROCESSING = "processing"  # 下载已完成，正在后处理流水线中封包/收尾（不占用来源槽位）
+    DONE = "done"        # 执行结束（成功、失败或取消）
     
 
 def json_output(data):
@@ -38,6 +49,23 @@ def json_response(data, status=200):
         mimetype="application/json"
     )
 
+def encode_cursor(values) -> str:
+    """将分页游标值（如 (created_at, id)）编码为不透明的 URL 安全字符串"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str, size: int = 2) -> tuple | None:
+    """解码 encode_cursor 生成的游标，格式不合法时返回 None"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return tuple(values)
+
 # 检查目录是否存在
 def check_dirs(path):
     if not os.path.exists(path):
@@ -1,6 +1,39 @@
 # src/utils_move.py
 import os
+import functools
 import jinja2
+import jinja2.meta
+
+
+@functools.lru_cache(maxsize=16)
+def _template_variables(template):
+    """模板中引用的变量名"""
+    return frozenset(jinja2.meta.find_undeclared_variables(jinja2.Environment().parse(template)))
+
+
+def move_path_needs_metadata(app, comicinfo):
+    """
+    判断渲染 MOVE_PATH 模板是否需要任务的原始 metadata：
+    模板引用的变量都能由 comicinfo（或 filename 等内置变量）提供时不需要，列表视图据此跳过读取和解码 gmetadata
+    """
+    move_path_template = app.config.get('MOVE_PATH')
+    if not move_path_template:
+        return False
+    try:
+        variables = set(_template_variables(move_path_template))
+    except jinja2.TemplateError:
+        return False
+    variables.discard('filename')
+    # series 只取自 comicinfo；author 优先取 penciller，comicinfo 中有 penciller 时不受 metadata 影响
+    variables.discard('series')
+    if 'author' in variables:
+        variables.discard('author')
+        variables.add('penciller')
+    provided = set()
+    for key in (comicinfo or {}):
+        provided.update((key, key.lower()))
+    return not variables <= provided
+
 
 def calculate_task_move_path(task_info, app, logger=None):
     """
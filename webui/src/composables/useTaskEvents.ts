@@ -0,0 +1,70 @@
+import { ref, onMounted, onUnmounted } from 'vue'
+
+export interface TaskDelta {
+  id: string
+  status?: string
+  error?: string | null
+  filename?: string | null
+  progress?: number
+  downloaded?: number
+  total_size?: number
+  speed?: number
+  log?: string[]
+  log_truncated?: boolean
+}
+
+type TaskEventListener = (deltas: TaskDelta[]) => void
+
+// 所有组件共享同一个 EventSource 连接
+const listeners = new Set<TaskEventListener>()
+const connected = ref(false)
+let source: EventSource | null = null
+
+const connect = () => {
+  source = new EventSource('/api/tasks/events')
+  source.onopen = () => {
+    connected.value = true
+  }
+  source.onerror = () => {
+    // EventSource 会自动重连，断开期间由调用方回退到轮询
+    connected.value = false
+  }
+  source.addEventListener('tasks', (event) => {
+    let deltas: TaskDelta[]
+    try {
+      deltas = JSON.parse((event as MessageEvent).data)
+    } catch (err) {
+      console.error('Failed to parse task events:', err)
+      return
+    }
+    listeners.forEach(listener => listener(deltas))
+  })
+}
+
+const disconnect = () => {
+  if (source) {
+    source.close()
+    source = null
+  }
+  connected.value = false
+}
+
+export function useTaskEvents(listener: TaskEventListener) {
+  onMounted(() => {
+    listeners.add(listener)
+    if (!source) {
+      connect()
+    }
+  })
+
+  onUnmounted(() => {
+    listeners.delete(listener)
+    if (listeners.size === 0) {
+      disconnect()
+    }
+  })
+
+  return {
+    connected
+  }
+}
@@ -1,5 +1,6 @@
 import { ref, onMounted, onUnmounted } from 'vue'
 import axios from 'axios'
+import { useTaskEvents } from './useTaskEvents'
 
 export interface TaskStats {
   total: number
@@ -34,6 +35,13 @@ export function useTaskStats() {
     refreshInterval.value = window.setInterval(fetchStats, 30000)
   }
 
+  // 有任务状态变化时立即刷新统计，轮询仅作为事件流断开时的兜底
+  useTaskEvents((deltas) => {
+    if (deltas.some(delta => delta.status !== undefined)) {
+      fetchStats()
+    }
+  })
+
   const stopAutoRefresh = () => {
     if (refreshInterval.value !== null) {
       clearInterval(refreshInterval.value)
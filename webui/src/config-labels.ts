@@ -13,6 +13,7 @@ export interface FieldLabel {
  */
 export const sectionLabels: Record<string, string> = {
     general: '通用',
+    download: '下载',
     advanced: '高级',
     ehentai: 'E-Hentai',
     nhentai: 'NHentai',
@@ -48,6 +49,54 @@ export const configLabels: Record<string, Record<string, FieldLabel>> = {
         move_path: {
             label: '完成后移动',
             description: '支持模板变量：{{author}}, {{series}}, {{title}}, {{filename}}, {{writer}}, {{penciller}}'
+        },
+        archive_tasks_after: {
+            label: '任务归档期限',
+            description: '任务最后更新超过该时长后移入压缩归档（如 90d），仍可通过 ID 或链接查找；留空则不归档'
+        },
+        gmetadata_cache_ttl: {
+            label: '元数据缓存有效期',
+            description: '重试、补抓元数据等操作在有效期内复用已获取的画廊元数据（如 7d）；手动刷新元数据会忽略缓存；留空则不缓存'
+        }
+    },
+
+    // ========== 下载配置 ==========
+    download: {
+        max_workers: {
+            label: '最大同时下载数',
+            description: '同时执行的下载任务总数'
+        },
+        ehentai: {
+            label: 'E-Hentai 并发上限',
+            description: 'E-Hentai/ExHentai 归档下载同时占用的槽位数'
+        },
+        nhentai: {
+            label: 'NHentai 并发上限',
+            description: 'NHentai 下载同时占用的槽位数'
+        },
+        hitomi: {
+            label: 'Hitomi 并发上限',
+            description: 'Hitomi 下载同时占用的槽位数'
+        },
+        hdoujin: {
+            label: 'HDoujin 并发上限',
+            description: 'HDoujin 下载同时占用的槽位数'
+        },
+        aria2: {
+            label: 'Aria2 种子并发上限',
+            description: '种子下载耗时较长，限制其占用的槽位以免阻塞其他下载'
+        },
+        package_workers: {
+            label: '封包进程数',
+            description: '下载完成后解压、检测广告页并重新打包的并行进程数，封包不占用下载槽位'
+        },
+        nhentai_page_workers: {
+            label: 'NHentai 并发页数',
+            description: '单个 NHentai 画廊同时下载的图片数，同一图片服务器的连接数和请求速率在所有任务间共享限制'
+        },
+        hitomi_page_workers: {
+            label: 'Hitomi 并发页数',
+            description: '单个 Hitomi 画廊同时下载的图片数，同一图片服务器的连接数和请求速率在所有任务间共享限制'
         }
     },
 
@@ -61,6 +110,10 @@ export const configLabels: Record<string, Record<string, FieldLabel>> = {
             label: '移除广告页',
             description: '自动检测并移除广告页面'
         },
+        cbz_deflate_formats: {
+            label: 'CBZ 压缩格式',
+            description: '打包 CBZ 时需要压缩的文件格式，其余文件（已压缩的图片）直接存储'
+        },
         aggressive_series_detection: {
             label: '激进的系列检测',
             description: '对 E-Hentai 的 AlternateSeries 字段进行更激进的检测'